@@ -1,2 +1,7 @@
 from .server import RpcServer
+from .async_server import AsyncRpcServer
+from .prefork import PreforkServer
+from .priority import PriorityExecutor
+from .client import RpcClient, AsyncRpcClient
+from .dispatch import rpc_method
 from .transport import *
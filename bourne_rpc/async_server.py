@@ -0,0 +1,387 @@
+import asyncio
+import functools
+import inspect
+import logging
+import socket
+
+from . import compression, exceptions, framing
+from .codecs import CODEC_JSON, EncodedResult
+from .connection import AsyncConnection
+from .notifications import DEFAULT_QUEUE_SIZE, AsyncNotificationExecutor
+from .pubsub import DEFAULT_SUBSCRIBER_QUEUE_SIZE, AsyncSubscriber
+from .streaming import DEFAULT_STREAM_CHUNK_SIZE, async_chunked, async_collect, chunk_message
+from .server import (DEFAULT_DRAIN_TIMEOUT, DEFAULT_MAX_INFLIGHT_PER_CONNECTION,
+                     BaseRpcServer, batch_response, error_response, is_notification,
+                     result_response)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRpcServer(BaseRpcServer):
+    """ JSON-RPC server handling all connections in a single asyncio event loop. It
+    speaks the same protocol (4 byte header followed by the message) as
+    :class:`RpcServer`, so existing clients can talk to both.
+
+    Methods of the served object can either be plain functions or coroutine
+    functions. Plain functions are called directly on the event loop and must
+    therefore not block, anything doing I/O should be written as `async def`. Events
+    have to be published on the event loop as well. """
+
+    def __init__(self, transport, obj, codecs=None, methods=None,
+                 notification_queue_size=DEFAULT_QUEUE_SIZE, pipelined=False,
+                 max_inflight_per_connection=DEFAULT_MAX_INFLIGHT_PER_CONNECTION,
+                 cache=None, subscriber_queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE,
+                 stream_chunk_size=DEFAULT_STREAM_CHUNK_SIZE, metrics=True,
+                 default_timeout=None, compressors=None,
+                 compression_threshold=compression.DEFAULT_COMPRESSION_THRESHOLD,
+                 max_frame_size=framing.DEFAULT_MAX_FRAME_SIZE):
+        """
+        :param transport: a bound socket based transport (e.g. a `UnixSocket` or a
+        `TcpSocket`), the listening socket of it is handed over to asyncio
+        :param obj: the object whose methods are served
+        :param codecs: see :class:`RpcServer`
+        :param methods: see :class:`RpcServer`
+        :param notification_queue_size: the maximum number of notifications pending,
+        further ones are dropped
+        :param pipelined: if True, every request of a connection runs in its own task
+        while reading goes on, responses are written as soon as they are ready
+        :param max_inflight_per_connection: the maximum number of pending requests of a
+        connection in pipelined mode, reading pauses while it is reached
+        :param cache: see :class:`RpcServer`
+        :param subscriber_queue_size: see :class:`RpcServer`
+        :param stream_chunk_size: see :class:`RpcServer`, methods may return async
+        iterators to be streamed as well
+        :param metrics: see :class:`RpcServer`
+        :param default_timeout: see :class:`RpcServer`. Coroutines running past their
+        deadline or getting cancelled are cancelled, plain functions can't be interrupted.
+        Cancelling requires `pipelined`, otherwise the cancel request is read only after
+        the response.
+        :param compressors: see :class:`RpcServer`
+        :param compression_threshold: see :class:`RpcServer`
+        :param max_frame_size: see :class:`RpcServer`
+        """
+        super().__init__(transport, obj, codecs, methods, cache, subscriber_queue_size,
+                         stream_chunk_size, metrics, default_timeout, compressors,
+                         compression_threshold, max_frame_size)
+        self.pipelined = pipelined
+        self.max_inflight_per_connection = max_inflight_per_connection
+        self.notifications = AsyncNotificationExecutor(queue_size=notification_queue_size)
+        self._server = None
+        self._queue_depth = 0
+        # connection -> the task of its handler
+        self._connections = {}
+
+    @property
+    def queue_depth(self):
+        """ the number of requests being handled """
+        return self._queue_depth
+
+    @property
+    def connection_count(self):
+        """ the number of connections currently served """
+        return len(self._connections)
+
+    async def start(self):
+        """ starts accepting connections on the event loop which is currently running """
+        # asyncio calls listen again on the socket, keeping the backlog of the transport
+        if self.transport.socket.family == getattr(socket, 'AF_UNIX', None):
+            start_server = asyncio.start_unix_server
+        else:
+            start_server = asyncio.start_server
+        self._server = await start_server(self.handler, sock=self.transport.socket,
+                                          backlog=socket.SOMAXCONN)
+
+    async def serve_forever(self):
+        """ starts the server and serves until it gets stopped """
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            logger.debug('serving got cancelled, that means this is a shutdown request')
+
+    def serve(self):
+        """ blocking counterpart of :meth:`RpcServer.serve`, runs a new event loop until
+        the server is stopped """
+        asyncio.run(self.serve_forever())
+
+    async def stop(self):
+        """ stops accepting new connections and closes the listening socket. Connections
+        are still served, see :meth:`shutdown`. """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def shutdown(self, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        stops the server gracefully, see :meth:`RpcServer.shutdown`. Handlers of
+        connections still busy after the drain timeout are cancelled.
+        :return: True if all requests in flight got answered
+        """
+        await self.stop()
+        for connection in list(self._connections):
+            connection.stop_reading()
+
+        handlers = list(self._connections.values())
+        drained = True
+        if handlers:
+            _, pending = await asyncio.wait(handlers, timeout=drain_timeout)
+            if pending:
+                drained = False
+                logger.warning('cancelling %s connections with requests in flight',
+                               len(pending))
+                for handler in pending:
+                    handler.cancel()
+                await asyncio.wait(pending)
+        await self.notifications.shutdown()
+        return drained
+
+    def new_subscriber(self, connection, codec):
+        return AsyncSubscriber(connection, codec, self.subscriber_queue_size)
+
+    async def handler(self, reader, writer):
+        """ handles a single connection until the client disconnects """
+        configure_connection = getattr(self.transport, 'configure_connection', None)
+        if configure_connection is not None:
+            configure_connection(writer.get_extra_info('socket'))
+        connection = AsyncConnection(writer, self.metrics)
+        inflight = asyncio.Semaphore(self.max_inflight_per_connection)
+        tasks = set()
+        self._connections[connection] = asyncio.current_task()
+        if self._server is not None and not self._server.is_serving():
+            # accepted while shutting down
+            connection.stop_reading()
+        try:
+            while 1:
+                try:
+                    raw_header = await reader.readexactly(framing.HEADER.size)
+                    header, = framing.HEADER.unpack(raw_header)
+                    payload = await reader.readexactly(
+                        framing.frame_length(header, self.max_frame_size))
+                    header, payload = framing.decompress_frame(
+                        header, payload, self.metrics, self.max_frame_size)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    logger.debug('connection closed')
+                    break
+                except ConnectionError as e:
+                    logger.warning('closing connection: %s', e)
+                    break
+                if self.metrics is not None:
+                    self.metrics.bytes_in += framing.HEADER.size + len(payload)
+
+                if self.pipelined:
+                    # stop reading while too many requests of this connection are pending
+                    await inflight.acquire()
+                    task = asyncio.ensure_future(self.respond(connection, header, payload))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: inflight.release())
+                else:
+                    await self.respond(connection, header, payload)
+
+            # the client might just have shut down its sending side
+            if tasks:
+                await asyncio.wait(list(tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            del self._connections[connection]
+            self.close_subscriber(connection)
+            connection.close()
+
+    async def respond(self, connection, header, payload):
+        """ handles a single message and writes the response """
+        codec = self.get_codec(header)
+        if codec is None:
+            codec = self.codecs[CODEC_JSON]
+            response_message = self.unknown_codec_response()
+        else:
+            self._queue_depth += 1
+            try:
+                response_message = await self.handle_message(codec, payload, connection)
+            finally:
+                self._queue_depth -= 1
+        if response_message is None:
+            # only notifications, nothing to answer
+            return
+
+        logger.debug('<-- %s', response_message)
+        await connection.send(response_message, framing.codec_flags(codec.codec_id))
+
+    async def handle_message(self, codec, payload, connection=None):
+        """ executes a single request or a batch and returns the encoded response
+        :param codec: the codec the request is encoded with
+        :param payload: the encoded request
+        :param connection: the `AsyncConnection` the request came from
+        :return: the encoded response
+        """
+        request_msg = self.decode_request(codec, payload)
+        if request_msg is None:
+            return codec.encode(error_response(None, exceptions.ERROR_PARSE, 'Parse error.'))
+
+        if isinstance(request_msg, list):
+            response = await self.handle_batch(request_msg, codec, connection)
+        else:
+            response = await self.handle_request(request_msg, codec, connection)
+        return self.encode_response(codec, response)
+
+    async def handle_batch(self, batch, codec, connection=None):
+        """
+        executes the requests of a batch concurrently on the event loop
+        :param codec: the codec the batch is encoded with
+        :param connection: the `AsyncConnection` the batch came from
+        :return: the list of responses in the order of the requests
+        """
+        if not batch:
+            return self.empty_batch_response()
+        return batch_response(await asyncio.gather(
+            *(self.handle_request(request_msg, codec, connection) for request_msg in batch)))
+
+    async def handle_request(self, request_msg, codec, connection=None):
+        """
+        executes a single request object, notifications are scheduled as tasks without
+        waiting for them. Results of cached methods are answered from the cache if
+        possible, single flight methods join an identical call in flight.
+        :param codec: the codec the response is going to be encoded with
+        :param connection: the `AsyncConnection` the request came from
+        :return: the response object, None for notifications
+        """
+        if self.is_builtin(request_msg):
+            return self.call_builtin(request_msg, codec, connection)
+
+        entry = started = None
+        try:
+            entry, args, kwargs = self.resolve(request_msg)
+            timeout = self.request_timeout(entry, request_msg)
+            if is_notification(request_msg):
+                if entry.streaming:
+                    self.notifications.submit(self._consume, entry.func, *args, **kwargs)
+                else:
+                    self.notifications.submit(entry.func, *args, **kwargs)
+                return None
+
+            started = self.start_timer()
+            cache_key = self.cache_key(entry, request_msg, codec)
+            if cache_key is not None:
+                data = self.cache.get(cache_key)
+                if data is not None:
+                    self.record_call(entry, started)
+                    return result_response(request_msg, EncodedResult(data))
+                generation = self.cache.generation
+            else:
+                generation = None
+
+            flight_key = self.flight_key(entry, request_msg, codec)
+            if flight_key is not None:
+                shared = self.flights.join(flight_key, functools.partial(
+                    self._start_shared, cache_key, entry, codec, generation, args,
+                    kwargs))
+                # shielded for every request, giving up waiting does not cancel the call
+                return_value = await self.wait_for(asyncio.shield(shared), entry,
+                                                   request_msg, connection, timeout)
+            else:
+                return_value = await self.call(entry, args, kwargs, request_msg, codec,
+                                               connection, timeout)
+                if cache_key is not None:
+                    return_value = self.cache_result(cache_key, entry, codec,
+                                                     return_value, generation)
+        except Exception as e:
+            if entry is not None:
+                self.record_call(entry, started, error=True)
+            return self.error_response_for(request_msg, e)
+        self.record_call(entry, started)
+        return result_response(request_msg, return_value)
+
+    async def call(self, entry, args, kwargs, request_msg, codec, connection=None,
+                   timeout=None):
+        """
+        executes a method in a task of its own, which is cancelled at the deadline or by
+        `rpc.cancel`
+        :param timeout: the number of seconds the method may take, None for no limit
+        :return: the result of the method
+        :raise RequestTimeoutError: if the deadline expired
+        :raise RequestCancelledError: if the request got cancelled
+        """
+        task = asyncio.ensure_future(self._execute(entry, args, kwargs, request_msg, codec,
+                                                   connection))
+        return await self.wait_for(task, entry, request_msg, connection, timeout)
+
+    async def wait_for(self, task, entry, request_msg, connection=None, timeout=None):
+        """
+        waits for the task executing a request, cancelling it at the deadline or by
+        `rpc.cancel`. The call behind a shielded task keeps running.
+        :return: the result of the task
+        :raise RequestTimeoutError: if the deadline expired
+        :raise RequestCancelledError: if the request got cancelled
+        """
+        cancelled = False
+
+        def cancel():
+            nonlocal cancelled
+            cancelled = True
+            task.cancel()
+
+        forget = self.register_cancel(connection, request_msg, cancel)
+        try:
+            return await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            if not task.cancelled():
+                # raised by the method itself
+                raise
+            self._count('timeouts')
+            raise exceptions.RequestTimeoutError(
+                '{} did not finish within {} seconds'.format(entry.name, timeout)) from None
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+            self._count('cancelled')
+            raise exceptions.RequestCancelledError() from None
+        finally:
+            forget()
+
+    def _start_shared(self, cache_key, entry, codec, generation, args, kwargs):
+        """ :return: the task of a call shared by several requests, resolving to the
+        encoded result """
+        async def execute():
+            result = await self._execute(entry, args, kwargs, None, codec, None)
+            return self.finish_shared(cache_key, entry, codec, result, generation)
+        return asyncio.ensure_future(execute())
+
+    async def _execute(self, entry, args, kwargs, request_msg, codec, connection):
+        return_value = entry.func(*args, **kwargs)
+        if inspect.isawaitable(return_value):
+            return_value = await return_value
+        if entry.streaming or hasattr(return_value, '__aiter__'):
+            if connection is None:
+                return_value = await async_collect(return_value)
+            else:
+                return_value = await self.stream(connection, codec, request_msg,
+                                                 return_value)
+        return return_value
+
+    async def stream(self, connection, codec, request_msg, items):
+        """
+        sends the items of a sync or async iterable in chunk frames, see
+        :meth:`RpcServer.stream`. Plain generators are iterated on the event loop and must
+        therefore not block.
+        :return: the number of streamed items
+        """
+        flags = framing.codec_flags(codec.codec_id)
+        count = 0
+        try:
+            async for chunk in async_chunked(items, self.stream_chunk_size):
+                if not await connection.send(
+                        codec.encode(chunk_message(request_msg, chunk)), flags):
+                    raise ConnectionError('connection is gone, stopped streaming')
+                count += len(chunk)
+        finally:
+            if hasattr(items, 'aclose'):
+                await items.aclose()
+            elif hasattr(items, 'close'):
+                items.close()
+        return count
+
+    @staticmethod
+    async def _consume(func, *args, **kwargs):
+        """ exhausts a streaming method called as notification """
+        await async_collect(func(*args, **kwargs))
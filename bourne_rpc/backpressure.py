@@ -0,0 +1,47 @@
+""" Limits on the number of requests in flight. Readers acquire capacity before handing
+requests to the executor, so when a limit is hit they stop reading from their connection
+instead of queueing requests without bound. """
+import threading
+
+
+class InflightLimiter:
+    """ Counts the requests in flight and blocks when a limit is reached. """
+
+    def __init__(self, limit=None):
+        """
+        :param limit: the maximum number of requests in flight, None for no limit
+        """
+        self.limit = limit
+        self.inflight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, count=1, timeout=None):
+        """
+        waits until `count` more requests fit into the limit. A batch bigger than the
+        limit is let through as soon as nothing else is in flight, otherwise it would
+        never fit.
+        :return: False if the timeout expired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._fits(count), timeout):
+                return False
+            self.inflight += count
+            return True
+
+    def release(self, count=1):
+        """ marks `count` requests as finished """
+        with self._condition:
+            self.inflight -= count
+            self._condition.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """
+        waits until no request is in flight anymore
+        :return: False if the timeout expired
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.inflight == 0, timeout)
+
+    def _fits(self, count):
+        return (self.limit is None or self.inflight == 0 or
+                self.inflight + count <= self.limit)
@@ -0,0 +1,235 @@
+""" Benchmark of the throughput and latency of :class:`RpcServer`.
+
+Runs a server in a forked process and drives it with client threads over every
+combination of the given transports, codecs, payload sizes, numbers of clients and modes,
+printing one JSON object per scenario (requests per second, p50/p99 latency and the peak
+memory of the server)::
+
+    python -m bourne_rpc.benchmark --clients 1 4 16 --payloads 64 65536 --output out.json
+
+Modes:
+
+- `sequential`: every client waits for the response before sending the next request
+- `pipelined`: the server is pipelined, every client keeps `--depth` requests in flight
+- `batch`: every client sends batches of `--depth` requests
+
+Only available where `os.fork` is (not on Windows). Latencies of batches are the ones
+of the whole batch. """
+import argparse
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .client import RpcClient, make_request
+from .codecs import CODEC_CBOR, CODEC_JSON, CODEC_MSGPACK, default_codecs
+from .server import RpcServer
+from .transport.tcp_socket import TcpSocket
+
+MODES = ('sequential', 'pipelined', 'batch')
+CODEC_NAMES = {'json': CODEC_JSON, 'msgpack': CODEC_MSGPACK, 'cbor': CODEC_CBOR}
+
+DEFAULT_DURATION = 2.0
+DEFAULT_DEPTH = 16
+
+
+class BenchmarkService:
+    """ the methods called by the benchmark """
+
+    def echo(self, payload):
+        return payload
+
+    def max_rss(self):
+        """ :return: the peak resident memory of the server in bytes, None if unknown """
+        if resource is None:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def percentile(sorted_values, fraction):
+    """ :return: the value at a fraction of already sorted values, None if empty """
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def create_transport(name, directory):
+    """
+    :param name: 'unix' or 'tcp'
+    :return: a tuple of a bound transport, the path or address to connect to and the
+    transport class clients connect with
+    """
+    if name == 'tcp':
+        transport = TcpSocket(('127.0.0.1', 0))
+        transport.bind()
+        return transport, transport.bound_address, TcpSocket
+    if name == 'unix':
+        from .transport.unix_domain_socket import UnixSocket
+        path = os.path.join(directory, 'bench_socket')
+        transport = UnixSocket(path)
+        transport.bind()
+        return transport, path, UnixSocket
+    raise ValueError('unknown transport {}'.format(name))
+
+
+def _serve(transport, pipelined):
+    RpcServer(transport, BenchmarkService(), pipelined=pipelined).serve()
+
+
+def _run_client(client, mode, payload, depth, deadline, latencies):
+    """ calls `echo` until the deadline, appending the latencies of the calls
+    :return: the number of completed requests """
+    completed = 0
+    if mode == 'sequential':
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            client.call('echo', payload)
+            latencies.append(time.perf_counter() - start)
+            completed += 1
+    elif mode == 'batch':
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            with client.batch() as batch:
+                futures = [batch.call('echo', payload) for _ in range(depth)]
+            for future in futures:
+                future.result()
+            latencies.append(time.perf_counter() - start)
+            completed += depth
+    else:
+        # a slot of the window is taken by every request in flight
+        window = threading.Semaphore(depth)
+
+        def done(start, _):
+            latencies.append(time.perf_counter() - start)
+            window.release()
+
+        while time.monotonic() < deadline:
+            window.acquire()
+            request_id = client.next_id()
+            future = concurrent.futures.Future()
+            future.add_done_callback(functools.partial(done, time.perf_counter()))
+            client.send(client.codec.encode(make_request('echo', [payload], request_id)),
+                        {request_id: future})
+            completed += 1
+        for _ in range(depth):
+            if not window.acquire(timeout=client.timeout):
+                raise TimeoutError('responses of pipelined requests are missing')
+    return completed
+
+
+def run_scenario(transport='unix', codec='json', payload_size=64, clients=1,
+                 mode='sequential', duration=DEFAULT_DURATION, depth=DEFAULT_DEPTH):
+    """
+    runs a single scenario against a fresh server
+    :param transport: 'unix' or 'tcp'
+    :param codec: 'json', 'msgpack' or 'cbor'
+    :param payload_size: the length of the string echoed by every request
+    :param clients: the number of clients, each calling from a thread of its own on a
+    connection of its own
+    :param mode: one of :data:`MODES`
+    :param duration: the number of seconds to send requests for
+    :param depth: the requests in flight per client (pipelined) or the size of batches
+    :return: a dict of the scenario and its results
+    """
+    codec_instance = default_codecs().get(CODEC_NAMES[codec])
+    if codec_instance is None:
+        raise ValueError('codec {} is not installed'.format(codec))
+
+    with tempfile.TemporaryDirectory() as directory:
+        server_transport, address, transport_class = create_transport(transport, directory)
+        process = multiprocessing.get_context('fork').Process(
+            target=_serve, args=(server_transport, mode == 'pipelined'), daemon=True)
+        process.start()
+        server_transport.close()
+
+        rpc_clients = [RpcClient(address, pool_size=1, codec=codec_instance,
+                                 transport_class=transport_class)
+                       for _ in range(clients)]
+        try:
+            payload = 'x' * payload_size
+            for client in rpc_clients:
+                client.call('echo', payload)
+
+            latencies = [[] for _ in rpc_clients]
+            deadline = time.monotonic() + duration
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(clients) as executor:
+                completed = sum(executor.map(
+                    lambda args: _run_client(args[0], mode, payload, depth, deadline,
+                                             args[1]),
+                    zip(rpc_clients, latencies)))
+            elapsed = time.perf_counter() - start
+            max_rss = rpc_clients[0].call('max_rss')
+        finally:
+            for client in rpc_clients:
+                client.close()
+            process.terminate()
+            process.join()
+
+    all_latencies = sorted(latency for client_latencies in latencies
+                           for latency in client_latencies)
+    return {'transport': transport, 'codec': codec, 'payload_size': payload_size,
+            'clients': clients, 'mode': mode, 'depth': depth,
+            'requests': completed, 'seconds': elapsed,
+            'requests_per_second': completed / elapsed,
+            'p50': percentile(all_latencies, 0.5), 'p99': percentile(all_latencies, 0.99),
+            'server_max_rss': max_rss}
+
+
+def scenarios(transports, codecs, payloads, clients, modes):
+    """ yields the keyword arguments of :func:`run_scenario` for all combinations """
+    for transport in transports:
+        for codec in codecs:
+            for payload_size in payloads:
+                for client_count in clients:
+                    for mode in modes:
+                        yield {'transport': transport, 'codec': codec,
+                               'payload_size': payload_size, 'clients': client_count,
+                               'mode': mode}
+
+
+def main(argv=None):
+    installed = [name for name, codec_id in CODEC_NAMES.items()
+                 if codec_id in default_codecs()]
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--transports', nargs='+', default=['unix', 'tcp'],
+                        choices=['unix', 'tcp'])
+    parser.add_argument('--codecs', nargs='+', default=installed, choices=installed)
+    parser.add_argument('--payloads', nargs='+', type=int, default=[64, 1024 * 1024],
+                        help='sizes of the echoed payloads in bytes')
+    parser.add_argument('--clients', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='seconds per scenario')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help='requests in flight per client or size of batches')
+    parser.add_argument('--output', help='file to write the results to as a JSON list, '
+                                         'they are printed as JSON lines regardless')
+    args = parser.parse_args(argv)
+
+    results = []
+    for scenario in scenarios(args.transports, args.codecs, args.payloads, args.clients,
+                              args.modes):
+        result = run_scenario(duration=args.duration, depth=args.depth, **scenario)
+        print(json.dumps(result), flush=True)
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+""" In-process cache of the results of idempotent methods. Results are stored already
+encoded with the codec of the request, so a hit skips both calling the method and encoding
+its result. Only methods decorated with `@rpc_method(cache=True)` are cached.
+
+Entries are evicted least recently used first once the number of entries or their total
+size exceeds the budget, and expire after their time to live. The application has to
+call :meth:`ResponseCache.invalidate` (or `server.invalidate`) when the state a cached
+result depends on changes. """
+import collections
+import json
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_TTL = 1.0
+
+
+def canonical_key(method, params):
+    """
+    :return: a hashable key of a call, equal for equal params regardless of the order of
+    named params. Values other than JSON ones are tagged with their type, so params
+    decoded by msgpack or CBOR which only differ in types (bytes and str, int and str
+    keys, arrays and tuples) get different keys.
+    :raise TypeError: if the keys of a map can't be ordered
+    """
+    return method, json.dumps(_tagged(params), separators=(',', ':'))
+
+
+def _tagged(value):
+    """ :return: the value as JSON serializable structure, containers and types JSON
+    does not have are turned into arrays starting with a tag of their type """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, dict):
+        if all(type(key) is str for key in value):
+            return {key: _tagged(item) for key, item in sorted(value.items())}
+        return ['d'] + sorted([json.dumps(_tagged(key), separators=(',', ':')),
+                               _tagged(item)] for key, item in value.items())
+    if isinstance(value, list):
+        return ['l'] + [_tagged(item) for item in value]
+    if isinstance(value, tuple):
+        return ['t'] + [_tagged(item) for item in value]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return ['y', bytes(value).hex()]
+    return ['o', '{}.{}'.format(type(value).__module__, type(value).__qualname__),
+            repr(value)]
+
+
+class CacheStats:
+    """ counters of a cache """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stats(self):
+        """ :return: a dict of all counters """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+
+class ResponseCache:
+    """ LRU cache of encoded results with a time to live and a memory budget. It is
+    thread safe. """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, clock=time.monotonic):
+        """
+        :param max_entries: the maximum number of cached results
+        :param max_bytes: the maximum total size of the cached results
+        :param ttl: the default time to live of an entry in seconds, None to keep entries
+        until they are evicted or invalidated
+        :param clock: the clock used for expiry
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.counters = CacheStats()
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (data, expires_at), in the order of their last use
+        self._entries = collections.OrderedDict()
+        # method -> keys of its entries, for invalidating a method
+        self._by_method = collections.defaultdict(set)
+        # bumped by every invalidation, results computed before must not be stored
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(method, params, codec_id):
+        """ :return: the key of the result of a call encoded with the given codec """
+        return canonical_key(method, params) + (codec_id,)
+
+    def get(self, key):
+        """ :return: the encoded result or None if it is not cached or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters.misses += 1
+                return None
+            data, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                self._remove(key)
+                self.counters.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters.hits += 1
+            return data
+
+    def put(self, key, data, ttl=None, generation=None):
+        """
+        stores an encoded result
+        :param ttl: the time to live of the entry, defaults to the ttl of the cache
+        :param generation: the :attr:`generation` read before the result was computed,
+        the result is dropped if the cache got invalidated in the meantime
+        :return: False if the result was not stored
+        """
+        if len(data) > self.max_bytes:
+            return False
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            expires_at = None if ttl is None else self._clock() + ttl
+            self._entries[key] = (data, expires_at)
+            self._by_method[key[0]].add(key)
+            self.size += len(data)
+
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.counters.evictions += 1
+        return True
+
+    def invalidate(self, method=None, params=None):
+        """
+        removes cached results
+        :param method: the method whose results are removed, None for all methods
+        :param params: only remove the result of the call with these params
+        """
+        with self._lock:
+            self.generation += 1
+            self.counters.invalidations += 1
+            if method is None:
+                self._entries.clear()
+                self._by_method.clear()
+                self.size = 0
+                return
+
+            keys = list(self._by_method.get(method, ()))
+            if params is not None:
+                call_key = canonical_key(method, params)
+                keys = [key for key in keys if key[:2] == call_key]
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key):
+        data, _ = self._entries.pop(key)
+        self.size -= len(data)
+        keys = self._by_method[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_method[key[0]]
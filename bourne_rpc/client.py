@@ -0,0 +1,897 @@
+""" Clients for :class:`RpcServer` and :class:`AsyncRpcServer`.
+
+Both clients keep a pool of persistent connections. Concurrent calls are multiplexed
+over the connections of the pool and matched to their responses by id, a background
+reader (thread or task) per connection resolves the pending calls. Connections that got
+lost are replaced on the next call.
+
+Events the server publishes to subscribed topics are received on a connection of their
+own, which is opened by the first subscription. """
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import logging
+import queue
+import threading
+from contextlib import suppress
+
+from . import compression, exceptions, framing
+from .codecs import JsonCodec
+from .transport import StreamingTransport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 4
+# the number of chunks of a streamed result received ahead of the consumer, reading from
+# the connection pauses beyond
+DEFAULT_STREAM_QUEUE_SIZE = 16
+
+
+def make_request(method, params=None, request_id=None, timeout=None, priority=None):
+    """
+    :param params: a list of positional or a dict of named params
+    :param request_id: the id of the request, None for notifications
+    :param timeout: the number of seconds the server may take, it gives up afterwards
+    :param priority: the priority lane of the request instead of the one of its method,
+    see :mod:`bourne_rpc.priority`
+    :return: a JSON-RPC request object
+    """
+    request = {'jsonrpc': '2.0', 'method': method}
+    if params is not None:
+        request['params'] = params
+    if request_id is not None:
+        request['id'] = request_id
+    if timeout is not None:
+        request['timeout'] = timeout
+    if priority is not None:
+        request['priority'] = priority
+    return request
+
+
+def cancel_request(request_id):
+    """ :return: the `rpc.cancel` notification cancelling a request """
+    return make_request('rpc.cancel', [request_id])
+
+
+def result_of(response):
+    """
+    :return: the result of a response object
+    :raise RpcError: if the response is an error response
+    :raise RpcTimeoutError: if the server gave up on the request at its deadline
+    """
+    if 'error' in response:
+        error = response['error']
+        if error.get('code') == exceptions.ERROR_TIMEOUT:
+            raise exceptions.RpcTimeoutError(error.get('data') or error.get('message'))
+        raise exceptions.RpcError(error.get('code'), error.get('message'), error.get('data'))
+    return response.get('result')
+
+
+def negotiated_compression(response, compressors):
+    """
+    :param response: the response to `rpc.negotiate`
+    :param compressors: the dict of the offered compressors by name
+    :return: a tuple of the compressor the server chose (None if it did not choose any
+    or does not know `rpc.negotiate`) and the compression threshold
+    """
+    try:
+        result = result_of(response)
+    except exceptions.RpcError:
+        logger.debug('server does not negotiate, not compressing')
+        return None, None
+    if not isinstance(result, dict):
+        return None, None
+    threshold = result.get('compression_threshold')
+    if isinstance(threshold, bool) or not isinstance(threshold, int):
+        threshold = compression.DEFAULT_COMPRESSION_THRESHOLD
+    return compressors.get(result.get('compression')), threshold
+
+
+def compressors_for(compression_option):
+    """ :return: the dict of compressors by name selected by the `compression` option of
+    the clients """
+    if not compression_option:
+        return {}
+    available = compression.default_compressors()
+    if compression_option is True:
+        return available
+    return {name: available[name] for name in compression_option if name in available}
+
+
+def end_stream(chunks):
+    """ puts the end marker into the queue (a `queue.Queue` or an `asyncio.Queue`) of a
+    streamed result without waiting. Only used once the connection got lost, the stream
+    fails anyway, so a chunk is dropped if the queue is full. """
+    while 1:
+        try:
+            chunks.put_nowait(None)
+            return
+        except (queue.Full, asyncio.QueueFull):
+            with suppress(queue.Empty, asyncio.QueueEmpty):
+                chunks.get_nowait()
+
+
+def decode_responses(codec, flags, payload):
+    """ :return: the list of response objects within a frame """
+    if framing.codec_id(flags) != codec.codec_id:
+        # the server answers frames of codecs it does not know with JSON
+        codec = JsonCodec()
+    message = codec.decode(payload)
+    return message if isinstance(message, list) else [message]
+
+
+class ClientConnection:
+    """ A single connection of a :class:`RpcClient`. Any number of threads may send
+    requests at the same time, the responses are read by a background thread. """
+
+    def __init__(self, transport, codec, on_event=None, shm_threshold=None):
+        """
+        :param transport: a connected transport
+        :param codec: the codec requests are encoded with
+        :param on_event: called on the reader thread with the method and params of every
+        notification the server sends
+        :param shm_threshold: the minimum size of requests passed in shared memory, see
+        :mod:`bourne_rpc.shm`
+        """
+        self.transport = transport
+        self.codec = codec
+        self.shm_threshold = shm_threshold
+        self.on_event = on_event
+        self.closed = False
+        # set once compression got negotiated, see `RpcClient(compression=...)`
+        self.compressor = None
+        self.compression_threshold = None
+        self._pending = {}
+        # request id -> queue of the chunks of a streamed result
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True,
+                                        name='bourne_rpc_client')
+        self._reader.start()
+
+    @property
+    def pending(self):
+        """ the number of requests waiting for a response """
+        return len(self._pending)
+
+    def send(self, message, futures=None, streams=None):
+        """
+        sends an encoded message
+        :param futures: a dict mapping the ids of the requests within the message to the
+        futures which get resolved with their response objects
+        :param streams: a dict mapping the ids of streaming requests to bounded queues
+        getting the chunks of their results, followed by None once the response arrived.
+        Reading waits while a queue is full, so the server has to wait as well.
+        :raise ConnectionError: if the connection is closed
+        """
+        futures = futures or {}
+        with self._lock:
+            if self.closed:
+                raise ConnectionError('connection is closed')
+            self._pending.update(futures)
+            self._streams.update(streams or {})
+        flags = framing.codec_flags(self.codec.codec_id)
+        if (self.compressor is not None and len(message) >= self.compression_threshold
+                and (self.shm_threshold is None or len(message) < self.shm_threshold)):
+            message, flags = framing.compress_payload(self.compressor, message, flags)
+        try:
+            with self._write_lock:
+                framing.send_frame(self.transport, message, flags, self.shm_threshold)
+        except OSError:
+            self.forget(futures)
+            self.close()
+            raise
+
+    def forget(self, request_ids):
+        """ stops waiting for the responses of requests, e.g. after a timeout """
+        with self._lock:
+            for request_id in request_ids:
+                self._pending.pop(request_id, None)
+                self._streams.pop(request_id, None)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        # waking up the reader, closing alone does not interrupt a blocking read
+        with suppress(OSError, AttributeError):
+            self.transport.shutdown()
+        self.transport.close()
+
+    def _read_loop(self):
+        reader = framing.FrameReader(self.transport)
+        try:
+            while 1:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+                for response in decode_responses(self.codec, *frame):
+                    self._dispatch(response)
+        except Exception:
+            if not self.closed:
+                logger.exception('Failed to read from connection')
+        finally:
+            self._fail_pending()
+
+    def _dispatch(self, response):
+        if 'method' in response:
+            # an event pushed by the server
+            if self.on_event is not None:
+                self.on_event(response['method'], response.get('params'))
+            return
+        if 'chunk' in response:
+            with self._lock:
+                chunks = self._streams.get(response.get('id'))
+            if chunks is not None:
+                # waits while the consumer does not keep up
+                chunks.put(response['chunk'])
+            return
+        with self._lock:
+            future = self._pending.pop(response.get('id'), None)
+            chunks = self._streams.pop(response.get('id'), None)
+        if future is None:
+            logger.warning('Got response to unknown request %r', response.get('id'))
+            return
+        future.set_result(response)
+        if chunks is not None:
+            chunks.put(None)
+
+    def _fail_pending(self):
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+            streams, self._streams = self._streams, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError('connection closed'))
+        for chunks in streams.values():
+            end_stream(chunks)
+
+
+class RpcClient:
+    """ Thread safe client for a :class:`RpcServer`, keeping a pool of persistent
+    connections which are used round robin. Calls made concurrently from several threads
+    share the connections, use `pipelined=True` on the server to not have them wait for
+    each other. """
+
+    def __init__(self, path, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 codec=None, transport_class=None, shm_threshold=None,
+                 transport_options=None, compression=None,
+                 stream_queue_size=DEFAULT_STREAM_QUEUE_SIZE):
+        """
+        :param path: the path of the transport the server listens on, see
+        `get_transport_path`
+        :param pool_size: the number of connections kept open
+        :param timeout: the default number of seconds to wait for a response
+        :param codec: the codec requests are encoded with, defaults to JSON
+        :param transport_class: the transport to connect with, defaults to
+        `StreamingTransport`
+        :param shm_threshold: the minimum size of requests passed to the server in a
+        shared memory segment, see :mod:`bourne_rpc.shm`. None to never do so.
+        :param transport_options: keyword arguments passed to the `connect` of the
+        transport, e.g. `{'seqpacket': True}` for a `UnixSocket` in that mode
+        :param compression: the names of the compression algorithms to offer the server
+        in the order of preference (e.g. `['zstd', 'zlib']`), True for all available
+        ones. Every new connection negotiates one of them, payloads above the threshold
+        of the server are compressed in both directions. None to not compress.
+        :param stream_queue_size: the maximum number of chunks of a streamed result
+        received ahead of the consumer, see :meth:`stream`
+        """
+        self.path = path
+        self.compressors = compressors_for(compression)
+        self.stream_queue_size = stream_queue_size
+        self.shm_threshold = shm_threshold
+        self.transport_options = transport_options or {}
+        self.timeout = timeout
+        self.codec = codec or JsonCodec()
+        self.transport_class = transport_class or StreamingTransport
+        self._connections = [None] * pool_size
+        self._round_robin = itertools.count()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._events_connection = None
+        # topic -> callbacks
+        self._subscriptions = {}
+
+    def call(self, method, *params):
+        """
+        calls a method with positional params and waits for its result
+        :raise RpcError: if the server answered with an error
+        :raise RpcTimeoutError: if the server did not answer in time
+        """
+        return self.request(method, list(params))
+
+    def request(self, method, params=None, timeout=None, priority=None):
+        """
+        calls a method and waits for its result
+        :param params: a list of positional or a dict of named params
+        :param timeout: the number of seconds to wait, defaults to the client timeout. It
+        is sent along as deadline, the server gives up on the request as well. If it
+        expires the request is cancelled.
+        :param priority: the priority lane of the request, see :mod:`bourne_rpc.priority`
+        :raise RpcError: if the server answered with an error
+        :raise RpcTimeoutError: if the server did not answer in time
+        """
+        request_id = self.next_id()
+        timeout = self.timeout if timeout is None else timeout
+        future = concurrent.futures.Future()
+        connection = self.send(
+            self.codec.encode(make_request(method, params, request_id, timeout,
+                                           priority)),
+            {request_id: future})
+        try:
+            self.wait({request_id: future}, timeout)
+        except exceptions.RpcTimeoutError:
+            self.cancel(connection, request_id)
+            raise
+        return result_of(future.result())
+
+    def cancel(self, connection, request_id):
+        """ asks the server to cancel a request sent on a connection, in case it still
+        works on it """
+        with suppress(OSError):
+            connection.send(self.codec.encode(cancel_request(request_id)))
+
+    def notify(self, method, *params):
+        """ sends a notification without waiting for anything """
+        self.send(self.codec.encode(make_request(method, list(params))))
+
+    def stream(self, method, params=None, timeout=None):
+        """
+        calls a streaming method, see :mod:`bourne_rpc.streaming`
+        :param params: a list of positional or a dict of named params
+        :param timeout: the number of seconds to wait for the next chunk
+        :return: an iterator of the items of the result, yielding them as they arrive.
+        While `stream_queue_size` chunks are waiting for it, the connection is not read
+        and the server waits, other responses on the connection are held up as well.
+        :raise RpcError: once the server answered with an error
+        :raise RpcTimeoutError: if no chunk arrived in time
+        """
+        request_id = self.next_id()
+        future = concurrent.futures.Future()
+        chunks = queue.Queue(self.stream_queue_size)
+        connection = self.send(self.codec.encode(make_request(method, params, request_id)),
+                               {request_id: future}, {request_id: chunks})
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            while 1:
+                try:
+                    chunk = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise exceptions.RpcTimeoutError(
+                        'no chunk within {} seconds'.format(timeout)) from None
+                if chunk is None:
+                    break
+                yield from chunk
+            result_of(future.result())
+        finally:
+            connection.forget([request_id])
+            # the reader might wait for room in the queue
+            with suppress(queue.Empty):
+                while 1:
+                    chunks.get_nowait()
+
+    def batch(self):
+        """
+        :return: a :class:`Batch` collecting requests, which are sent as a single batch
+        request when it gets sent or its context is left
+        """
+        return Batch(self)
+
+    def subscribe(self, topic, callback):
+        """
+        subscribes to the events the server publishes to a topic
+        :param callback: called with the params of every event. It is called on the
+        thread reading the events, so it should return quickly.
+        """
+        with self._lock:
+            callbacks = self._subscriptions.setdefault(topic, [])
+            callbacks.append(callback)
+            first = len(callbacks) == 1
+        if first:
+            self._events_request('rpc.subscribe', [topic])
+
+    def unsubscribe(self, topic, callback=None):
+        """ removes a callback of a topic, all of them if None is given """
+        with self._lock:
+            callbacks = self._subscriptions.get(topic, [])
+            if callback is not None and callback in callbacks:
+                callbacks.remove(callback)
+            if callback is not None and callbacks:
+                return
+            self._subscriptions.pop(topic, None)
+        self._events_request('rpc.unsubscribe', [topic])
+
+    def next_id(self):
+        """ :return: a new request id, unique for this client """
+        return next(self._ids)
+
+    def send(self, message, futures=None, streams=None):
+        """
+        sends an encoded message on a connection of the pool. If the connection turns
+        out to be lost, sending is retried once on a new connection.
+        :param futures: see :meth:`ClientConnection.send`
+        :param streams: see :meth:`ClientConnection.send`
+        :return: the connection the message was sent on
+        """
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.send(message, futures, streams)
+                return connection
+            except OSError:
+                if attempt:
+                    raise
+                logger.debug('connection got lost, reconnecting')
+
+    def wait(self, futures, timeout=None):
+        """
+        waits for the responses of requests
+        :param futures: a dict mapping request ids to the futures of their responses
+        :raise RpcTimeoutError: if not all responses arrived in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        _, not_done = concurrent.futures.wait(futures.values(), timeout)
+        if not_done:
+            for connection in self._connections + [self._events_connection]:
+                if connection is not None:
+                    connection.forget(futures)
+            raise exceptions.RpcTimeoutError(
+                'no response within {} seconds'.format(timeout))
+
+    def close(self):
+        """ closes all connections of the pool """
+        with self._lock:
+            connections, self._connections = self._connections, [None] * len(
+                self._connections)
+            connections.append(self._events_connection)
+            self._events_connection = None
+        for connection in connections:
+            if connection is not None:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _connection(self):
+        """ :return: the next connection of the pool, (re)connecting it if needed """
+        index = next(self._round_robin) % len(self._connections)
+        with self._lock:
+            connection = self._connections[index]
+            if connection is None or connection.closed:
+                connection = ClientConnection(self._connect(), self.codec,
+                                              shm_threshold=self.shm_threshold)
+                self._negotiate(connection)
+                self._connections[index] = connection
+        return connection
+
+    def _negotiate(self, connection):
+        """ agrees on the compression of a new connection, if enabled """
+        if not self.compressors:
+            return
+        request_id = self.next_id()
+        future = concurrent.futures.Future()
+        connection.send(self.codec.encode(make_request(
+            'rpc.negotiate', {'compression': list(self.compressors)}, request_id)),
+            {request_id: future})
+        self.wait({request_id: future})
+        connection.compressor, connection.compression_threshold = negotiated_compression(
+            future.result(), self.compressors)
+
+    def _connect(self):
+        """ :return: a new connected transport """
+        return self.transport_class.connect(self.path, **self.transport_options)
+
+    def _events_request(self, method, topics):
+        """ calls a built-in method about subscriptions on the events connection, a lost
+        events connection is replaced and subscribed to all topics again """
+        request_id = self.next_id()
+        future = concurrent.futures.Future()
+        message = self.codec.encode(make_request(method, topics, request_id))
+        with self._lock:
+            connection = self._events_connection
+            if connection is None or connection.closed:
+                connection = ClientConnection(self._connect(), self.codec,
+                                              self._on_event, self.shm_threshold)
+                self._negotiate(connection)
+                self._events_connection = connection
+                topics = list(self._subscriptions)
+                if topics:
+                    connection.send(self.codec.encode(make_request('rpc.subscribe',
+                                                                   topics)))
+        connection.send(message, {request_id: future})
+        self.wait({request_id: future})
+        return result_of(future.result())
+
+    def _on_event(self, topic, params):
+        with self._lock:
+            callbacks = list(self._subscriptions.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(params)
+            except Exception:
+                logger.exception('Failed to handle event of %s', topic)
+
+
+class Batch:
+    """ Collects calls and notifications of a client, which are sent as a single batch
+    request. The futures returned by :meth:`call` resolve to the results. """
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self._response_futures = {}
+
+    def call(self, method, *params):
+        """ adds a call to the batch
+        :return: a future resolving to the result or the `RpcError` of the call """
+        return self.request(method, list(params))
+
+    def request(self, method, params=None):
+        """ adds a call with a list of positional or a dict of named params
+        :return: a future resolving to the result or the `RpcError` of the call """
+        request_id = self.client.next_id()
+        self.requests.append(make_request(method, params, request_id))
+
+        response_future, result_future = self.new_future(), self.new_future()
+        response_future.add_done_callback(
+            functools.partial(_resolve_result, result_future))
+        self._response_futures[request_id] = response_future
+        return result_future
+
+    def notify(self, method, *params):
+        """ adds a notification to the batch """
+        self.requests.append(make_request(method, list(params)))
+
+    def send(self, timeout=None):
+        """ sends the batch and waits for all responses
+        :raise RpcTimeoutError: if not all responses arrived in time """
+        if not self.requests:
+            return
+        requests, self.requests = self.requests, []
+        futures, self._response_futures = self._response_futures, {}
+        self.client.send(self.client.codec.encode(requests), futures)
+        self.client.wait(futures, timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.send()
+
+    @staticmethod
+    def new_future():
+        return concurrent.futures.Future()
+
+
+def _resolve_result(result_future, response_future):
+    """ resolves a future of a result by the future of the response """
+    try:
+        result_future.set_result(result_of(response_future.result()))
+    except Exception as e:
+        result_future.set_exception(e)
+
+
+class AsyncClientConnection:
+    """ A single connection of an :class:`AsyncRpcClient`, responses are read by a
+    background task. """
+
+    def __init__(self, reader, writer, codec, on_event=None):
+        """ see :class:`ClientConnection`, `on_event` is called on the event loop """
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.on_event = on_event
+        self.closed = False
+        self.compressor = None
+        self.compression_threshold = None
+        self._pending = {}
+        self._streams = {}
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def send(self, message, futures=None, streams=None):
+        """ see :meth:`ClientConnection.send`, streams are `asyncio.Queue` objects """
+        if self.closed:
+            raise ConnectionError('connection is closed')
+        futures = futures or {}
+        self._pending.update(futures)
+        self._streams.update(streams or {})
+        flags = framing.codec_flags(self.codec.codec_id)
+        if self.compressor is not None and len(message) >= self.compression_threshold:
+            message, flags = framing.compress_payload(self.compressor, message, flags)
+        try:
+            if isinstance(message, list):
+                self.writer.writelines(
+                    [framing.pack_header(sum(len(buffer) for buffer in message), flags)] +
+                    message)
+            else:
+                self.writer.write(framing.pack_frame(message, flags))
+            await self.writer.drain()
+        except OSError:
+            self.forget(futures)
+            self.close()
+            raise
+
+    def forget(self, request_ids):
+        for request_id in request_ids:
+            self._pending.pop(request_id, None)
+            self._streams.pop(request_id, None)
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+    async def _read_loop(self):
+        try:
+            while 1:
+                header, = framing.HEADER.unpack(
+                    await self.reader.readexactly(framing.HEADER.size))
+                payload = await self.reader.readexactly(framing.frame_length(header))
+                header, payload = framing.decompress_frame(header, payload)
+                for response in decode_responses(self.codec, header, payload):
+                    if 'method' in response:
+                        if self.on_event is not None:
+                            self.on_event(response['method'], response.get('params'))
+                        continue
+                    chunks = self._streams.get(response.get('id'))
+                    if 'chunk' in response:
+                        if chunks is not None:
+                            # waits while the consumer does not keep up
+                            await chunks.put(response['chunk'])
+                        continue
+                    future = self._pending.pop(response.get('id'), None)
+                    if future is None:
+                        logger.warning('Got response to unknown request %r',
+                                       response.get('id'))
+                    elif not future.done():
+                        future.set_result(response)
+                    if self._streams.pop(response.get('id'), None) is not None:
+                        await chunks.put(None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            if not self.closed:
+                logger.exception('Failed to read from connection')
+        finally:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+            streams, self._streams = self._streams, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection closed'))
+            for chunks in streams.values():
+                end_stream(chunks)
+
+
+class AsyncRpcClient:
+    """ asyncio counterpart of :class:`RpcClient` """
+
+    def __init__(self, path, pool_size=1, timeout=DEFAULT_TIMEOUT, codec=None,
+                 connect=None, compression=None,
+                 stream_queue_size=DEFAULT_STREAM_QUEUE_SIZE):
+        """
+        :param path: the path of the unix socket the server listens on
+        :param pool_size: the number of connections kept open
+        :param timeout: the default number of seconds to wait for a response
+        :param codec: the codec requests are encoded with, defaults to JSON
+        :param connect: a coroutine function returning a (reader, writer) tuple of a new
+        connection, defaults to opening a unix socket connection to the path
+        :param compression: see :class:`RpcClient`
+        :param stream_queue_size: see :class:`RpcClient`
+        """
+        self.path = path
+        self.compressors = compressors_for(compression)
+        self.stream_queue_size = stream_queue_size
+        self.timeout = timeout
+        self.codec = codec or JsonCodec()
+        self.connect = connect or functools.partial(asyncio.open_unix_connection, path)
+        self._connections = [None] * pool_size
+        self._round_robin = itertools.count()
+        self._ids = itertools.count(1)
+        self._events_connection = None
+        self._subscriptions = {}
+        self._connect_lock = asyncio.Lock()
+
+    async def call(self, method, *params):
+        """ see :meth:`RpcClient.call` """
+        return await self.request(method, list(params))
+
+    async def request(self, method, params=None, timeout=None, priority=None):
+        """ see :meth:`RpcClient.request` """
+        request_id = self.next_id()
+        timeout = self.timeout if timeout is None else timeout
+        future = asyncio.get_running_loop().create_future()
+        connection = await self.send(
+            self.codec.encode(make_request(method, params, request_id, timeout,
+                                           priority)),
+            {request_id: future})
+        try:
+            await self.wait({request_id: future}, timeout)
+        except exceptions.RpcTimeoutError:
+            await self.cancel(connection, request_id)
+            raise
+        return result_of(future.result())
+
+    async def cancel(self, connection, request_id):
+        """ see :meth:`RpcClient.cancel` """
+        with suppress(OSError):
+            await connection.send(self.codec.encode(cancel_request(request_id)))
+
+    async def notify(self, method, *params):
+        """ sends a notification without waiting for a response """
+        await self.send(self.codec.encode(make_request(method, list(params))))
+
+    async def stream(self, method, params=None, timeout=None):
+        """ see :meth:`RpcClient.stream`, returns an async iterator """
+        request_id = self.next_id()
+        future = asyncio.get_running_loop().create_future()
+        chunks = asyncio.Queue(self.stream_queue_size)
+        connection = await self.send(
+            self.codec.encode(make_request(method, params, request_id)),
+            {request_id: future}, {request_id: chunks})
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            while 1:
+                try:
+                    chunk = await asyncio.wait_for(chunks.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise exceptions.RpcTimeoutError(
+                        'no chunk within {} seconds'.format(timeout)) from None
+                if chunk is None:
+                    break
+                for item in chunk:
+                    yield item
+            result_of(future.result())
+        finally:
+            connection.forget([request_id])
+            # the reader might wait for room in the queue
+            with suppress(asyncio.QueueEmpty):
+                while 1:
+                    chunks.get_nowait()
+
+    def batch(self):
+        """ :return: an :class:`AsyncBatch` """
+        return AsyncBatch(self)
+
+    async def subscribe(self, topic, callback):
+        """ see :meth:`RpcClient.subscribe`, the callback is called on the event loop """
+        callbacks = self._subscriptions.setdefault(topic, [])
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            await self._events_request('rpc.subscribe', [topic])
+
+    async def unsubscribe(self, topic, callback=None):
+        """ see :meth:`RpcClient.unsubscribe` """
+        callbacks = self._subscriptions.get(topic, [])
+        if callback is not None and callback in callbacks:
+            callbacks.remove(callback)
+        if callback is not None and callbacks:
+            return
+        self._subscriptions.pop(topic, None)
+        await self._events_request('rpc.unsubscribe', [topic])
+
+    def next_id(self):
+        """ :return: a new request id, unique for this client """
+        return next(self._ids)
+
+    async def send(self, message, futures=None, streams=None):
+        """ see :meth:`RpcClient.send` """
+        for attempt in range(2):
+            connection = await self._connection()
+            try:
+                await connection.send(message, futures, streams)
+                return connection
+            except OSError:
+                if attempt:
+                    raise
+                logger.debug('connection got lost, reconnecting')
+
+    async def wait(self, futures, timeout=None):
+        """ see :meth:`RpcClient.wait` """
+        timeout = self.timeout if timeout is None else timeout
+        _, not_done = await asyncio.wait(list(futures.values()), timeout=timeout)
+        if not_done:
+            for connection in self._connections + [self._events_connection]:
+                if connection is not None:
+                    connection.forget(futures)
+            raise exceptions.RpcTimeoutError(
+                'no response within {} seconds'.format(timeout))
+
+    async def close(self):
+        connections, self._connections = self._connections, [None] * len(
+            self._connections)
+        connections.append(self._events_connection)
+        self._events_connection = None
+        for connection in connections:
+            if connection is not None:
+                connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def _connection(self):
+        index = next(self._round_robin) % len(self._connections)
+        connection = self._connections[index]
+        if connection is None or connection.closed:
+            async with self._connect_lock:
+                # another call might have connected while waiting for the lock
+                connection = self._connections[index]
+                if connection is None or connection.closed:
+                    reader, writer = await self.connect()
+                    connection = AsyncClientConnection(reader, writer, self.codec)
+                    await self._negotiate(connection)
+                    self._connections[index] = connection
+        return connection
+
+    async def _negotiate(self, connection):
+        """ see :meth:`RpcClient._negotiate` """
+        if not self.compressors:
+            return
+        request_id = self.next_id()
+        future = asyncio.get_running_loop().create_future()
+        await connection.send(self.codec.encode(make_request(
+            'rpc.negotiate', {'compression': list(self.compressors)}, request_id)),
+            {request_id: future})
+        await self.wait({request_id: future})
+        connection.compressor, connection.compression_threshold = negotiated_compression(
+            future.result(), self.compressors)
+
+    async def _events_request(self, method, topics):
+        """ see :meth:`RpcClient._events_request` """
+        request_id = self.next_id()
+        future = asyncio.get_running_loop().create_future()
+        message = self.codec.encode(make_request(method, topics, request_id))
+        connection = self._events_connection
+        if connection is None or connection.closed:
+            reader, writer = await self.connect()
+            connection = AsyncClientConnection(reader, writer, self.codec, self._on_event)
+            await self._negotiate(connection)
+            self._events_connection = connection
+            topics = list(self._subscriptions)
+            if topics:
+                await connection.send(self.codec.encode(make_request('rpc.subscribe',
+                                                                     topics)))
+        await connection.send(message, {request_id: future})
+        await self.wait({request_id: future})
+        return result_of(future.result())
+
+    def _on_event(self, topic, params):
+        for callback in list(self._subscriptions.get(topic, ())):
+            try:
+                callback(params)
+            except Exception:
+                logger.exception('Failed to handle event of %s', topic)
+
+
+class AsyncBatch(Batch):
+    """ asyncio counterpart of :class:`Batch` """
+
+    async def send(self, timeout=None):
+        """ sends the batch and waits for all responses """
+        if not self.requests:
+            return
+        requests, self.requests = self.requests, []
+        futures, self._response_futures = self._response_futures, {}
+        await self.client.send(self.client.codec.encode(requests), futures)
+        await self.client.wait(futures, timeout)
+
+    @staticmethod
+    def new_future():
+        return asyncio.get_running_loop().create_future()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *_):
+        if exc_type is None:
+            await self.send()
@@ -0,0 +1,217 @@
+""" Payload codecs used to encode and decode the messages within a frame.
+
+The codec of a frame is marked by its id in the frame header (see :mod:`framing`), so a
+client can choose the codec per message and the server answers with the same codec.
+Clients not knowing about codecs never set these bits and get JSON as before. """
+import functools
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+CODEC_CBOR = 2
+
+
+class EncodedResult:
+    """ A result which is already encoded with the codec of the response, e.g. taken
+    from the response cache. It is spliced into the encoded response as it is. """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class Codec:
+    """ base of all codecs, subclasses implement `encode`, `decode` and the splicing of
+    already encoded parts into responses """
+    codec_id = None
+    name = None
+
+    def encode_response(self, response):
+        """
+        encodes a response object or a list of them (batch), results which are an
+        :class:`EncodedResult` are spliced in without encoding them again
+        """
+        if isinstance(response, list):
+            if not any(isinstance(entry.get('result'), EncodedResult)
+                       for entry in response):
+                return self.encode(response)
+            return self.join_array([self.encode_response(entry) for entry in response])
+
+        result = response.get('result')
+        if not isinstance(result, EncodedResult):
+            return self.encode(response)
+        return self.splice_result({key: value for key, value in response.items()
+                                   if key != 'result'}, result.data)
+
+    def splice_result(self, response, result):
+        """
+        :param response: the response object without the result
+        :param result: the encoded result
+        :return: the encoded response with the result added
+        """
+        raise NotImplementedError
+
+    def join_array(self, elements):
+        """ :return: an encoded array of the already encoded elements """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """ the default codec encoding messages as UTF-8 JSON using the standard library """
+    codec_id = CODEC_JSON
+    name = 'json'
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf8')
+
+    def decode(self, payload):
+        """ :param payload: a bytes like object, e.g. a memoryview into the receive
+        buffer """
+        return json.loads(str(payload, 'utf8'))
+
+    def splice_result(self, response, result):
+        # replacing the closing brace of the object
+        return self.encode(response)[:-1] + b',"result":' + result + b'}'
+
+    def join_array(self, elements):
+        return b'[' + b','.join(elements) + b']'
+
+
+class FastJsonCodec(JsonCodec):
+    """ replacement of :class:`JsonCodec` using orjson or ujson, whichever is installed.
+    The wire format is the same, so it shares the codec id with JSON. Messages these
+    can't encode or decode (integers beyond 64 bits, NaN and Infinity literals) are
+    handled by the standard library instead. Unlike the standard library orjson encodes
+    NaN and Infinity as null and decodes integers beyond 64 bits as floats, use
+    :class:`JsonCodec` if messages may contain them. Pass it to the server to use it::
+
+        server = RpcServer(transport, obj,
+                           codecs={**default_codecs(), CODEC_JSON: FastJsonCodec()})
+    """
+
+    def __init__(self):
+        if orjson is not None:
+            self._dumps = functools.partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS)
+            self._loads = orjson.loads
+        elif ujson is not None:
+            self._dumps = lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf8')
+            self._loads = lambda payload: ujson.loads(str(payload, 'utf8'))
+        else:
+            raise ImportError('Neither orjson nor ujson is installed')
+
+    def encode(self, obj):
+        try:
+            return self._dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            # the standard library raises as well if it really can't be encoded
+            return super().encode(obj)
+
+    def decode(self, payload):
+        try:
+            return self._loads(payload)
+        except (ValueError, OverflowError):
+            # e.g. NaN and Infinity, invalid payloads raise the error of json
+            return super().decode(payload)
+
+
+class MsgpackCodec(Codec):
+    """ compact binary codec using MessagePack, requires the `msgpack` package """
+    codec_id = CODEC_MSGPACK
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('msgpack is not installed')
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, payload):
+        # maps with keys other than str and bytes are encoded as well
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+    def splice_result(self, response, result):
+        return b''.join([self._packer.pack_map_header(len(response) + 1)] +
+                        [self.encode(key) + self.encode(value)
+                         for key, value in response.items()] +
+                        [self.encode('result'), result])
+
+    def join_array(self, elements):
+        return self._packer.pack_array_header(len(elements)) + b''.join(elements)
+
+
+class CborCodec(Codec):
+    """ compact binary codec using CBOR, requires the `cbor2` package """
+    codec_id = CODEC_CBOR
+    name = 'cbor'
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError('cbor2 is not installed')
+
+    def encode(self, obj):
+        return cbor2.dumps(obj)
+
+    def decode(self, payload):
+        return cbor2.loads(payload)
+
+    def splice_result(self, response, result):
+        return b''.join([_cbor_header(CBOR_MAP, len(response) + 1)] +
+                        [self.encode(key) + self.encode(value)
+                         for key, value in response.items()] +
+                        [self.encode('result'), result])
+
+    def join_array(self, elements):
+        return _cbor_header(CBOR_ARRAY, len(elements)) + b''.join(elements)
+
+
+CBOR_ARRAY = 4
+CBOR_MAP = 5
+
+
+def _cbor_header(major_type, length):
+    """ :return: the head of a CBOR array or map of the given length """
+    if length < 24:
+        return bytes([major_type << 5 | length])
+    for additional_info, size_format in ((24, '>B'), (25, '>H'), (26, '>I'), (27, '>Q')):
+        if length < 1 << (8 * struct.calcsize(size_format)):
+            return bytes([major_type << 5 | additional_info]) + struct.pack(size_format,
+                                                                            length)
+    raise ValueError('length {} is too big'.format(length))
+
+
+def default_codecs():
+    """
+    :return: a dict mapping codec ids to instances of all codecs available with the
+    installed packages. JSON is always available and uses the standard library.
+    """
+    codecs = {CODEC_JSON: JsonCodec()}
+    for codec_class in (MsgpackCodec, CborCodec):
+        try:
+            codec = codec_class()
+        except ImportError:
+            continue
+        codecs[codec.codec_id] = codec
+    return codecs
@@ -0,0 +1,208 @@
+""" Compression of big payloads, negotiated per connection.
+
+A client offers the algorithms it supports with the built-in `rpc.negotiate`, the server
+picks the first one it supports as well. From then on both ends compress payloads of at
+least the compression threshold. Compressed frames are marked with bit 31 of the header
+(see :mod:`framing`), the first byte of their payload is the id of the algorithm.
+Receiving works regardless of negotiation, so the server may start compressing right
+away. zlib is always available, lz4 and zstd if the `lz4` or `zstandard` packages are
+installed.
+
+Payloads are compressed in chunks straight out of the encoded message and the chunks
+are written with a scatter/gather write, so big messages are neither copied nor joined
+before they are sent. """
+import threading
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+COMPRESSION_ZSTD = 3
+
+# payloads are passed to the compressor in chunks of this size
+CHUNK_SIZE = 256 * 1024
+
+DEFAULT_COMPRESSION_THRESHOLD = 16 * 1024
+
+
+class Compressor:
+    """ base of all compressors, subclasses implement `compressobj` and `decompress` """
+    compressor_id = None
+    name = None
+
+    def compress(self, payload):
+        """
+        :param payload: the encoded message
+        :return: a list of buffers of the compressed payload, starting with the id of
+        the algorithm
+        """
+        compressobj = self.compressobj()
+        chunks = [bytes((self.compressor_id,))]
+        view = memoryview(payload).cast('B')
+        for offset in range(0, len(view), CHUNK_SIZE):
+            chunk = compressobj.compress(view[offset:offset + CHUNK_SIZE])
+            if chunk:
+                chunks.append(chunk)
+        chunks.append(compressobj.flush())
+        return chunks
+
+    def compressobj(self):
+        """ :return: a new object with `compress(data)` and `flush()` """
+        raise NotImplementedError
+
+    def decompress(self, data, max_length):
+        """
+        :param data: the compressed payload without the id of the algorithm
+        :param max_length: the maximum length of the decompressed payload
+        :raise ValueError: if the data is invalid or decompresses to more than
+        `max_length` bytes
+        """
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    """ deflate using the standard library """
+    compressor_id = COMPRESSION_ZLIB
+    name = 'zlib'
+
+    def __init__(self, level=1):
+        """ :param level: 1 (fastest) to 9 (smallest) """
+        self.level = level
+
+    def compressobj(self):
+        return zlib.compressobj(self.level)
+
+    def decompress(self, data, max_length):
+        decompressobj = zlib.decompressobj()
+        try:
+            payload = decompressobj.decompress(data, max_length)
+        except zlib.error as e:
+            raise ValueError(str(e))
+        if decompressobj.unconsumed_tail or not decompressobj.eof:
+            raise ValueError('compressed payload is too big or truncated')
+        return payload
+
+
+class Lz4Compressor(Compressor):
+    """ the fastest one, requires the `lz4` package """
+    compressor_id = COMPRESSION_LZ4
+    name = 'lz4'
+
+    def __init__(self):
+        if lz4 is None:
+            raise ImportError('lz4 is not installed')
+
+    def compressobj(self):
+        return _Lz4CompressObj()
+
+    def decompress(self, data, max_length):
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        try:
+            payload = decompressor.decompress(data, max_length)
+        except RuntimeError as e:
+            raise ValueError(str(e))
+        if not decompressor.eof:
+            raise ValueError('compressed payload is too big or truncated')
+        return payload
+
+
+class _Lz4CompressObj:
+    """ adapts `LZ4FrameCompressor` to the interface of `zlib.compressobj` """
+
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        chunk = self._compressor.compress(data)
+        if self._header:
+            chunk, self._header = self._header + chunk, b''
+        return chunk
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+
+class ZstdCompressor(Compressor):
+    """ better ratios than zlib at a higher speed, requires the `zstandard` package """
+    compressor_id = COMPRESSION_ZSTD
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise ImportError('zstandard is not installed')
+        self.level = level
+        # the contexts of zstandard are not thread safe, every thread gets its own ones
+        self._local = threading.local()
+
+    def compressobj(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compressobj()
+
+    def decompress(self, data, max_length):
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+        try:
+            return decompressor.decompress(data, max_output_size=max_length)
+        except zstandard.ZstdError as e:
+            raise ValueError(str(e))
+
+
+def default_compressors():
+    """
+    :return: a dict mapping names to instances of all compressors available with the
+    installed packages, in the order of preference (zstd, lz4, zlib)
+    """
+    compressors = {}
+    for compressor_class in (ZstdCompressor, Lz4Compressor, ZlibCompressor):
+        try:
+            compressor = compressor_class()
+        except ImportError:
+            continue
+        compressors[compressor.name] = compressor
+    return compressors
+
+
+# the compressors able to decompress received frames, by id
+_DECOMPRESSORS = {compressor.compressor_id: compressor
+                  for compressor in default_compressors().values()}
+
+
+def decompress(payload, max_length):
+    """
+    :param payload: the payload of a compressed frame, including the id of the algorithm
+    :param max_length: the maximum length of the decompressed payload
+    :return: the decompressed payload
+    :raise ValueError: if the algorithm is unknown or the payload is invalid
+    """
+    if not len(payload):
+        raise ValueError('compressed payload is empty')
+    compressor = _DECOMPRESSORS.get(payload[0])
+    if compressor is None:
+        raise ValueError('unknown compression {}'.format(payload[0]))
+    return compressor.decompress(payload[1:], max_length)
+
+
+def choose(offered, compressors):
+    """
+    :param offered: the names of the algorithms offered by the other end, in the order
+    of its preference
+    :param compressors: a dict mapping names to the compressors supported here
+    :return: the first offered compressor supported here, None if there is none
+    """
+    for name in offered:
+        if isinstance(name, str) and name in compressors:
+            return compressors[name]
+    return None
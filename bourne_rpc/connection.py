@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import socket
+import threading
+from contextlib import suppress
+
+from . import framing
+from .backpressure import InflightLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """ A client connection of a :class:`RpcServer`. Responses may be sent from any
+    thread, writes are serialized so frames never interleave.
+
+    Frames sent while another thread is writing are queued and the next writer sends all
+    of them at once, with a single scatter/gather write where the transport supports it.
+    """
+
+    def __init__(self, transport, max_inflight=None, shm_threshold=None, flush_delay=0,
+                 metrics=None, send_timeout=None, deadlines=None):
+        """
+        :param transport: the connected transport (or socket)
+        :param max_inflight: the maximum number of requests in flight on the connection
+        :param shm_threshold: the minimum size of messages passed in shared memory, see
+        :mod:`bourne_rpc.shm`. None to send all messages over the transport.
+        :param flush_delay: the number of seconds a frame may wait for further frames to
+        be written together with it while responses to other messages of the connection
+        are pending, 0 to write right away
+        :param metrics: the :class:`ServerMetrics` counting the writes and the bytes
+        sent, if any
+        :param send_timeout: the number of seconds a write may block, the connection is
+        shut down if the client does not read for that long. None for no limit.
+        :param deadlines: the :class:`DeadlineScheduler` timing the writes, required
+        with a `send_timeout`
+        """
+        self.transport = transport
+        self.limiter = InflightLimiter(max_inflight)
+        self.shm_threshold = shm_threshold
+        self.flush_delay = flush_delay
+        self.metrics = metrics
+        self.send_timeout = send_timeout
+        self.deadlines = deadlines
+        # set once the connection subscribes to a topic
+        self.subscriber = None
+        # request id -> function cancelling the pending request, see `rpc.cancel`
+        self.cancel_callbacks = {}
+        self._write_condition = threading.Condition()
+        # frames waiting to be written, as (message, flags) tuples
+        self._pending = []
+        # every queued frame gets a ticket, frames up to `_written` are written
+        self._queued = 0
+        self._written = 0
+        self._writing = False
+        self._broken = False
+        # received messages (requests or batches) whose response is not sent yet
+        self._responses = 0
+        # set once compression got negotiated, see `rpc.negotiate`
+        self.compressor = None
+        self.compression_threshold = None
+
+    def compress_with(self, compressor, threshold):
+        """ compresses messages of at least `threshold` bytes from now on, unless they
+        are passed in shared memory. None as compressor stops compressing. """
+        self.compressor = compressor
+        self.compression_threshold = threshold
+
+    def expect_response(self):
+        """ marks a received message as waiting for its response, see `flush_delay` """
+        with self._write_condition:
+            self._responses += 1
+
+    def response_done(self):
+        """ marks the response to a received message as sent """
+        with self._write_condition:
+            self._responses -= 1
+
+    def send(self, message, flags=0):
+        """
+        sends a single frame, possibly together with frames sent by other threads
+        :param message: the encoded message
+        :param flags: the flags of the frame
+        :return: False if the connection is gone
+        """
+        if self.metrics is not None:
+            # counted before compressing, like received messages after decompressing
+            self.metrics.bytes_out += framing.HEADER.size + len(message)
+        if (self.compressor is not None and len(message) >= self.compression_threshold
+                and (self.shm_threshold is None or len(message) < self.shm_threshold)):
+            # compressed by the sending thread, not while holding up the writer
+            message, flags = framing.compress_payload(self.compressor, message, flags,
+                                                      self.metrics)
+        with self._write_condition:
+            if self._broken:
+                return False
+            self._pending.append((message, flags))
+            self._queued += 1
+            ticket = self._queued
+            while self._writing:
+                self._write_condition.wait()
+            if self._written >= ticket or self._broken:
+                # written by another thread in the meantime
+                return not self._broken
+            self._writing = True
+            if self.flush_delay and self._responses > 1:
+                # the responses of other requests might follow soon, the lock is released
+                # while waiting and other threads add their frames
+                self._write_condition.wait(self.flush_delay)
+            frames, self._pending = self._pending, []
+            last = self._queued
+
+        writes = 0
+        deadline = None
+        if self.send_timeout is not None:
+            deadline = self.deadlines.schedule(self.send_timeout, self._send_timed_out)
+        try:
+            writes = framing.send_frames(self.transport, frames, self.shm_threshold)
+        except OSError:
+            logger.debug('connection is gone, dropping messages')
+            broken = True
+        else:
+            broken = False
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+        with self._write_condition:
+            self._written = last
+            self._writing = False
+            self._broken = self._broken or broken
+            self._write_condition.notify_all()
+        if self.metrics is not None:
+            self.metrics.record_writes(writes, len(frames))
+        return not broken
+
+    def _send_timed_out(self):
+        # called by the thread of the deadlines, shutting down wakes up the blocked writer
+        # with an error and the reader with the end of the stream
+        logger.warning('closing connection, the client did not read for %s seconds',
+                       self.send_timeout)
+        with suppress(OSError):
+            self.transport.shutdown(socket.SHUT_RDWR)
+
+    def stop_reading(self):
+        """ wakes up the reader of the connection, which sees the end of the stream and
+        stops reading requests. Responses can still be sent. """
+        with suppress(OSError):
+            self.transport.shutdown(socket.SHUT_RD)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncConnection:
+    """ A client connection of an :class:`AsyncRpcServer`. Writes are serialized so
+    frames never interleave. Frames sent during the same iteration of the event loop are
+    written together. """
+
+    def __init__(self, writer, metrics=None):
+        """
+        :param writer: the `asyncio.StreamWriter` of the connection
+        :param metrics: the :class:`ServerMetrics` counting the writes and the bytes
+        sent, if any
+        """
+        self.writer = writer
+        self.metrics = metrics
+        # set once the connection subscribes to a topic
+        self.subscriber = None
+        # request id -> function cancelling the pending request, see `rpc.cancel`
+        self.cancel_callbacks = {}
+        self._write_lock = asyncio.Lock()
+        # headers and messages waiting for the next flush, and the number of frames
+        self._pending = []
+        self._pending_frames = 0
+        # set once compression got negotiated, see `rpc.negotiate`
+        self.compressor = None
+        self.compression_threshold = None
+
+    def compress_with(self, compressor, threshold):
+        """ see :meth:`Connection.compress_with` """
+        self.compressor = compressor
+        self.compression_threshold = threshold
+
+    async def send(self, message, flags=0):
+        """
+        sends a single frame
+        :param message: the encoded message
+        :param flags: the flags of the frame
+        :return: False if the connection is gone
+        """
+        if self.writer.is_closing():
+            return False
+        if self.metrics is not None:
+            self.metrics.bytes_out += framing.HEADER.size + len(message)
+        if self.compressor is not None and len(message) >= self.compression_threshold:
+            message, flags = framing.compress_payload(self.compressor, message, flags,
+                                                      self.metrics)
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._flush)
+        if isinstance(message, list):
+            self._pending.append(framing.pack_header(
+                sum(len(buffer) for buffer in message), flags))
+            self._pending.extend(message)
+        else:
+            self._pending.append(framing.pack_header(len(message), flags))
+            self._pending.append(message)
+        self._pending_frames += 1
+        # the flush runs before this task resumes
+        await asyncio.sleep(0)
+        async with self._write_lock:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                logger.debug('connection is gone, dropping message')
+                return False
+        return True
+
+    def _flush(self):
+        buffers, self._pending = self._pending, []
+        frames, self._pending_frames = self._pending_frames, 0
+        if self.writer.is_closing():
+            return
+        self.writer.writelines(buffers)
+        if self.metrics is not None:
+            self.metrics.record_writes(1, frames)
+
+    def stop_reading(self):
+        """ see :meth:`Connection.stop_reading` """
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            with suppress(OSError):
+                sock.shutdown(socket.SHUT_RD)
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,102 @@
+""" Deadlines of the requests of :class:`RpcServer`. A single background thread calls
+the callbacks of expired deadlines, instead of a timer thread per request. Requests
+answered in time cancel their deadline, cancelled deadlines are dropped lazily. """
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """ a scheduled callback, see :meth:`DeadlineScheduler.schedule` """
+
+    __slots__ = ('when', 'callback', '_scheduler')
+
+    def __init__(self, when, callback, scheduler):
+        self.when = when
+        self.callback = callback
+        self._scheduler = scheduler
+
+    def cancel(self):
+        """ makes sure the callback is not called, if it did not get called yet """
+        if self.callback is not None:
+            self.callback = None
+            self._scheduler._cancelled()
+
+
+class DeadlineScheduler:
+    """ calls callbacks once their deadline expired, from a thread of its own which is
+    started on the first deadline """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: returns the current time in seconds
+        """
+        self.clock = clock
+        self._heap = []
+        self._order = itertools.count()
+        self._cancelled_count = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled_count
+
+    def schedule(self, delay, callback):
+        """
+        :param delay: the number of seconds after which the callback is called
+        :param callback: called without arguments on the thread of the scheduler, so it
+        must not block
+        :return: the :class:`Deadline`, which can be cancelled
+        """
+        deadline = Deadline(self.clock() + delay, callback, self)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline.when, next(self._order), deadline))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='bourne_rpc_deadlines')
+                self._thread.start()
+            elif self._heap[0][2] is deadline:
+                # expires before all others, the thread has to wake up earlier
+                self._condition.notify()
+        return deadline
+
+    def _cancelled(self):
+        with self._condition:
+            self._cancelled_count += 1
+            # answered requests would pile up until their deadline otherwise
+            if self._cancelled_count > len(self._heap) // 2:
+                self._heap = [item for item in self._heap if item[2].callback is not None]
+                heapq.heapify(self._heap)
+                self._cancelled_count = 0
+
+    def expire(self):
+        """ calls the callbacks of all expired deadlines """
+        while 1:
+            with self._condition:
+                if not self._heap or self._heap[0][0] > self.clock():
+                    return
+                _, _, deadline = heapq.heappop(self._heap)
+                callback, deadline.callback = deadline.callback, None
+                if callback is None:
+                    self._cancelled_count -= 1
+                    continue
+            try:
+                callback()
+            except Exception:
+                logger.exception('Failed to handle expired deadline')
+
+    def _run(self):
+        while 1:
+            self.expire()
+            with self._condition:
+                # checked again with the lock held, a new deadline might expire earlier
+                if not self._heap:
+                    self._condition.wait()
+                else:
+                    remaining = self._heap[0][0] - self.clock()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
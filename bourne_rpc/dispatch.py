@@ -0,0 +1,185 @@
+""" The table of methods a server exposes, built once when the server is created.
+
+Which methods of the served object are exposed is decided in this order:
+- if any method is decorated with :func:`rpc_method`, exactly the decorated ones
+- if an allowlist of names is given, exactly those
+- otherwise all public methods, meaning the ones not starting with an underscore
+"""
+import inspect
+
+from . import exceptions
+
+RPC_METHOD_ATTRIBUTE = '_bourne_rpc_method'
+
+
+def rpc_method(func=None, name=None, **options):
+    """
+    decorator marking a method of the served object as exposed. Can be used with or
+    without arguments:
+
+        @rpc_method
+        def status(self, path): ...
+
+        @rpc_method(name='sync.status')
+        def status(self, path): ...
+
+    :param name: the name the method is called by, defaults to the name of the function
+    :param options: options of the method, stored in the dispatch table entry:
+        - cache: cache the results of the method, see :mod:`bourne_rpc.cache`
+        - cache_ttl: the time to live of its cached results
+        - stream: stream the result, which is an iterable, in chunks. Defaults to True
+          for generator functions.
+        - timeout: the number of seconds a call may take, instead of the default timeout
+          of the server
+        - single_flight: concurrent calls with the same params share a single execution,
+          see :mod:`bourne_rpc.singleflight`
+        - priority: the lane of the calls, 'interactive', 'default' or 'bulk', see
+          :mod:`bourne_rpc.priority`
+    """
+    def decorate(function):
+        setattr(function, RPC_METHOD_ATTRIBUTE, (name or function.__name__, options))
+        return function
+
+    if func is not None:
+        return decorate(func)
+    return decorate
+
+
+class MethodEntry:
+    """ A method of the dispatch table together with its precomputed signature, which is
+    used to check the params of a call without calling `inspect` again. """
+
+    __slots__ = ('name', 'func', 'options', 'streaming', 'positional',
+                 'required_positional', 'var_positional', 'named', 'required_named',
+                 'required_keyword_only', 'required_positional_only', 'var_keyword')
+
+    def __init__(self, name, func, options=None):
+        """
+        :param name: the name the method is called by
+        :param func: the (bound) callable
+        :param options: the options of the method, see :func:`rpc_method`
+        """
+        self.name = name
+        self.func = func
+        self.options = options or {}
+        self.streaming = self.options.get('stream', inspect.isgeneratorfunction(func) or
+                                          inspect.isasyncgenfunction(func))
+
+        try:
+            parameters = inspect.signature(func).parameters.values()
+        except (TypeError, ValueError):
+            # no signature available (some builtins), every call is passed through
+            parameters = [inspect.Parameter('args', inspect.Parameter.VAR_POSITIONAL),
+                          inspect.Parameter('kwargs', inspect.Parameter.VAR_KEYWORD)]
+
+        positional_kinds = (inspect.Parameter.POSITIONAL_ONLY,
+                            inspect.Parameter.POSITIONAL_OR_KEYWORD)
+        named_kinds = (inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                       inspect.Parameter.KEYWORD_ONLY)
+        kinds = {parameter.kind for parameter in parameters}
+
+        self.positional = [p.name for p in parameters if p.kind in positional_kinds]
+        self.required_positional = len([p for p in parameters if p.kind in positional_kinds
+                                        and p.default is p.empty])
+        self.var_positional = inspect.Parameter.VAR_POSITIONAL in kinds
+        self.named = frozenset(p.name for p in parameters if p.kind in named_kinds)
+        self.required_named = frozenset(p.name for p in parameters
+                                        if p.kind in named_kinds and p.default is p.empty)
+        # keyword only parameters without default can't be passed positionally
+        self.required_keyword_only = self.required_named.difference(self.positional)
+        # and positional only ones without default can't be passed by name
+        self.required_positional_only = any(
+            p.kind == inspect.Parameter.POSITIONAL_ONLY and p.default is p.empty
+            for p in parameters)
+        self.var_keyword = inspect.Parameter.VAR_KEYWORD in kinds
+
+    def bind(self, params):
+        """
+        checks the params of a call against the signature
+        :param params: the params of the request, a list, a dict or None
+        :return: a tuple of positional and named arguments
+        :raise InvalidParamsError: if the params do not match the signature
+        """
+        if params is None:
+            params = []
+
+        if isinstance(params, list):
+            if len(params) < self.required_positional:
+                raise exceptions.InvalidParamsError(
+                    '{} expects at least {} params'.format(self.name,
+                                                           self.required_positional))
+            if len(params) > len(self.positional) and not self.var_positional:
+                raise exceptions.InvalidParamsError(
+                    '{} expects at most {} params'.format(self.name, len(self.positional)))
+            if self.required_keyword_only:
+                raise exceptions.InvalidParamsError(
+                    '{} requires named params'.format(self.name))
+            return params, {}
+
+        if isinstance(params, dict):
+            if self.required_positional_only:
+                raise exceptions.InvalidParamsError(
+                    '{} requires positional params'.format(self.name))
+            missing = self.required_named.difference(params)
+            if missing:
+                raise exceptions.InvalidParamsError(
+                    '{} is missing params {}'.format(self.name, ', '.join(sorted(missing))))
+            if not self.var_keyword:
+                unknown = set(params).difference(self.named)
+                if unknown:
+                    raise exceptions.InvalidParamsError(
+                        '{} got unknown params {}'.format(self.name,
+                                                          ', '.join(sorted(unknown))))
+            return (), params
+
+        raise exceptions.InvalidParamsError('params must be an array or an object')
+
+
+class DispatchTable:
+    """ Maps method names to :class:`MethodEntry`, looking up a method is a single dict
+    access. """
+
+    def __init__(self, obj, allowlist=None):
+        """
+        :param obj: the served object
+        :param allowlist: the names of the methods to expose, used if no method of the
+        object is decorated with :func:`rpc_method`
+        """
+        self.entries = {}
+
+        decorated, public = [], []
+        for attribute_name in dir(obj):
+            # looking at the attribute statically to not trigger properties
+            attribute = inspect.getattr_static(obj, attribute_name)
+            function = getattr(attribute, '__func__', attribute)
+            marker = getattr(function, RPC_METHOD_ATTRIBUTE, None)
+            if marker is not None:
+                decorated.append((attribute_name, marker))
+            elif (not attribute_name.startswith('_') and callable(function) and
+                  not isinstance(attribute, type)):
+                public.append(attribute_name)
+
+        if decorated:
+            for attribute_name, (name, options) in decorated:
+                self.add(name, getattr(obj, attribute_name), **options)
+        else:
+            for name in (public if allowlist is None else allowlist):
+                self.add(name, getattr(obj, name))
+
+    def add(self, name, func, **options):
+        """ adds a method to the table, replacing an existing one with the same name """
+        self.entries[name] = MethodEntry(name, func, options)
+
+    def lookup(self, name):
+        """
+        :return: the entry of a method
+        :raise MethodNotFoundError: if there is no such method
+        """
+        try:
+            return self.entries[name]
+        except (KeyError, TypeError):
+            raise exceptions.MethodNotFoundError(
+                'method {!r} not found'.format(name)) from None
+
+    def __contains__(self, name):
+        return name in self.entries
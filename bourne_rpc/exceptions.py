@@ -8,8 +8,50 @@ ERROR_PARSE = -32700  # Invalid JSON was received by the server.
 ERROR_METHOD_NOT_FOUND = -32601  # Method not found	The method does not exist / is not available.
 ERROR_INVALID_PARAMS = -32602  # Invalid params	Invalid method parameter(s).
 ERROR_INTERNAL = -32603  # Internal error	Internal JSON-RPC error.
+ERROR_TIMEOUT = -32001  # Server error	The request did not finish before its deadline.
+ERROR_CANCELLED = -32002  # Server error	The request got cancelled by the client.
 
 
-class InvalidRequestError(BourneRpcException):
+class RequestError(BourneRpcException):
+    """ base of errors caused by the request, answered with their code and message """
+    code = ERROR_INTERNAL
+    message = 'Internal error.'
+
+
+class InvalidRequestError(RequestError):
     code = -32600
-    message  = 'Invalid Request	The JSON sent is not a valid Request object.'
\ No newline at end of file
+    message  = 'Invalid Request	The JSON sent is not a valid Request object.'
+
+
+class MethodNotFoundError(RequestError):
+    code = ERROR_METHOD_NOT_FOUND
+    message = 'Method not found.'
+
+
+class InvalidParamsError(RequestError):
+    code = ERROR_INVALID_PARAMS
+    message = 'Invalid params.'
+
+
+class RequestTimeoutError(RequestError):
+    code = ERROR_TIMEOUT
+    message = 'Request timed out.'
+
+
+class RequestCancelledError(RequestError):
+    code = ERROR_CANCELLED
+    message = 'Request cancelled.'
+
+
+class RpcError(BourneRpcException):
+    """ an error response received from the server """
+
+    def __init__(self, code, message, data=None):
+        super().__init__('{} ({})'.format(message, code))
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class RpcTimeoutError(BourneRpcException, TimeoutError):
+    """ no response was received in time """
@@ -0,0 +1,386 @@
+""" Length prefixed framing used on all streaming transports.
+
+Every message on the stream is preceded by its length as 4 byte unsigned integer:
+[size of following message M (4 bytes)] [M]
+
+The lower 28 bits of the header carry the length, the upper 4 bits are flags. Clients
+which do not know about the flags never set them, for them nothing changes.
+- bits 28-29: the id of the codec of the payload, 0 is JSON (see :mod:`codecs`)
+- bit 30: the payload is located in a shared memory segment passed along as file
+  descriptor, the frame only carries its length (see :mod:`shm`)
+- bit 31: the payload is compressed, its first byte is the id of the algorithm (see
+  :mod:`compression`)
+"""
+import collections
+import os
+import socket
+import struct
+import time
+
+from . import compression, shm
+
+HEADER = struct.Struct('I')
+
+LENGTH_MASK = 0x0FFFFFFF
+FLAGS_MASK = 0xF0000000
+CODEC_SHIFT = 28
+CODEC_MASK = 0x3 << CODEC_SHIFT
+FLAG_FD = 1 << 30
+FLAG_COMPRESSED = 1 << 31
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# the default maximum length of a received payload (after decompression), a peer sending
+# a longer frame gets disconnected before anything is allocated for it
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# the maximum number of received file descriptors not belonging to a complete frame yet,
+# a peer sending more gets disconnected
+MAX_PENDING_FDS = 64
+
+# frames up to this size are sent with a single write by transports which can't write
+# several buffers at once
+SMALL_FRAME_SIZE = 16 * 1024 - HEADER.size
+
+# the maximum number of buffers of a single scatter/gather write
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+
+def codec_flags(codec_id):
+    """ :return: the header flags marking a payload encoded with the given codec """
+    return codec_id << CODEC_SHIFT
+
+
+def codec_id(flags):
+    """ :return: the codec id out of the flags of a header """
+    return (flags & CODEC_MASK) >> CODEC_SHIFT
+
+
+def pack_header(length, flags=0):
+    """
+    packs the header of a frame
+    :param length: the length of the payload
+    :param flags: the flags of the frame
+    :raise ValueError: if the payload is too big to be framed
+    """
+    if length > LENGTH_MASK:
+        raise ValueError('frame of {} bytes exceeds the maximum frame size'.format(length))
+    return HEADER.pack(length | flags)
+
+
+def frame_length(header, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    :param header: the unpacked header of a received frame
+    :param max_frame_size: the maximum length of a payload accepted
+    :return: the length of the payload
+    :raise ConnectionError: if the frame is longer than `max_frame_size`
+    """
+    length = header & LENGTH_MASK
+    if length > max_frame_size:
+        raise ConnectionError('frame of {} bytes exceeds the maximum of {}'.format(
+            length, max_frame_size))
+    return length
+
+
+def pack_frame(payload, flags=0):
+    """
+    prepends the header to a payload
+    :param payload: the encoded message
+    :param flags: the flags of the frame
+    :return: the complete frame as bytes
+    """
+    return pack_header(len(payload), flags) + payload
+
+
+def send_frame(transport, payload, flags=0, shm_threshold=None):
+    """
+    sends a single frame, payloads of at least `shm_threshold` bytes are passed in a
+    shared memory segment if the transport supports passing file descriptors
+    :param transport: a connected transport (or socket)
+    :param payload: the encoded message
+    :param flags: the flags of the frame
+    :param shm_threshold: the minimum size of payloads passed in shared memory, None to
+    always send them over the transport
+    :return: the number of writes it took
+    """
+    return send_frames(transport, [(payload, flags)], shm_threshold)
+
+
+def send_frames(transport, frames, shm_threshold=None):
+    """
+    sends several frames with as few writes as possible: headers and payloads of all
+    frames are written at once if the transport supports scatter/gather writes
+    :param frames: a list of (payload, flags) tuples, the payload may be a list of
+    buffers as well (see :func:`compress_payload`), which is never passed in shared
+    memory
+    :param shm_threshold: see :func:`send_frame`
+    :return: the number of writes it took
+    """
+    buffers = []
+    writes = 0
+    for payload, flags in frames:
+        if isinstance(payload, list):
+            buffers.append(pack_header(sum(len(buffer) for buffer in payload), flags))
+            buffers.extend(payload)
+            continue
+        if (shm_threshold is not None and len(payload) >= shm_threshold and
+                hasattr(transport, 'send_fds')):
+            if buffers:
+                writes += write_buffers(transport, buffers)
+                buffers = []
+            fd = shm.create_segment(payload)
+            try:
+                transport.send_fds(pack_frame(shm.SEGMENT_LENGTH.pack(len(payload)),
+                                              flags | FLAG_FD), [fd])
+            finally:
+                os.close(fd)
+            writes += 1
+            continue
+        buffers.append(pack_header(len(payload), flags))
+        buffers.append(payload)
+    if buffers:
+        writes += write_buffers(transport, buffers)
+    return writes
+
+
+def compress_payload(compressor, payload, flags, metrics=None):
+    """
+    :param compressor: the :class:`compression.Compressor` negotiated for the connection
+    :param payload: the encoded message
+    :param flags: the flags of the frame
+    :param metrics: the :class:`ServerMetrics` recording the ratio and time, if any
+    :return: a tuple of the compressed payload as list of buffers and the flags, or of
+    the original payload and flags if compressing does not make it smaller
+    """
+    started = time.perf_counter_ns()
+    chunks = compressor.compress(payload)
+    length = sum(len(chunk) for chunk in chunks)
+    if metrics is not None:
+        metrics.record_compression(len(payload), length,
+                                   time.perf_counter_ns() - started)
+    if length >= len(payload) or length > LENGTH_MASK:
+        return payload, flags
+    return chunks, flags | FLAG_COMPRESSED
+
+
+def decompress_frame(flags, payload, metrics=None, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    :param flags: the flags of a received frame
+    :param payload: its payload
+    :param metrics: the :class:`ServerMetrics` recording the time, if any
+    :param max_frame_size: the maximum length of the decompressed payload
+    :return: a tuple of the flags and the payload, decompressed if the frame is
+    compressed
+    :raise ConnectionError: if the payload can't be decompressed
+    """
+    if not flags & FLAG_COMPRESSED:
+        return flags, payload
+    started = time.perf_counter_ns()
+    try:
+        payload = compression.decompress(payload, max_frame_size)
+    except ValueError as e:
+        raise ConnectionError('invalid compressed frame: {}'.format(e))
+    if metrics is not None:
+        metrics.record_decompression(time.perf_counter_ns() - started)
+    return flags & ~FLAG_COMPRESSED, payload
+
+
+def write_buffers(transport, buffers):
+    """
+    writes buffers one after another, with a single scatter/gather write if the transport
+    (or socket) supports it
+    :return: the number of writes it took
+    """
+    send_buffers = getattr(transport, 'send_buffers', None)
+    if send_buffers is not None:
+        return send_buffers(buffers)
+    if isinstance(transport, socket.socket) and hasattr(transport, 'sendmsg'):
+        return sendmsg_all(transport.sendmsg, buffers)
+    if sum(len(buffer) for buffer in buffers) <= SMALL_FRAME_SIZE + HEADER.size:
+        # a single write (and a single record on SOCK_SEQPACKET), copying is cheaper
+        transport.sendall(b''.join(buffers))
+        return 1
+    for buffer in buffers:
+        transport.sendall(buffer)
+    return len(buffers)
+
+
+def sendmsg_all(sendmsg, buffers):
+    """
+    writes all buffers with scatter/gather writes, going on after partial writes
+    :param sendmsg: the `sendmsg` of a socket
+    :param buffers: a list of bytes-like objects
+    :return: the number of writes it took
+    """
+    views = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+    first = 0
+    writes = 0
+    while first < len(views):
+        sent = sendmsg(views[first:first + IOV_MAX])
+        writes += 1
+        # skipping what got sent, the rest of a partially sent buffer is sent next
+        while sent:
+            length = len(views[first])
+            if sent < length:
+                views[first] = views[first][sent:]
+                break
+            sent -= length
+            first += 1
+    return writes
+
+
+def close_fds(fds):
+    """ closes a list of file descriptors """
+    for fd in fds:
+        os.close(fd)
+
+
+class FrameReader:
+    """ Reads frames from a transport into a preallocated, growable receive buffer.
+
+    Data is received with `recv_into` directly into the buffer, a single read might
+    therefore contain several (pipelined) frames which are returned one after another
+    without touching the transport again. Short reads are handled by reading until the
+    frame is complete.
+
+    File descriptors of shared memory segments (see :mod:`shm`) are received along if the
+    transport provides `recv_into_fds`. They arrive with the read ending within the frame
+    they were sent with, once a frame is complete all descriptors arrived up to its end
+    which it does not take are closed. Compressed frames are decompressed.
+
+    Frames longer than `max_frame_size` raise a `ConnectionError` as soon as their header
+    arrived, payloads in shared memory are not limited as the sender provides their
+    memory. """
+
+    def __init__(self, transport, buffer_size=DEFAULT_BUFFER_SIZE, metrics=None,
+                 max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        """
+        :param transport: a connected transport (or socket) providing `recv_into` or
+        at least `recv`
+        :param buffer_size: the initial size of the receive buffer, it grows if a frame
+        does not fit into it
+        :param metrics: the :class:`ServerMetrics` recording decompression, if any
+        :param max_frame_size: the maximum length of a payload, after decompression
+        """
+        self.transport = transport
+        self.metrics = metrics
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # the unconsumed data is located in self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        # the number of bytes received so far, the position of self._end in the stream
+        self._received = 0
+        # tuples of the stream position of the end of the read they arrived with and the
+        # received file descriptor
+        self._fds = collections.deque()
+
+    def read_frame(self):
+        """
+        reads the next frame from the transport
+        :return: a tuple of the flags of the frame and the payload as memoryview into the
+        receive buffer, which is only valid until the next call. Returns None if the
+        connection got closed.
+        :raise ConnectionError: if the connection got closed in the middle of a frame or
+        the frame is too long
+        """
+        while 1:
+            if self._end - self._start >= HEADER.size:
+                header, = HEADER.unpack_from(self._buffer, self._start)
+                length = frame_length(header, self.max_frame_size)
+                frame_end = self._start + HEADER.size + length
+                if frame_end <= self._end:
+                    payload = self._view[self._start + HEADER.size:frame_end]
+                    self._start = frame_end
+                    fds = self._take_fds(self._received - self._end + frame_end)
+                    if header & FLAG_FD:
+                        return header & FLAGS_MASK & ~FLAG_FD, self._map_segment(payload,
+                                                                                 fds)
+                    close_fds(fds)
+                    return decompress_frame(header & FLAGS_MASK, payload, self.metrics,
+                                            self.max_frame_size)
+                self._reserve(HEADER.size + length)
+            else:
+                self._reserve(HEADER.size)
+
+            if not self._fill():
+                self.close_fds()
+                if self._start == self._end:
+                    return None
+                raise ConnectionError('connection closed in the middle of a frame')
+
+    def close_fds(self):
+        """ closes file descriptors received but not consumed by a frame """
+        while self._fds:
+            os.close(self._fds.popleft()[1])
+
+    def _take_fds(self, frame_end):
+        """ :return: the file descriptors arrived up to the stream position `frame_end`,
+        which belong to the frame ending there """
+        fds = []
+        while self._fds and self._fds[0][0] <= frame_end:
+            fds.append(self._fds.popleft()[1])
+        return fds
+
+    def _map_segment(self, payload, fds):
+        """ :return: the payload of a frame located in a shared memory segment, which is
+        passed as the first of the file descriptors of the frame """
+        if not fds or len(payload) != shm.SEGMENT_LENGTH.size:
+            close_fds(fds)
+            raise ConnectionError('invalid frame of a shared memory segment')
+        close_fds(fds[1:])
+        length, = shm.SEGMENT_LENGTH.unpack(payload)
+        return shm.map_segment(fds[0], length)
+
+    def _reserve(self, size):
+        """ makes sure that `size` bytes starting at the unconsumed data fit into the
+        buffer by either moving the data to the front or by growing the buffer """
+        if self._start + size <= len(self._buffer):
+            return
+
+        pending = bytes(self._view[self._start:self._end])
+        if size > len(self._buffer):
+            # the old buffer might still be referenced by a returned payload, so a new one
+            # is allocated instead of resizing
+            self._buffer = bytearray(max(size, 2 * len(self._buffer)))
+            self._view = memoryview(self._buffer)
+        self._buffer[:len(pending)] = pending
+        self._start = 0
+        self._end = len(pending)
+
+    def _fill(self):
+        """ receives as much data as available into the free space of the buffer
+        :return: False if the connection got closed """
+        if self._start == self._end:
+            # everything got consumed, start over at the beginning of the buffer
+            self._start = self._end = 0
+
+        record_size = getattr(self.transport, 'record_size', None)
+        if record_size is not None:
+            # a record which does not fit into the buffer would be truncated
+            self._reserve(self._end - self._start + record_size)
+
+        free = self._view[self._end:]
+        try:
+            if hasattr(self.transport, 'recv_into_fds'):
+                received, fds = self.transport.recv_into_fds(free)
+                self._fds.extend((self._received + received, fd) for fd in fds)
+                if len(self._fds) > MAX_PENDING_FDS:
+                    self.close_fds()
+                    raise ConnectionError('too many file descriptors received')
+            elif hasattr(self.transport, 'recv_into'):
+                received = self.transport.recv_into(free)
+            else:
+                data = self.transport.recv(len(free))
+                received = len(data)
+                free[:received] = data
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+
+        self._end += received
+        self._received += received
+        return received > 0
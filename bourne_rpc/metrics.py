@@ -0,0 +1,160 @@
+""" Low overhead metrics of a server: per method call and error counts and latency
+histograms, bytes in and out. They are pulled with `server.stats()` or the built-in
+method `rpc.stats`.
+
+Recording a call is a couple of integer operations without taking a lock, counters are
+therefore not exact under heavy contention of threads (an increment may get lost now and
+then), which is fine for monitoring. """
+import time
+
+# latencies are recorded in nanoseconds, bucket i holds latencies below 2 ** i ns
+HISTOGRAM_BUCKETS = 64
+
+
+class LatencyHistogram:
+    """ histogram of latencies with buckets growing in powers of two """
+
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+
+    def record(self, nanoseconds):
+        self.buckets[min(nanoseconds.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += nanoseconds
+
+    def percentile(self, fraction):
+        """
+        :param fraction: e.g. 0.99 for the 99th percentile
+        :return: the estimated latency in seconds, None if nothing got recorded. The
+        value is interpolated within its bucket.
+        """
+        buckets = list(self.buckets)
+        count = sum(buckets)
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            if bucket_count and seen + bucket_count >= rank:
+                low = 1 << (index - 1) if index else 0
+                high = 1 << index
+                return (low + (high - low) * (rank - seen) / bucket_count) / 1e9
+            seen += bucket_count
+        return None
+
+    def stats(self):
+        """ :return: a dict of the mean, p50, p90 and p99 latency in seconds """
+        return {'mean': self.total / self.count / 1e9 if self.count else None,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99)}
+
+
+class MethodStats:
+    """ metrics of a single method """
+
+    __slots__ = ('calls', 'errors', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def stats(self):
+        stats = {'calls': self.calls, 'errors': self.errors}
+        stats.update(self.latency.stats())
+        return stats
+
+
+class ServerMetrics:
+    """ the metrics of a server """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.methods = {}
+        self.requests = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # writes to the transports and the frames sent with them
+        self.writes = 0
+        self.frames_out = 0
+        # compressed payloads, their size before and after and the time it took
+        self.compressed = 0
+        self.compressed_bytes_in = 0
+        self.compressed_bytes_out = 0
+        self.compression_time = 0
+        self.decompressed = 0
+        self.decompression_time = 0
+
+    @staticmethod
+    def now():
+        """ :return: the current time in nanoseconds, pass differences to :meth:`record` """
+        return time.perf_counter_ns()
+
+    def record(self, method, nanoseconds, error=False):
+        """
+        records a finished call
+        :param method: the name of the method
+        :param nanoseconds: the time from receiving the request to its result
+        :param error: True if the call failed
+        """
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods.setdefault(method, MethodStats())
+        stats.calls += 1
+        if error:
+            stats.errors += 1
+        stats.latency.record(nanoseconds)
+
+    def record_writes(self, writes, frames):
+        """
+        records frames sent to a connection
+        :param writes: the number of writes (system calls) it took
+        :param frames: the number of frames sent
+        """
+        self.writes += writes
+        self.frames_out += frames
+
+    def record_compression(self, length, compressed_length, nanoseconds):
+        """ records a compressed payload, of `length` bytes before and
+        `compressed_length` bytes after compressing """
+        self.compressed += 1
+        self.compressed_bytes_in += length
+        self.compressed_bytes_out += compressed_length
+        self.compression_time += nanoseconds
+
+    def record_decompression(self, nanoseconds):
+        """ records a decompressed payload """
+        self.decompressed += 1
+        self.decompression_time += nanoseconds
+
+    def stats(self):
+        """ :return: a dict of all metrics, which can be encoded by all codecs """
+        return {'uptime': time.monotonic() - self.started,
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'writes': self.writes,
+                'frames_out': self.frames_out,
+                # below 1 if frames got coalesced, above 1 if frames took several writes
+                'writes_per_frame': (self.writes / self.frames_out if self.frames_out
+                                     else None),
+                'compression': {
+                    'compressed': self.compressed,
+                    # the original size by the compressed size
+                    'ratio': (self.compressed_bytes_in / self.compressed_bytes_out
+                              if self.compressed_bytes_out else None),
+                    'seconds': self.compression_time / 1e9,
+                    'decompressed': self.decompressed,
+                    'decompression_seconds': self.decompression_time / 1e9},
+                'methods': {name: stats.stats()
+                            for name, stats in list(self.methods.items())}}
@@ -0,0 +1,137 @@
+""" Background execution of JSON-RPC notifications, which are requests without an id that
+never get a response. The client does not wait for them, so the server queues them
+instead of blocking the connection. The queues are bounded, notifications arriving
+while a queue is full are dropped and counted. """
+import asyncio
+import inspect
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1024
+
+
+class NotificationCounters:
+    """ counters of the notifications handled by an executor """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        """ :return: a dict of all counters """
+        with self._lock:
+            return {'received': self.received, 'dropped': self.dropped,
+                    'failed': self.failed}
+
+
+class NotificationExecutor:
+    """ executes notifications on background threads fed by a bounded queue. With a
+    single worker (the default) notifications are executed in the order they arrived. """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, workers=1):
+        """
+        :param queue_size: the maximum number of notifications waiting for execution
+        :param workers: the number of threads executing notifications
+        """
+        self.counters = NotificationCounters()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = [threading.Thread(target=self._work, daemon=True,
+                                          name='bourne_rpc_notifications')
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        queues a notification without waiting for its execution
+        :return: False if the notification got dropped because the queue is full
+        """
+        self.counters.increment('received')
+        try:
+            self._queue.put_nowait((method, args, kwargs))
+        except queue.Full:
+            self.counters.increment('dropped')
+            logger.warning('notification queue is full, dropping call of %s', method)
+            return False
+        return True
+
+    @property
+    def queue_depth(self):
+        """ the number of notifications waiting for execution """
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True):
+        """ stops the workers after the queued notifications got executed """
+        for _ in self._workers:
+            self._queue.put((None, None, None))
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _work(self):
+        while 1:
+            method, args, kwargs = self._queue.get()
+            if method is None:
+                return
+            try:
+                method(*args, **kwargs)
+            except Exception:
+                self.counters.increment('failed')
+                logger.exception('Failed to handle notification')
+
+
+class AsyncNotificationExecutor:
+    """ executes notifications as tasks on the running event loop, limiting the number of
+    pending tasks """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param queue_size: the maximum number of notifications pending at the same time
+        """
+        self.counters = NotificationCounters()
+        self.queue_size = queue_size
+        self._tasks = set()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        schedules a notification without waiting for its execution
+        :return: False if the notification got dropped because too many are pending
+        """
+        self.counters.increment('received')
+        if len(self._tasks) >= self.queue_size:
+            self.counters.increment('dropped')
+            logger.warning('too many pending notifications, dropping call of %s', method)
+            return False
+
+        task = asyncio.ensure_future(self._execute(method, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    @property
+    def queue_depth(self):
+        """ the number of notifications pending """
+        return len(self._tasks)
+
+    async def shutdown(self):
+        """ waits for all pending notifications """
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    async def _execute(self, method, args, kwargs):
+        try:
+            return_value = method(*args, **kwargs)
+            if inspect.isawaitable(return_value):
+                await return_value
+        except Exception:
+            self.counters.increment('failed')
+            logger.exception('Failed to handle notification')
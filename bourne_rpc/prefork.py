@@ -0,0 +1,147 @@
+""" Pre-fork mode spreading the load of CPU heavy methods across cores.
+
+A supervisor process owns the listening transport and forks worker processes, which all
+accept connections from the shared listening socket and serve them with a
+:class:`RpcServer` of their own. The kernel spreads the connections across the workers,
+so every worker has its own GIL. Workers which die are replaced. Stopping the supervisor
+lets every worker finish the requests in flight before it exits.
+
+Only available where `os.fork` is (not on Windows). Workers get a copy of the served
+object as it was when they got forked, state changed in one worker is not seen by the
+others. """
+import logging
+import os
+import signal
+import threading
+import time
+
+from .server import DEFAULT_DRAIN_TIMEOUT, RpcServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESTART_DELAY = 1.0
+SUPERVISOR_INTERVAL = 0.05
+
+
+class PreforkServer:
+    """ Supervisor of worker processes serving the same transport. """
+
+    def __init__(self, transport, obj, workers=None, drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+                 restart_delay=DEFAULT_RESTART_DELAY, **server_options):
+        """
+        :param transport: a bound transport, the workers accept connections from it
+        :param obj: the object whose methods are served
+        :param workers: the number of worker processes, defaults to the number of cores
+        :param drain_timeout: the number of seconds workers get to finish their requests
+        in flight when stopping, they get killed afterwards
+        :param restart_delay: the minimum number of seconds between a worker dying and
+        its replacement being started, to not fork in a tight loop if workers die on
+        startup
+        :param server_options: keyword arguments for the `RpcServer` of every worker
+        """
+        if not hasattr(os, 'fork'):
+            raise OSError('pre-fork mode requires os.fork')
+        self.transport = transport
+        self.obj = obj
+        self.workers = workers or os.cpu_count() or 1
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.server_options = server_options
+        self.restarts = 0
+        # pid -> time it got started
+        self._workers = {}
+        # points in time dead workers can be replaced at
+        self._pending_restarts = []
+        self._stopping = threading.Event()
+
+    @property
+    def worker_pids(self):
+        """ the process ids of the running workers """
+        return list(self._workers)
+
+    def serve(self):
+        """ starts the workers and supervises them until :meth:`stop` got called and all
+        of them exited. If called from the main thread, SIGTERM and SIGINT stop the
+        server. """
+        if threading.current_thread() is threading.main_thread():
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signal_number, lambda *_: self.stop())
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        deadline = None
+        try:
+            while self._workers or self._pending_restarts and not self._stopping.is_set():
+                self._reap()
+                if self._stopping.is_set():
+                    if deadline is None:
+                        deadline = time.monotonic() + self.drain_timeout
+                    elif time.monotonic() > deadline:
+                        self._signal_workers(signal.SIGKILL)
+                else:
+                    self._restart()
+                time.sleep(SUPERVISOR_INTERVAL)
+        finally:
+            self.transport.close()
+
+    def stop(self):
+        """ asks all workers to stop accepting connections and to exit once their
+        requests in flight are finished, :meth:`serve` returns after they exited """
+        self._stopping.set()
+        self._signal_workers(signal.SIGTERM)
+
+    def _signal_workers(self, signal_number):
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signal_number)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = self._run_worker()
+            except BaseException:
+                logger.exception('worker failed')
+            finally:
+                os._exit(exit_code)
+        logger.info('started worker %s', pid)
+        self._workers[pid] = time.monotonic()
+
+    def _reap(self):
+        """ forgets about exited workers and schedules their replacement """
+        while self._workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            if self._workers.pop(pid, None) is None:
+                continue
+            if not self._stopping.is_set():
+                logger.warning('worker %s exited unexpectedly (status %s), restarting it',
+                               pid, status)
+                self._pending_restarts.append(time.monotonic() + self.restart_delay)
+
+    def _restart(self):
+        now = time.monotonic()
+        due = [restart for restart in self._pending_restarts if restart <= now]
+        for restart in due:
+            self._pending_restarts.remove(restart)
+            self.restarts += 1
+            self._spawn()
+
+    def _run_worker(self):
+        """ serves in a forked worker until it gets SIGTERM
+        :return: the exit code """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server = RpcServer(self.transport, self.obj, **self.server_options)
+        signal.signal(signal.SIGTERM, lambda *_: server.stop())
+        try:
+            server.serve()
+        finally:
+            # the connections are served on threads which are killed on exit
+            if not server.shutdown(self.drain_timeout):
+                logger.warning('worker %s exits with requests in flight', os.getpid())
+        return 0
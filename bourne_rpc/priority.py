@@ -0,0 +1,201 @@
+""" Priority lanes for the methods of a :class:`RpcServer`, so bulk work does not starve
+the calls a user is waiting for.
+
+Every request is queued in a lane, `interactive`, `default` or `bulk`, chosen with
+`@rpc_method(priority=...)` or by the `priority` member of the request. A free worker
+takes the request waiting in the most important lane, but every lane only gets a limited
+number of workers at the same time and some workers are reserved for interactive calls,
+so these find a worker even while everything else is busy. Requests age while they wait:
+every `aging` seconds of waiting count as one lane more important, which keeps bulk work
+from being starved by a steady stream of more important calls.
+
+The time requests wait in the queue is measured per lane, see
+:meth:`PriorityExecutor.lane_stats`::
+
+    server = RpcServer(transport, obj, executor=PriorityExecutor(max_workers=8))
+"""
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+from .metrics import LatencyHistogram
+
+LANE_INTERACTIVE = 'interactive'
+LANE_DEFAULT = 'default'
+LANE_BULK = 'bulk'
+# from the most to the least important
+LANES = (LANE_INTERACTIVE, LANE_DEFAULT, LANE_BULK)
+
+DEFAULT_AGING = 1.0
+
+
+class LaneStats:
+    """ counters and the queue wait times of a lane """
+
+    __slots__ = ('submitted', 'queued', 'running', 'wait')
+
+    def __init__(self):
+        self.submitted = 0
+        self.queued = 0
+        self.running = 0
+        self.wait = LatencyHistogram()
+
+    def stats(self):
+        """ :return: a dict of the counters and the mean, p50, p90 and p99 wait time in
+        seconds """
+        stats = {'submitted': self.submitted, 'queued': self.queued,
+                 'running': self.running}
+        stats.update({'wait_' + key: value for key, value in self.wait.stats().items()})
+        return stats
+
+
+class PriorityExecutor(concurrent.futures.Executor):
+    """ a thread pool executing calls by the priority of their lane, see
+    :mod:`bourne_rpc.priority` """
+
+    def __init__(self, max_workers=None, reserved=1, lane_workers=None,
+                 aging=DEFAULT_AGING, thread_name_prefix='bourne_rpc'):
+        """
+        :param max_workers: the number of threads, defaults to the default of
+        `ThreadPoolExecutor`
+        :param reserved: the number of workers only interactive calls may use
+        :param lane_workers: a dict mapping lanes to the maximum number of workers
+        executing calls of the lane at the same time. By default interactive calls may
+        use all workers, default calls all but the reserved ones and bulk calls half of
+        them.
+        :param aging: the number of seconds of waiting after which a call is treated
+        like one of the next more important lane, None to never promote calls
+        """
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if not 0 <= reserved < max_workers:
+            raise ValueError('reserved must leave at least one worker for other lanes')
+        shared = max_workers - reserved
+        self.max_workers = max_workers
+        self.reserved = reserved
+        self.lane_workers = {LANE_INTERACTIVE: max_workers, LANE_DEFAULT: shared,
+                             LANE_BULK: max(1, shared // 2)}
+        if lane_workers:
+            unknown = set(lane_workers) - set(LANES)
+            if unknown:
+                raise ValueError('unknown lanes {}'.format(sorted(unknown)))
+            self.lane_workers.update(lane_workers)
+        for lane in LANES[1:]:
+            self.lane_workers[lane] = min(self.lane_workers[lane], shared)
+        self.aging = aging
+        self.thread_name_prefix = thread_name_prefix
+        self._lanes = {lane: collections.deque() for lane in LANES}
+        self._stats = {lane: LaneStats() for lane in LANES}
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """ queues a call in the default lane, see :meth:`submit_to` """
+        return self.submit_to(LANE_DEFAULT, fn, *args, **kwargs)
+
+    def submit_to(self, lane, fn, *args, **kwargs):
+        """
+        queues a call in a lane
+        :param lane: one of :data:`LANES`, None for the default lane
+        :return: a `concurrent.futures.Future` of its result
+        :raise ValueError: if the lane is unknown
+        :raise RuntimeError: after shutdown
+        """
+        lane = LANE_DEFAULT if lane is None else lane
+        if lane not in self._lanes:
+            raise ValueError('unknown lane {}'.format(lane))
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new calls after shutdown')
+            self._lanes[lane].append((time.monotonic(), next(self._order), future, fn,
+                                      args, kwargs))
+            stats = self._stats[lane]
+            stats.submitted += 1
+            stats.queued += 1
+            self._condition.notify_all()
+            queued = sum(lane_stats.queued for lane_stats in self._stats.values())
+            if self._idle < queued and len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work, daemon=True,
+                    name='{}_{}'.format(self.thread_name_prefix, len(self._threads)))
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for lane, queued in self._lanes.items():
+                    for item in queued:
+                        item[2].cancel()
+                    self._stats[lane].queued -= len(queued)
+                    queued.clear()
+            self._condition.notify_all()
+        if wait:
+            for thread in list(self._threads):
+                thread.join()
+
+    def lane_stats(self):
+        """ :return: a dict mapping lanes to their counters and queue wait times """
+        return {lane: stats.stats() for lane, stats in self._stats.items()}
+
+    def _next(self, now):
+        """ :return: the lane whose oldest call is to be executed next, None if no call
+        may run now. Called with the lock held. """
+        best = best_rank = None
+        # the reserved workers are left to interactive calls
+        shared_left = (self.max_workers - self.reserved -
+                       sum(self._stats[lane].running for lane in LANES[1:]))
+        for index, lane in enumerate(LANES):
+            queued = self._lanes[lane]
+            if not queued or self._stats[lane].running >= self.lane_workers[lane]:
+                continue
+            if lane != LANE_INTERACTIVE and shared_left <= 0:
+                continue
+            queued_at, order = queued[0][:2]
+            rank = index
+            if self.aging:
+                rank -= (now - queued_at) / self.aging
+            if best is None or (rank, order) < best_rank:
+                best, best_rank = lane, (rank, order)
+        return best
+
+    def _work(self):
+        while 1:
+            with self._condition:
+                while 1:
+                    lane = self._next(time.monotonic())
+                    if lane is not None:
+                        break
+                    if self._shutdown and not any(self._lanes.values()):
+                        return
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                queued_at, _, future, fn, args, kwargs = self._lanes[lane].popleft()
+                stats = self._stats[lane]
+                stats.queued -= 1
+                stats.running += 1
+                stats.wait.record(int((time.monotonic() - queued_at) * 1e9))
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._condition:
+                    stats.running -= 1
+                    # a lane at its limit might be able to run again
+                    self._condition.notify_all()
@@ -0,0 +1,197 @@
+""" Server push of events to subscribed connections. Clients subscribe to topics with the
+built-in method `rpc.subscribe` and receive every event published to one of them as a
+JSON-RPC notification, with the topic as method, over their existing connection.
+
+Every subscriber has a bounded queue of pending events. Events published with a key are
+coalesced with a pending event of the same topic and key, so a slow subscriber only gets
+the latest state instead of every intermediate one. Events without a key are all queued.
+If the queue is full the oldest event is dropped. """
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+
+from . import framing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def event_notification(topic, params):
+    """ :return: the JSON-RPC notification carrying an event """
+    notification = {'jsonrpc': '2.0', 'method': topic}
+    if params is not None:
+        notification['params'] = params
+    return notification
+
+
+class PendingEvents:
+    """ the bounded queue of events pending for a subscriber, coalescing events with a
+    key by topic and key. Not thread safe by itself. """
+
+    def __init__(self, queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.coalesced = 0
+        self.dropped = 0
+        # (topic, key) -> (topic, params), oldest first
+        self._events = collections.OrderedDict()
+        # stands in for the key of events without one, so they are never coalesced
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._events)
+
+    def push(self, topic, params, key=None):
+        """
+        :param key: pending events with the same topic and key are coalesced, None never
+            coalesces
+        """
+        if key is None:
+            event_key = (None, next(self._sequence))
+        else:
+            event_key = (topic, key)
+        if event_key in self._events:
+            # the newer event replaces the pending one, keeping its place in the queue
+            self._events[event_key] = (topic, params)
+            self.coalesced += 1
+            return
+        if len(self._events) >= self.queue_size:
+            self._events.popitem(last=False)
+            self.dropped += 1
+        self._events[event_key] = (topic, params)
+
+    def pop(self):
+        """ :return: a tuple of topic and params of the oldest event """
+        return self._events.popitem(last=False)[1]
+
+
+class Subscriber:
+    """ the subscriptions of a connection of a :class:`RpcServer`, events are sent by a
+    thread of their own so a slow connection never blocks the publisher """
+
+    def __init__(self, connection, codec, queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        """
+        :param connection: the `Connection` to send the events over
+        :param codec: the codec to encode the events with
+        :param queue_size: the maximum number of pending events
+        """
+        self.connection = connection
+        self.codec = codec
+        self.topics = set()
+        self.pending = PendingEvents(queue_size)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._send_events, daemon=True,
+                                        name='bourne_rpc_subscriber')
+        self._thread.start()
+
+    def push(self, topic, params=None, key=None):
+        """ queues an event for sending """
+        with self._condition:
+            if self._closed:
+                return
+            self.pending.push(topic, params, key)
+            self._condition.notify()
+
+    def close(self):
+        """ stops sending, pending events are dropped """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _send_events(self):
+        while 1:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or self.pending)
+                if self._closed:
+                    return
+                topic, params = self.pending.pop()
+            message = self.codec.encode(event_notification(topic, params))
+            if not self.connection.send(message, framing.codec_flags(self.codec.codec_id)):
+                self.close()
+
+
+class AsyncSubscriber:
+    """ the subscriptions of a connection of an :class:`AsyncRpcServer`, events are sent
+    by a task of their own. All methods have to be called on the event loop. """
+
+    def __init__(self, connection, codec, queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        """
+        :param connection: the `AsyncConnection` to send the events over
+        :param codec: the codec to encode the events with
+        :param queue_size: the maximum number of pending events
+        """
+        self.connection = connection
+        self.codec = codec
+        self.topics = set()
+        self.pending = PendingEvents(queue_size)
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._send_events())
+
+    def push(self, topic, params=None, key=None):
+        """ queues an event for sending """
+        if self._task.done():
+            return
+        self.pending.push(topic, params, key)
+        self._ready.set()
+
+    def close(self):
+        """ stops sending, pending events are dropped """
+        self._task.cancel()
+
+    async def _send_events(self):
+        while 1:
+            await self._ready.wait()
+            while self.pending:
+                topic, params = self.pending.pop()
+                message = self.codec.encode(event_notification(topic, params))
+                if not await self.connection.send(
+                        message, framing.codec_flags(self.codec.codec_id)):
+                    return
+            self._ready.clear()
+
+
+class PubSub:
+    """ maps topics to their subscribers """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = collections.defaultdict(set)
+
+    def subscribe(self, subscriber, topics):
+        with self._lock:
+            for topic in topics:
+                self._subscribers[topic].add(subscriber)
+                subscriber.topics.add(topic)
+
+    def unsubscribe(self, subscriber, topics=None):
+        """ :param topics: the topics to unsubscribe from, None for all of them """
+        with self._lock:
+            for topic in list(subscriber.topics if topics is None else topics):
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[topic]
+                subscriber.topics.discard(topic)
+
+    def subscriber_count(self, topic):
+        """ :return: the number of connections subscribed to a topic """
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+    def publish(self, topic, params=None, key=None):
+        """
+        queues an event for all subscribers of the topic
+        :param params: the params of the notification
+        :param key: pending events with the same topic and key are coalesced, events
+        without a key are all queued
+        :return: the number of subscribers the event was queued for
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscriber in subscribers:
+            subscriber.push(topic, params, key)
+        return len(subscribers)
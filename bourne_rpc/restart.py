@@ -0,0 +1,87 @@
+""" Hot restart: the listening socket is handed over to a new process of the server, so a
+deploy neither refuses connections nor drops requests.
+
+The running server starts its successor with :func:`spawn_successor`, which inherits the
+listening socket and finds it in the environment variable `BOURNE_RPC_LISTEN_FD`. The
+successor creates its transport with :func:`listening_transport`, which adopts the
+inherited socket instead of binding a new one. From then on both processes accept
+connections from the same socket, until the old one shuts down gracefully and finishes
+its requests in flight::
+
+    transport = listening_transport(UnixSocket, path)
+    server = RpcServer(transport, obj)
+
+    def restart(*_):
+        spawn_successor(transport)
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGHUP, restart)
+    server.serve()
+
+Connections waiting in the backlog while neither process accepts are not lost. Only
+available for socket based transports (not for named pipes). """
+import logging
+import os
+import socket
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+LISTEN_FD_VARIABLE = 'BOURNE_RPC_LISTEN_FD'
+
+
+def inherited_socket(environ=None):
+    """
+    :param environ: the environment to look into, defaults to `os.environ`. The variable
+    is removed, so it's not handed down to further child processes.
+    :return: the listening socket handed over by the predecessor, None if there is none
+    """
+    environ = os.environ if environ is None else environ
+    fd = environ.pop(LISTEN_FD_VARIABLE, None)
+    if fd is None:
+        return None
+    return socket.socket(fileno=int(fd))
+
+
+def listening_transport(transport_class, address, **options):
+    """
+    :param transport_class: e.g. `UnixSocket` or `TcpSocket`
+    :param address: the path or address to listen on
+    :param options: keyword arguments for the transport
+    :return: a listening transport, either adopting the socket inherited from the
+    predecessor or bound to the address
+    """
+    sock = inherited_socket()
+    if sock is not None:
+        logger.info('adopting the listening socket of the predecessor')
+        # the path of a unix socket must not be unlinked, the socket is still reachable
+        return transport_class(address, sock=sock, **options)
+    transport = transport_class(address, **options)
+    transport.bind()
+    return transport
+
+
+def spawn_successor(transport, args=None, env=None):
+    """
+    starts a new process of the server, inheriting the listening socket of the transport.
+    Shut down this server afterwards, see :meth:`RpcServer.shutdown`.
+    :param args: the command line of the new process, defaults to the one of this
+    process
+    :param env: the environment of the new process, defaults to the one of this process
+    :return: the `subprocess.Popen` of the new process
+    :raise OSError: if the transport is not socket based
+    """
+    sock = getattr(transport, 'socket', None)
+    if sock is None:
+        raise OSError('hot restart requires a socket based transport')
+    if args is None:
+        # the original arguments keep `-m package` intact
+        args = [sys.executable] + (sys.orig_argv[1:] if hasattr(sys, 'orig_argv')
+                                   else sys.argv)
+    fd = sock.fileno()
+    env = dict(os.environ if env is None else env)
+    env[LISTEN_FD_VARIABLE] = str(fd)
+    process = subprocess.Popen(args, env=env, pass_fds=(fd,))
+    logger.info('started successor %s', process.pid)
+    return process
@@ -1,82 +1,1000 @@
 import contextlib
-import json
-import struct
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
 import threading
 import logging
 import os
+import socket
 
-from . import exceptions
+from . import compression, exceptions, framing, priority
+from .backpressure import InflightLimiter
+from .cache import ResponseCache
+from .codecs import CODEC_JSON, EncodedResult, default_codecs
+from .connection import Connection
+from .deadlines import DeadlineScheduler
+from .dispatch import DispatchTable
+from .metrics import ServerMetrics
+from .notifications import DEFAULT_QUEUE_SIZE, NotificationExecutor
+from .pubsub import DEFAULT_SUBSCRIBER_QUEUE_SIZE, PubSub, Subscriber
+from .singleflight import SingleFlight
+from .streaming import (DEFAULT_STREAM_CHUNK_SIZE, StreamGate, chunk_message, chunked,
+                        close_iterator, collect)
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_INFLIGHT = 1024
+DEFAULT_MAX_CONNECTIONS = 256
+DEFAULT_SEND_TIMEOUT = 30
+DEFAULT_MAX_INFLIGHT_PER_CONNECTION = 64
+DEFAULT_DRAIN_TIMEOUT = 30
+# the number of seconds accepting waits before checking whether the server got stopped
+ACCEPT_INTERVAL = 0.1
+
 
 def validate_request(request):
     """ Checks if a request fullfills the JSON-RPC 2.0 specs.
     :param request a dict
     :raise InvalidRequestError"""
 
+    if not isinstance(request, dict):
+        raise exceptions.InvalidRequestError('request is not an object')
+
     if not request.get('jsonrpc') == '2.0':
         raise exceptions.InvalidRequestError('jsonrpc field is missing or not set to 2.0')
 
-    for field in ['id', 'method']:
-        if field not in request:
-            raise exceptions.InvalidRequestError(
-                '{} is missing in request object'.format(field))
+    # the id is optional, requests without one are notifications
+    if 'method' not in request:
+        raise exceptions.InvalidRequestError('method is missing in request object')
+
 
+class BaseRpcServer:
+    """ protocol handling shared by :class:`RpcServer` and :class:`AsyncRpcServer`, that
+    is everything independent of how connections and method calls are scheduled """
 
-class RpcServer:
-    def __init__(self, transport, obj):
+    def __init__(self, transport, obj, codecs=None, methods=None, cache=None,
+                 subscriber_queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE,
+                 stream_chunk_size=DEFAULT_STREAM_CHUNK_SIZE, metrics=True,
+                 default_timeout=None, compressors=None,
+                 compression_threshold=compression.DEFAULT_COMPRESSION_THRESHOLD,
+                 max_frame_size=framing.DEFAULT_MAX_FRAME_SIZE):
+        """
+        :param transport: the transport to accept connections from
+        :param obj: the object whose methods are served
+        :param codecs: a dict mapping codec ids to the codecs the server understands,
+        defaults to all codecs available with the installed packages
+        :param methods: the names of the methods of obj to expose if none of them is
+        decorated with `rpc_method`, defaults to all public methods
+        :param cache: the `ResponseCache` for the results of methods decorated with
+        `rpc_method(cache=True)`, defaults to a cache with the default budget
+        :param subscriber_queue_size: the maximum number of events pending for a
+        subscribed connection, the oldest ones are dropped beyond
+        :param stream_chunk_size: the maximum number of items in a chunk frame of a
+        streamed result, see :mod:`bourne_rpc.streaming`
+        :param metrics: collect metrics of the calls, see :meth:`stats`
+        :param default_timeout: the number of seconds a request may take unless its
+        method is decorated with another `timeout`, None for no limit. Requests may ask
+        for less with a `timeout` member.
+        :param compressors: a dict mapping names to the compressors clients may
+        negotiate with `rpc.negotiate`, defaults to all available with the installed
+        packages. An empty dict refuses compression.
+        :param compression_threshold: the minimum size of responses compressed on
+        connections which negotiated compression
+        :param max_frame_size: the maximum length of a request frame (after
+        decompression), connections sending a longer one are closed
+        """
         self.transport = transport
         self.obj = obj
+        self.codecs = codecs if codecs is not None else default_codecs()
+        self.dispatch = DispatchTable(obj, methods)
+        self.cache = cache if cache is not None else ResponseCache()
+        self.flights = SingleFlight()
+        self.pubsub = PubSub()
+        self.subscriber_queue_size = subscriber_queue_size
+        self.stream_chunk_size = stream_chunk_size
+        self.metrics = ServerMetrics() if metrics else None
+        self.default_timeout = default_timeout
+        self.compressors = (compressors if compressors is not None
+                            else compression.default_compressors())
+        self.compression_threshold = compression_threshold
+        self.max_frame_size = max_frame_size
+        # methods of the server itself, JSON-RPC reserves the `rpc.` prefix for them
+        self.builtins = {'rpc.subscribe': self.rpc_subscribe,
+                         'rpc.unsubscribe': self.rpc_unsubscribe,
+                         'rpc.stats': self.rpc_stats,
+                         'rpc.cancel': self.rpc_cancel,
+                         'rpc.negotiate': self.rpc_negotiate}
+
+    def get_codec(self, flags):
+        """ :return: the codec marked in the flags of a frame, None if it is unknown """
+        return self.codecs.get(framing.codec_id(flags))
+
+    def decode_request(self, codec, payload):
+        """
+        :return: the decoded request or None if it could not be decoded
+        """
+        try:
+            request_msg = codec.decode(payload)
+        except Exception:
+            logger.exception("Failed to decode request")
+            return None
+        logger.debug('--> %s', request_msg)
+        return request_msg
+
+    def resolve(self, request_msg):
+        """
+        validates a request, looks up the method and checks the params against its
+        signature
+        :return: a tuple of the dispatch table entry, the positional and the named args
+        :raise RequestError
+        """
+        if self.metrics is not None:
+            self.metrics.requests += 1
+        try:
+            validate_request(request_msg)
+            entry = self.dispatch.lookup(request_msg['method'])
+            args, kwargs = entry.bind(request_msg.get('params'))
+        except exceptions.RequestError:
+            if self.metrics is not None:
+                self.metrics.rejected += 1
+            raise
+        return entry, args, kwargs
+
+    def request_timeout(self, entry, request_msg):
+        """
+        :return: the number of seconds a request may take, the lower one of the timeout
+        of its method and the `timeout` member of the request. None for no limit.
+        :raise InvalidRequestError: if the timeout of the request is not a number
+        """
+        timeout = entry.options.get('timeout', self.default_timeout)
+        if 'timeout' in request_msg:
+            requested = request_msg['timeout']
+            if isinstance(requested, bool) or not isinstance(requested, (int, float)):
+                raise exceptions.InvalidRequestError('timeout must be a number of seconds')
+            timeout = requested if timeout is None else min(timeout, requested)
+        return timeout
+
+    @staticmethod
+    def request_lane(entry, request_msg):
+        """
+        :return: the priority lane of a request, the `priority` member of the request or
+        else the priority of its method. None for the default lane.
+        :raise InvalidRequestError: if the priority of the request is unknown
+        """
+        lane = request_msg.get('priority', entry.options.get('priority'))
+        if lane is not None and lane not in priority.LANES:
+            raise exceptions.InvalidRequestError(
+                'priority must be one of {}'.format(', '.join(priority.LANES)))
+        return lane
+
+    def rpc_cancel(self, connection, codec, params):
+        """
+        built-in `rpc.cancel`, cancels a pending request of the same connection given by
+        its id (params `[id]` or `{"id": id}`). The request is answered with an error
+        right away, it is dropped if it did not start yet.
+        :return: True if the request was still pending
+        """
+        if isinstance(params, dict):
+            params = [params.get('id')]
+        if not isinstance(params, list) or len(params) != 1:
+            raise exceptions.InvalidParamsError('expects the id of a request')
+        key = cancellable_id(params[0])
+        if connection is None or key is None:
+            return False
+        cancel = connection.cancel_callbacks.get(key)
+        if cancel is None:
+            return False
+        cancel()
+        return True
+
+    def rpc_negotiate(self, connection, codec, params):
+        """
+        built-in `rpc.negotiate`, agrees on features of the connection. Params are an
+        object with `compression`, the names of the algorithms the client supports in
+        the order of its preference.
+        :return: an object with `compression`, the chosen algorithm (None for no
+        compression) and `compression_threshold`, the minimum size of compressed
+        payloads
+        """
+        if not isinstance(params, dict):
+            raise exceptions.InvalidParamsError('expects an object of features')
+        offered = params.get('compression') or []
+        if not isinstance(offered, list):
+            raise exceptions.InvalidParamsError('compression must be a list of names')
+        compressor = compression.choose(offered, self.compressors)
+        if connection is not None:
+            connection.compress_with(compressor, self.compression_threshold)
+        return {'compression': compressor.name if compressor is not None else None,
+                'compression_threshold': self.compression_threshold}
+
+    @staticmethod
+    def register_cancel(connection, request_msg, cancel):
+        """
+        makes a pending request cancellable by `rpc.cancel`
+        :param cancel: called without arguments to cancel the request
+        :return: a function to call once the request got answered
+        """
+        key = cancellable_id(request_msg.get('id'))
+        if connection is None or key is None:
+            return lambda *_: None
+        connection.cancel_callbacks[key] = cancel
+
+        def forget(*_):
+            if connection.cancel_callbacks.get(key) is cancel:
+                del connection.cancel_callbacks[key]
+        return forget
+
+    def start_timer(self):
+        """ :return: the start time of a call to pass to :meth:`record_call`, None if
+        metrics are disabled """
+        if self.metrics is None:
+            return None
+        return self.metrics.now()
+
+    def record_call(self, entry, started, error=False):
+        """ records the latency of a finished call started at `started` """
+        if started is not None:
+            self.metrics.record(entry.name, self.metrics.now() - started, error)
+
+    def _count(self, counter):
+        """ increments a counter of the metrics, if enabled """
+        if self.metrics is not None:
+            setattr(self.metrics, counter, getattr(self.metrics, counter) + 1)
+
+    def stats(self):
+        """
+        :return: a dict of the metrics of the server: the number of connections, the
+        requests in flight, counters of notifications, of the cache and of single flight
+        calls and, if enabled, requests, bytes in and out and calls, errors and latency
+        percentiles (in seconds) per method
+        """
+        stats = {'connections': self.connection_count, 'queue_depth': self.queue_depth,
+                 'notifications': self.notifications.counters.stats(),
+                 'cache': self.cache.counters.stats(),
+                 'single_flight': self.flights.counters.stats()}
+        lane_stats = getattr(getattr(self, 'executor', None), 'lane_stats', None)
+        if lane_stats is not None:
+            stats['lanes'] = lane_stats()
+        if self.metrics is not None:
+            stats.update(self.metrics.stats())
+        return stats
+
+    def rpc_stats(self, connection, codec, params):
+        """ built-in `rpc.stats`, see :meth:`stats` """
+        return self.stats()
+
+    def is_builtin(self, request_msg):
+        """ :return: True if the request calls a built-in method of the server """
+        method = request_msg.get('method') if isinstance(request_msg, dict) else None
+        return isinstance(method, str) and method in self.builtins
+
+    def call_builtin(self, request_msg, codec, connection):
+        """
+        executes a built-in method right away, they only touch the state of the server
+        :param connection: the connection the request came from
+        :return: the response object, None for notifications
+        """
+        try:
+            validate_request(request_msg)
+            result = self.builtins[request_msg['method']](connection, codec,
+                                                          request_msg.get('params'))
+        except Exception as e:
+            return self.error_response_for(request_msg, e)
+        if is_notification(request_msg):
+            return None
+        return result_response(request_msg, result)
+
+    def rpc_subscribe(self, connection, codec, params):
+        """
+        built-in `rpc.subscribe`, subscribes the connection to the topics given as params,
+        events are sent with the codec of this request
+        :return: all topics the connection is subscribed to
+        """
+        topics = topics_param(params)
+        if not topics:
+            raise exceptions.InvalidParamsError('no topics to subscribe to')
+        if connection is None:
+            raise exceptions.InvalidRequestError('subscribing requires a connection')
+        if connection.subscriber is None:
+            connection.subscriber = self.new_subscriber(connection, codec)
+        self.pubsub.subscribe(connection.subscriber, topics)
+        return sorted(connection.subscriber.topics)
+
+    def rpc_unsubscribe(self, connection, codec, params):
+        """
+        built-in `rpc.unsubscribe`, unsubscribes the connection from the topics given as
+        params, from all topics without params
+        :return: the topics the connection is still subscribed to
+        """
+        topics = topics_param(params) or None
+        if connection is None or connection.subscriber is None:
+            return []
+        self.pubsub.unsubscribe(connection.subscriber, topics)
+        return sorted(connection.subscriber.topics)
+
+    def new_subscriber(self, connection, codec):
+        """ :return: a subscriber sending events over the connection """
+        raise NotImplementedError
+
+    def close_subscriber(self, connection):
+        """ drops the subscriptions of a closed connection """
+        if connection.subscriber is not None:
+            self.pubsub.unsubscribe(connection.subscriber)
+            connection.subscriber.close()
+
+    def publish(self, topic, params=None, key=None):
+        """
+        sends an event to all connections subscribed to the topic, as a notification
+        with the topic as method. Returns right away, the event is queued per connection.
+        :param params: the params of the notification
+        :param key: events of the topic with the same key still pending for a connection
+        are coalesced into the latest one. Events without a key are never coalesced.
+        :return: the number of connections the event is queued for
+        """
+        return self.pubsub.publish(topic, params, key)
+
+    def cache_key(self, entry, request_msg, codec):
+        """ :return: the key of the cached result of a request, None if the method is not
+        cached """
+        if (not entry.options.get('cache') or entry.streaming or
+                is_notification(request_msg)):
+            return None
+        return self.call_key(entry, request_msg, codec)
+
+    def call_key(self, entry, request_msg, codec):
+        """ :return: the key of a call by its params, None if the params have none, e.g.
+        maps whose keys can't be ordered, see :func:`bourne_rpc.cache.canonical_key` """
+        try:
+            return self.cache.key(entry.name, request_msg.get('params'), codec.codec_id)
+        except (TypeError, ValueError):
+            return None
+
+    def cache_result(self, key, entry, codec, result, generation):
+        """
+        encodes a result and stores it in the cache
+        :param generation: the generation of the cache before the method was called
+        :return: the result to put into the response
+        """
+        result = self.encode_result(codec, result)
+        if isinstance(result, EncodedResult):
+            self.cache.put(key, result.data, entry.options.get('cache_ttl'), generation)
+        return result
+
+    @staticmethod
+    def encode_result(codec, result):
+        """
+        :return: the result as :class:`EncodedResult`, which can be put into several
+        responses without encoding it again. The result itself if it can't be encoded.
+        """
+        try:
+            return EncodedResult(codec.encode(result))
+        except Exception:
+            # leaving the error response to encode_response
+            return result
+
+    def flight_key(self, entry, request_msg, codec):
+        """ :return: the key of the shared call of a request, None if the method is not
+        single flight or the params have no key, see :meth:`call_key` """
+        if (not entry.options.get('single_flight') or entry.streaming or
+                is_notification(request_msg)):
+            return None
+        return self.call_key(entry, request_msg, codec)
+
+    def finish_shared(self, cache_key, entry, codec, result, generation):
+        """ :return: the encoded result of a shared call, stored in the cache as well if
+        the method is cached """
+        if cache_key is not None:
+            return self.cache_result(cache_key, entry, codec, result, generation)
+        return self.encode_result(codec, result)
+
+    def invalidate(self, method=None, params=None):
+        """ removes cached results, see :meth:`ResponseCache.invalidate` """
+        self.cache.invalidate(method, params)
+
+    def error_response_for(self, request_msg, error):
+        """
+        :param error: the exception the request failed with
+        :return: the error response of a failed request, None for notifications which
+        are not answered even if they fail (unless they are invalid requests)
+        """
+        if isinstance(error, exceptions.RequestError):
+            # the fault of the client, no need for a traceback
+            logger.debug('Rejected request: %s', error)
+            response = error_response(request_id(request_msg), error.code, error.message)
+            if str(error):
+                response['error']['data'] = str(error)
+        else:
+            logger.error("Failed to handle request", exc_info=error)
+            response = error_response(request_id(request_msg), exceptions.ERROR_INTERNAL,
+                                      'Unknown error.')
+
+        if (not isinstance(error, exceptions.InvalidRequestError) and
+                is_notification(request_msg)):
+            return None
+        return response
+
+    def encode_response(self, codec, response):
+        """
+        :param response: a response object or a list of them for batches
+        :return: the encoded response, an error response if it can't be encoded. None if
+        there is no response.
+        """
+        if response is None:
+            return None
+        try:
+            return codec.encode_response(response)
+        except Exception:
+            logger.exception("Failed to encode response")
+            if isinstance(response, list):
+                return codec.encode_response([self._encodable(codec, entry)
+                                              for entry in response])
+            return codec.encode_response(self._encodable(codec, response))
+
+    @staticmethod
+    def _encodable(codec, response):
+        """ :return: the response or an error response if it can't be encoded """
+        try:
+            codec.encode_response(response)
+        except Exception:
+            return error_response(response.get('id'), exceptions.ERROR_INTERNAL,
+                                  'Result could not be encoded.')
+        return response
+
+    @staticmethod
+    def empty_batch_response():
+        """ :return: the response to an empty batch, which is an invalid request """
+        return error_response(None, exceptions.InvalidRequestError.code,
+                              exceptions.InvalidRequestError.message)
+
+    def unknown_codec_response(self):
+        """ :return: the JSON encoded error response for a frame of an unknown codec """
+        return self.codecs[CODEC_JSON].encode(
+            error_response(None, exceptions.ERROR_PARSE, 'Unknown codec.'))
+
+
+class RpcServer(BaseRpcServer):
+    """ JSON-RPC server reading every connection on its own thread while the methods are
+    executed on a bounded executor. Readers stop reading from their connection while
+    the limit of requests in flight is reached, which pushes back on the clients
+    instead of queueing without bound. """
+
+    def __init__(self, transport, obj, codecs=None, methods=None, max_workers=None,
+                 notification_queue_size=DEFAULT_QUEUE_SIZE, executor=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_inflight=DEFAULT_MAX_INFLIGHT,
+                 max_inflight_per_connection=DEFAULT_MAX_INFLIGHT_PER_CONNECTION,
+                 pipelined=False, cache=None,
+                 subscriber_queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE,
+                 stream_chunk_size=DEFAULT_STREAM_CHUNK_SIZE, shm_threshold=None,
+                 metrics=True, default_timeout=None, flush_delay=0, compressors=None,
+                 compression_threshold=compression.DEFAULT_COMPRESSION_THRESHOLD,
+                 max_frame_size=framing.DEFAULT_MAX_FRAME_SIZE,
+                 send_timeout=DEFAULT_SEND_TIMEOUT):
+        """
+        :param transport: the transport to accept connections from
+        :param obj: the object whose methods are served
+        :param codecs: a dict mapping codec ids to the codecs the server understands,
+        defaults to all codecs available with the installed packages
+        :param methods: the names of the methods of obj to expose if none of them is
+        decorated with `rpc_method`, defaults to all public methods
+        :param max_workers: the number of threads executing methods, defaults to the
+        default of `ThreadPoolExecutor`. Ignored if an executor is passed.
+        :param notification_queue_size: the maximum number of notifications waiting
+        for execution, further ones are dropped
+        :param executor: a `concurrent.futures.Executor` executing the methods instead
+        of the default thread pool, e.g. a `ProcessPoolExecutor` for CPU heavy methods
+        (in which case the served object has to be picklable) or a
+        :class:`PriorityExecutor` scheduling requests by their priority lane
+        :param max_connections: the maximum number of connections served at the same
+        time, no new connections are accepted while it is reached. Every connection
+        has a thread reading its requests. None for no limit.
+        :param max_inflight: the maximum number of requests in flight on the server
+        :param max_inflight_per_connection: the maximum number of requests in flight of
+        a single connection
+        :param pipelined: if True, reading from a connection goes on while its requests
+        are executed and responses are sent as soon as they are ready, possibly out of
+        order. Clients have to match responses by their id. Otherwise requests of a
+        connection are handled one after another.
+        :param cache: see :class:`BaseRpcServer`
+        :param subscriber_queue_size: see :class:`BaseRpcServer`
+        :param stream_chunk_size: see :class:`BaseRpcServer`. Streaming methods are
+        executed on the executor as well, which has to be thread based for them.
+        :param shm_threshold: the minimum size of responses passed to the client in a
+        shared memory segment, see :mod:`bourne_rpc.shm`. Only enable it if all clients
+        support it. Requests are accepted that way regardless.
+        :param metrics: see :class:`BaseRpcServer`
+        :param default_timeout: see :class:`BaseRpcServer`. Requests still waiting for
+        the executor at their deadline are dropped, the threads of running ones can't be
+        interrupted and finish in the background while the error is already answered.
+        Cancelling running requests works the same way.
+        :param flush_delay: the number of seconds a response may wait for further
+        responses of the same connection, to send them with a single write. It only
+        waits while responses to other requests or batches of the connection are pending,
+        which needs pipelining. Responses ready while another one is written are sent
+        together regardless.
+        :param compressors: see :class:`BaseRpcServer`
+        :param compression_threshold: see :class:`BaseRpcServer`. Responses passed in
+        shared memory are not compressed.
+        :param max_frame_size: see :class:`BaseRpcServer`. Requests passed in shared
+        memory are not limited.
+        :param send_timeout: the number of seconds sending a response may block, e.g. on
+        a client not reading its responses, before the connection is closed. Responses
+        are sent by the executor threads, which it would hold up otherwise. None for no
+        limit.
+        """
+        super().__init__(transport, obj, codecs, methods, cache, subscriber_queue_size,
+                         stream_chunk_size, metrics, default_timeout, compressors,
+                         compression_threshold, max_frame_size)
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers,
+                                          thread_name_prefix='bourne_rpc')
+        self.executor = executor
+        self.notifications = NotificationExecutor(queue_size=notification_queue_size)
+        self.deadlines = DeadlineScheduler()
+        # sends the errors of requests aborted at their deadline or by `rpc.cancel`
+        self._aborts = ThreadPoolExecutor(thread_name_prefix='bourne_rpc_aborts')
+        self.max_inflight_per_connection = max_inflight_per_connection
+        self.pipelined = pipelined
+        self.shm_threshold = shm_threshold
+        self.flush_delay = flush_delay
+        self.send_timeout = send_timeout
+        self._stopped = False
+        # the connections currently served, notified when one is closed
+        self._connections = set()
+        self._connections_changed = threading.Condition()
+        self._connection_limiter = InflightLimiter(max_connections)
+        self._inflight_limiter = InflightLimiter(max_inflight)
+
+    @property
+    def queue_depth(self):
+        """ the number of requests handed to the executor which did not finish yet """
+        return self._inflight_limiter.inflight
+
+    @property
+    def connection_count(self):
+        """ the number of connections currently served """
+        return self._connection_limiter.inflight
 
     def serve(self):
-        while 1:
+        sock = getattr(self.transport, 'socket', None)
+        if sock is not None:
+            # closing a socket does not wake up a thread blocked in accepting on every
+            # platform (e.g. Linux), and shutting down a listening socket would shut it
+            # down for all processes sharing it
+            sock.settimeout(ACCEPT_INTERVAL)
+        while not self._stopped:
+            self._connection_limiter.acquire()
             try:
                 transport, addr = self.transport.accept()
                 logger.info('Got new client from "%s"', addr)
-                threading.Thread(target=self.handler, args=(transport,)).start()
-            except WindowsError as ex:
-                if ex.winerror == 995:
+                threading.Thread(target=self._serve_connection, args=(transport,)).start()
+            except socket.timeout:
+                self._connection_limiter.release()
+            except OSError as ex:
+                self._connection_limiter.release()
+                if self._stopped or getattr(ex, 'winerror', None) == 995:
                     logger.debug("io got canceled, that means this is a shutdown request")
                     break
                 else:
                     raise
 
     def stop(self):
+        """ stops accepting connections, :meth:`serve` returns. Connections are still
+        served, see :meth:`shutdown`. """
+        self._stopped = True
         self.transport.close()
 
+    def shutdown(self, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        stops the server gracefully: stops accepting connections and reading requests,
+        answers the requests in flight, closes the connections and stops the executors
+        :param drain_timeout: the number of seconds requests in flight get to finish,
+        connections still busy afterwards are closed without their responses
+        :return: True if all requests in flight got answered
+        """
+        self.stop()
+        with self._connections_changed:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.stop_reading()
+
+        with self._connections_changed:
+            drained = self._connections_changed.wait_for(lambda: not self._connections,
+                                                         drain_timeout)
+            connections = list(self._connections)
+        if not drained:
+            logger.warning('closing %s connections with requests in flight',
+                           len(connections))
+            for connection in connections:
+                connection.close()
+
+        self.notifications.shutdown(wait=drained)
+        self._aborts.shutdown(wait=drained)
+        if self._own_executor:
+            # threads of methods still running can't be interrupted
+            self.executor.shutdown(wait=drained)
+        return drained
+
+    def wait_idle(self, timeout=None):
+        """
+        waits until no request is in flight anymore
+        :return: False if the timeout expired
+        """
+        return self._inflight_limiter.wait_idle(timeout)
+
+    def _serve_connection(self, com_socket):
+        try:
+            self.handler(com_socket)
+        finally:
+            self._connection_limiter.release()
+
+    def new_subscriber(self, connection, codec):
+        return Subscriber(connection, codec, self.subscriber_queue_size)
+
     def handler(self, com_socket):
-        with contextlib.closing(com_socket):
-            while 1:
+        connection = Connection(com_socket, self.max_inflight_per_connection,
+                                self.shm_threshold, self.flush_delay, self.metrics,
+                                self.send_timeout, self.deadlines)
+        with self._connections_changed:
+            self._connections.add(connection)
+        if self._stopped:
+            # accepted while shutting down
+            connection.stop_reading()
+        try:
+            with contextlib.closing(connection):
                 try:
-                    msg_length, = struct.unpack('I', com_socket.recv(4))
-                except BrokenPipeError:
-                    com_socket.close()
-                    logger.debug('connection closed')
+                    self._read_requests(connection)
+                finally:
+                    self.close_subscriber(connection)
+        finally:
+            with self._connections_changed:
+                self._connections.discard(connection)
+                self._connections_changed.notify_all()
+
+    def _read_requests(self, connection):
+        reader = framing.FrameReader(connection.transport, metrics=self.metrics,
+                                     max_frame_size=self.max_frame_size)
+        while 1:
+            try:
+                frame = reader.read_frame()
+            except OSError as e:
+                if self._stopped:
+                    # transports which can't stop reading only cancel the pending read
+                    frame = None
+                elif isinstance(e, ConnectionError):
+                    # a broken or misbehaving client, e.g. sending a too long frame
+                    logger.warning('closing connection: %s', e)
                     return
-                message = com_socket.recv(msg_length).decode('utf8')
-                logger.debug('--> %s', message)
+                else:
+                    raise
+            if frame is None:
+                logger.debug('connection closed')
+                # the client might just have shut down its sending side
+                connection.limiter.wait_idle()
+                return
+            flags, payload = frame
+            if self.metrics is not None:
+                self.metrics.bytes_in += framing.HEADER.size + len(payload)
 
-                request_msg = json.loads(message)
+            # answering with the codec the request was encoded with
+            codec = self.get_codec(flags)
+            if codec is None:
+                connection.send(self.unknown_codec_response())
+                continue
 
-                response = {'jsonrpc': '2.0', 'id': request_msg['id']}
-                try:
-                    validate_request(request_msg)
-                    params = request_msg.get('params', [])
-                    logger.debug(params)
-
-                    return_value = getattr(self.obj, request_msg['method'])(*params)
-                    response['result'] = return_value
-                except exceptions.InvalidRequestError as e:
-                    logger.exception("Failed to handle request")
-                    response['error'] = {'code': e.code, 'message': e.message}
-                except:
-                    logger.exception("Failed to handle request")
-                    response['error'] = {'code': exceptions.ERROR_INTERNAL,
-                                         'message': 'Unknown error.'}
-                finally:
-                    # send response
-                    response_message = json.dumps(response).encode('utf-8')
-                    logger.debug('<-- %s', response_message)
-                    com_socket.sendall(struct.pack('I', len(response_message)))
-                    com_socket.sendall(response_message)
+            # the payload is decoded before returning, in pipelined mode reading goes on
+            # while the request is executed
+            self.handle_message(codec, payload, connection,
+                                functools.partial(self.respond, connection, codec))
+            if not self.pipelined:
+                # the request counts as in flight until its response got sent
+                connection.limiter.wait_idle()
+
+    def respond(self, connection, codec, response_future):
+        """ waits for a response and sends it over the connection """
+        response_message = self.encode_response(codec, response_future.result())
+        if response_message is None:
+            # only notifications, nothing to answer
+            return
+        logger.debug('<-- %s', response_message)
+        connection.send(response_message, framing.codec_flags(codec.codec_id))
+
+    def handle_message(self, codec, payload, connection=None, on_response=None):
+        """
+        hands a single request or a batch of requests to the executor. Blocks while the
+        limits of requests in flight are reached.
+        :param codec: the codec the request is encoded with
+        :param payload: the encoded request
+        :param connection: the `Connection` the request came from
+        :param on_response: called with the future of the response once it resolved,
+        before the request stops counting as in flight
+        :return: a future of the response, resolving to None if there is nothing to
+        answer
+        """
+        request_msg = self.decode_request(codec, payload)
+        if request_msg is None:
+            response_future = completed_future(
+                error_response(None, exceptions.ERROR_PARSE, 'Parse error.'))
+            if on_response is not None:
+                on_response(response_future)
+            return response_future
+
+        count = len(request_msg) if isinstance(request_msg, list) else 1
+        limiters = [self._inflight_limiter]
+        if connection is not None:
+            limiters.insert(0, connection.limiter)
+        for limiter in limiters:
+            limiter.acquire(count)
+        if connection is not None:
+            connection.expect_response()
+
+        def release():
+            if connection is not None:
+                connection.response_done()
+            for limiter in limiters:
+                limiter.release(count)
+
+        try:
+            if isinstance(request_msg, list):
+                response_future = self.handle_batch(request_msg, codec, connection)
+            else:
+                response_future = self.handle_request(request_msg, codec, connection)
+        except BaseException:
+            release()
+            raise
+
+        def done(future):
+            try:
+                if on_response is not None:
+                    on_response(future)
+            finally:
+                release()
+        response_future.add_done_callback(done)
+        return response_future
+
+    def handle_batch(self, batch, codec, connection=None):
+        """
+        hands the requests of a batch to the executor, which executes them concurrently
+        :param codec: the codec the batch is encoded with
+        :param connection: the `Connection` the batch came from
+        :return: a future of the list of responses in the order of the requests
+        """
+        if not batch:
+            return completed_future(self.empty_batch_response())
+
+        response_future = Future()
+        futures = [self.handle_request(request_msg, codec, connection)
+                   for request_msg in batch]
+        pending = len(futures)
+        lock = threading.Lock()
+
+        def done(_):
+            nonlocal pending
+            with lock:
+                pending -= 1
+                if pending:
+                    return
+            response_future.set_result(batch_response(
+                future.result() for future in futures))
+
+        for future in futures:
+            future.add_done_callback(done)
+        return response_future
+
+    def handle_request(self, request_msg, codec, connection=None):
+        """
+        hands a single request object to the executor, notifications are queued for
+        execution in the background. Results of cached methods are answered from the
+        cache if possible, single flight methods join an identical call in flight.
+        :param codec: the codec the response is going to be encoded with
+        :param connection: the `Connection` the request came from
+        :return: a future of the response object, resolving to None for notifications
+        """
+        if self.is_builtin(request_msg):
+            return completed_future(self.call_builtin(request_msg, codec, connection))
+
+        try:
+            entry, args, kwargs = self.resolve(request_msg)
+            timeout = self.request_timeout(entry, request_msg)
+            lane = self.request_lane(entry, request_msg)
+            cache_key = self.cache_key(entry, request_msg, codec)
+            flight_key = self.flight_key(entry, request_msg, codec)
+        except Exception as e:
+            return completed_future(self.error_response_for(request_msg, e))
+
+        if is_notification(request_msg):
+            if entry.streaming:
+                self.notifications.submit(collect, entry.func, *args, **kwargs)
+            else:
+                self.notifications.submit(entry.func, *args, **kwargs)
+            return completed_future(None)
+
+        started = self.start_timer()
+        if cache_key is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                self.record_call(entry, started)
+                return completed_future(result_response(request_msg, EncodedResult(data)))
+            generation = self.cache.generation
+        else:
+            generation = None
+
+        response_future = Future()
+        # whoever answers first (the call, its deadline or a cancellation) takes it
+        unanswered = threading.Lock()
+
+        def answer(response, error=False, counter=None):
+            if unanswered.acquire(blocking=False):
+                finish(response, error, counter)
+
+        def finish(response, error, counter):
+            self.record_call(entry, started, error)
+            if counter is not None:
+                self._count(counter)
+            # sends the response, see `handle_message`
+            response_future.set_result(response)
+
+        def done(future):
+            if future.cancelled():
+                # dropped before it started, the error got answered already
+                return
+            try:
+                result = future.result()
+                if cache_key is not None and flight_key is None:
+                    result = self.cache_result(cache_key, entry, codec, result, generation)
+                answer(result_response(request_msg, result))
+            except Exception as e:
+                answer(self.error_response_for(request_msg, e), error=True)
+
+        def abort(error, counter):
+            if not unanswered.acquire(blocking=False):
+                return
+            if flight_key is None:
+                # other requests might wait for a shared call
+                call_future.cancel()
+            # only marked as aborted here, sending might block on a slow connection and
+            # deadlines of all connections expire on the single thread of the scheduler
+            self._aborts.submit(finish_aborted, self.error_response_for(request_msg, error),
+                                counter)
+
+        def finish_aborted(response, counter):
+            if gate is not None:
+                # no chunk may follow the error
+                gate.close()
+            finish(response, True, counter)
+
+        gate = None
+        if not entry.streaming:
+            call = entry.func
+        elif connection is None:
+            call = functools.partial(collect, entry.func)
+        else:
+            gate = StreamGate()
+            call = functools.partial(self.stream, connection, codec, request_msg, gate,
+                                     entry.func)
+        if flight_key is None:
+            call_future = self.submit(lane, call, *args, **kwargs)
+        else:
+            call_future = self.flights.join(flight_key, functools.partial(
+                self._start_shared, cache_key, entry, codec, generation, lane, args,
+                kwargs))
+
+        response_future.add_done_callback(self.register_cancel(
+            connection, request_msg,
+            functools.partial(abort, exceptions.RequestCancelledError(), 'cancelled')))
+        if timeout is not None:
+            deadline = self.deadlines.schedule(timeout, functools.partial(
+                abort, exceptions.RequestTimeoutError(
+                    '{} did not finish within {} seconds'.format(entry.name, timeout)),
+                'timeouts'))
+            response_future.add_done_callback(lambda _: deadline.cancel())
+        call_future.add_done_callback(done)
+        return response_future
+
+    def submit(self, lane, fn, *args, **kwargs):
+        """ hands a call to the executor, in a priority lane if it has lanes
+        :return: the future of the call """
+        submit_to = getattr(self.executor, 'submit_to', None)
+        if submit_to is None:
+            return self.executor.submit(fn, *args, **kwargs)
+        return submit_to(lane, fn, *args, **kwargs)
+
+    def _start_shared(self, cache_key, entry, codec, generation, lane, args, kwargs):
+        """ :return: a future of the encoded result of a call shared by several
+        requests """
+        shared = Future()
+
+        def done(future):
+            try:
+                shared.set_result(self.finish_shared(cache_key, entry, codec,
+                                                     future.result(), generation))
+            except Exception as e:
+                shared.set_exception(e)
+
+        # encoded by the callback, the submitted function might run in another process
+        self.submit(lane, entry.func, *args, **kwargs).add_done_callback(done)
+        return shared
+
+    def stream(self, connection, codec, request_msg, gate, func, *args, **kwargs):
+        """
+        executes a streaming method, sending the items it yields in chunk frames while it
+        is still running. Sending blocks while the client does not keep up, which pauses
+        the method, so only a single chunk is held in memory.
+        :param gate: the :class:`StreamGate` closed once the request got aborted, which
+        stops the method
+        :return: the number of streamed items
+        """
+        flags = framing.codec_flags(codec.codec_id)
+        items = func(*args, **kwargs)
+        count = 0
+        try:
+            for chunk in chunked(items, self.stream_chunk_size):
+                with gate.lock:
+                    if gate.closed:
+                        break
+                    if not connection.send(codec.encode(chunk_message(request_msg, chunk)),
+                                           flags):
+                        raise ConnectionError('connection is gone, stopped streaming')
+                count += len(chunk)
+        finally:
+            close_iterator(items)
+        return count
+
+
+def topics_param(params):
+    """
+    :param params: the params of `rpc.subscribe`/`rpc.unsubscribe`, either a list of
+    topics or an object with a list of `topics`
+    :return: the list of topics
+    :raise InvalidParamsError
+    """
+    if isinstance(params, dict):
+        params = params.get('topics')
+    if params is None:
+        return []
+    if not isinstance(params, list) or not all(isinstance(topic, str) for topic in params):
+        raise exceptions.InvalidParamsError('topics must be a list of strings')
+    return params
+
+
+def cancellable_id(request_id):
+    """ :return: the id of a request as key of `Connection.cancel_callbacks`, None if
+    requests with such an id can't be cancelled """
+    if isinstance(request_id, (str, int)) and not isinstance(request_id, bool):
+        return request_id
+    return None
+
+
+def completed_future(result):
+    """ :return: a future which is already resolved to the result """
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def is_notification(request_msg):
+    """ :return: True if the (valid) request is a notification, meaning it has no id """
+    return 'id' not in request_msg
+
+
+def batch_response(responses):
+    """ :return: the responses of a batch without the ones of notifications, None if
+    nothing is left to answer """
+    return [response for response in responses if response is not None] or None
+
+
+def request_id(request_msg):
+    """ :return: the id of a request, None if there is none or the request is invalid """
+    if isinstance(request_msg, dict):
+        return request_msg.get('id')
+    return None
+
+
+def result_response(request_msg, result):
+    """ :return: the JSON-RPC response object carrying the result of a request """
+    return {'jsonrpc': '2.0', 'id': request_msg['id'], 'result': result}
+
+
+def error_response(request_id, code, message):
+    """ :return: a JSON-RPC error response object """
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
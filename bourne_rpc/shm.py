@@ -0,0 +1,73 @@
+""" Shared memory side channel for bulk payloads on unix domain sockets.
+
+Instead of copying a big payload through the socket, the sender writes it into an
+anonymous shared memory segment (a `memfd` on Linux, an unlinked temporary file
+elsewhere) and passes the file descriptor of the segment along with the frame
+(`SCM_RIGHTS`). The frame itself only carries the length of the payload and is marked with
+`framing.FLAG_FD`. The receiver maps the segment and decodes the payload right out of the
+mapping.
+
+Both ends have to know about the side channel, it is therefore only used above a
+threshold which has to be enabled explicitly (`shm_threshold`). """
+import mmap
+import os
+import struct
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SEGMENT_LENGTH = struct.Struct('Q')
+
+DEFAULT_SHM_THRESHOLD = 1024 * 1024
+
+# once written, the segment can't be changed anymore by the sender
+_SEALS = (getattr(fcntl, 'F_SEAL_SEAL', 0) | getattr(fcntl, 'F_SEAL_SHRINK', 0) |
+          getattr(fcntl, 'F_SEAL_GROW', 0) | getattr(fcntl, 'F_SEAL_WRITE', 0))
+
+
+def create_segment(payload):
+    """
+    creates an anonymous segment holding a payload
+    :return: the file descriptor of the segment, owned by the caller
+    """
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('bourne_rpc', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    else:
+        with tempfile.TemporaryFile() as file:
+            fd = os.dup(file.fileno())
+
+    try:
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+        if _SEALS and hasattr(fcntl, 'F_ADD_SEALS'):
+            try:
+                fcntl.fcntl(fd, fcntl.F_ADD_SEALS, _SEALS)
+            except OSError:
+                # a temporary file, sealing is not supported
+                pass
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def map_segment(fd, length):
+    """
+    maps a received segment and closes its file descriptor
+    :param length: the length of the payload within the segment
+    :return: a read only memoryview of the payload
+    :raise ConnectionError: if the segment is smaller than announced
+    """
+    try:
+        if os.fstat(fd).st_size < length:
+            raise ConnectionError('shared memory segment is smaller than its frame')
+        if not length:
+            return memoryview(b'')
+        segment = mmap.mmap(fd, length, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+    return memoryview(segment)
@@ -0,0 +1,61 @@
+""" Deduplication of identical calls in flight. Methods decorated with
+`@rpc_method(single_flight=True)` are executed once for all requests calling them with
+the same params while a previous call has not finished yet, every request is answered
+with the shared result under its own id. The result is encoded once, with the codec of
+the requests (requests with different codecs do not share a call).
+
+Unlike the response cache nothing is kept once the call finished, so it is safe for
+methods whose results change, as long as concurrent callers may see the same result.
+A shared call is not dropped at the deadline or on the cancellation of one of its
+requests, only the request itself is answered with the error. """
+import threading
+
+
+class SingleFlightStats:
+    """ counters of a :class:`SingleFlight` """
+
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+
+    def stats(self):
+        """ :return: a dict of all counters """
+        return {'calls': self.calls, 'collapsed': self.collapsed}
+
+
+class SingleFlight:
+    """ the calls in flight by key, see :func:`bourne_rpc.cache.canonical_key`. It is
+    thread safe and works with `concurrent.futures` as well as `asyncio` futures. """
+
+    def __init__(self):
+        self.counters = SingleFlightStats()
+        self._lock = threading.Lock()
+        # key -> the future of the call in flight
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def join(self, key, start):
+        """
+        :param key: the key of the call
+        :param start: called without arguments if no call of the key is in flight,
+        starts the call and returns its future
+        :return: the future of the call in flight, shared by all requests joining it
+        before it finished
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.counters.collapsed += 1
+                return future
+            future = start()
+            self._flights[key] = future
+            self.counters.calls += 1
+        future.add_done_callback(lambda _: self._land(key, future))
+        return future
+
+    def _land(self, key, future):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
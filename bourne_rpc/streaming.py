@@ -0,0 +1,86 @@
+""" Streaming of large results. Methods returning a generator (or an async iterator on
+the :class:`AsyncRpcServer`) do not build their whole result in memory, the items are sent
+while the method is still running, as a sequence of chunk frames carrying the id of the
+request:
+
+    {"jsonrpc": "2.0", "id": 1, "chunk": [item, item, ...]}
+
+followed by a regular response terminating the stream, with the number of streamed items
+as result (or an error if the method failed halfway through).
+
+The first chunk holds a single item so the client gets it as soon as possible, every
+further one twice as many up to the chunk size of the server.
+
+A stream stops once its request got aborted at the deadline or by `rpc.cancel`, no chunk
+follows the error response. """
+import itertools
+import threading
+
+DEFAULT_STREAM_CHUNK_SIZE = 256
+
+
+def chunk_message(request_msg, chunk):
+    """ :return: the object of a chunk frame """
+    return {'jsonrpc': '2.0', 'id': request_msg['id'], 'chunk': chunk}
+
+
+class StreamGate:
+    """ lets the chunks of a stream through until its request got aborted """
+
+    def __init__(self):
+        # held while sending a chunk, a chunk being sent goes out before the error
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def close(self):
+        """ stops the stream, waits for a chunk being sent """
+        with self.lock:
+            self.closed = True
+
+
+def chunked(items, max_size=DEFAULT_STREAM_CHUNK_SIZE):
+    """ splits an iterable into lists of growing size, starting with a single item """
+    iterator = iter(items)
+    size = 1
+    while 1:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+        size = min(size * 2, max_size)
+
+
+async def async_chunked(items, max_size=DEFAULT_STREAM_CHUNK_SIZE):
+    """ :func:`chunked` for async iterables, plain iterables are accepted as well """
+    if not hasattr(items, '__aiter__'):
+        for chunk in chunked(items, max_size):
+            yield chunk
+        return
+
+    size, chunk = 1, []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            size, chunk = min(size * 2, max_size), []
+    if chunk:
+        yield chunk
+
+
+def collect(func, *args, **kwargs):
+    """ calls a streaming method and returns its items as a list, for when there is no
+    connection to stream to """
+    return list(func(*args, **kwargs))
+
+
+async def async_collect(items):
+    """ :return: the items of an async or plain iterable as a list """
+    return [item for chunk in [chunk async for chunk in async_chunked(items)]
+            for item in chunk]
+
+
+def close_iterator(items):
+    """ closes a generator which was not exhausted, running its `finally` blocks """
+    close = getattr(items, 'close', None)
+    if close is not None:
+        close()
@@ -0,0 +1,159 @@
+import logging
+import socket
+
+from .. import framing
+
+logger = logging.getLogger(__name__)
+
+# seconds of idle time before the first keepalive probe, between probes and the number
+# of unanswered probes after which the connection is considered dead
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+
+def parse_address(address):
+    """
+    :param address: a (host, port) tuple or a 'host:port' string
+    :return: a (host, port) tuple
+    """
+    if isinstance(address, str):
+        host, _, port = address.rpartition(':')
+        return host.strip('[]'), int(port)
+    host, port = address
+    return host, int(port)
+
+
+class TcpSocket:
+    """ Transport over TCP, for servers on other hosts or containers. Nagle's algorithm
+    is disabled (TCP_NODELAY) as every frame is a complete message which should leave
+    right away, and keepalive detects dead peers. With `reuse_port` several server
+    processes can bind the same port and the kernel spreads the connections across
+    them (SO_REUSEPORT, Linux and BSD). """
+
+    def __init__(self, address, sock=None, reuse_port=False, keepalive=True,
+                 send_buffer_size=None, receive_buffer_size=None):
+        """
+        :param address: the address to bind to or connect to, a (host, port) tuple or a
+        'host:port' string
+        :param sock: an already connected socket to wrap, see :meth:`connect`
+        :param reuse_port: allow other sockets to bind the same port (SO_REUSEPORT)
+        :param keepalive: enable TCP keepalive on connections
+        :param send_buffer_size: the size of the send buffer (SO_SNDBUF), None to keep
+        the default of the system
+        :param receive_buffer_size: the size of the receive buffer (SO_RCVBUF)
+        """
+        self.address = parse_address(address)
+        self.reuse_port = reuse_port
+        self.keepalive = keepalive
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        if sock is not None:
+            self.socket = sock
+            return
+
+        self.socket = socket.socket(self._family(self.address[0]), socket.SOCK_STREAM)
+        if hasattr(socket, 'SO_REUSEADDR') and not hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):
+            # restarting the server must not wait for connections in TIME_WAIT
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise OSError('SO_REUSEPORT is not supported on this platform')
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    @staticmethod
+    def _family(host):
+        return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+    def bind(self):
+        """ binds the socket to the configured address and starts listening, binding to
+        port 0 picks a free port, see :attr:`bound_address` """
+        self.socket.bind(self.address)
+        self.socket.listen(socket.SOMAXCONN)
+
+    @property
+    def bound_address(self):
+        """ the (host, port) tuple the socket is bound to """
+        return self.socket.getsockname()[:2]
+
+    @classmethod
+    def connect(cls, address, **options):
+        """
+        connects to a server
+        :param address: see :meth:`__init__`
+        :param options: the socket options, see :meth:`__init__`
+        :return: a connected transport
+        """
+        host, port = parse_address(address)
+        sock = socket.create_connection((host, port))
+        transport = cls((host, port), sock=sock, **options)
+        try:
+            transport.configure_connection(sock)
+        except OSError:
+            sock.close()
+            raise
+        return transport
+
+    def accept(self):
+        """ accepts a connection from the socket
+        :return: a tuple of the connected transport and the address of the client """
+        sock, addr = self.socket.accept()
+        self.configure_connection(sock)
+        return type(self)(self.address, sock=sock, keepalive=self.keepalive,
+                          send_buffer_size=self.send_buffer_size,
+                          receive_buffer_size=self.receive_buffer_size), addr
+
+    def configure_connection(self, sock):
+        """ sets the options of a connected socket """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                                  ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                                  ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+                if hasattr(socket, option):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        if self.send_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+        if self.receive_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+
+    def sendall(self, b):
+        """
+        sends data to the socket
+        :param b: the data to be sent
+        """
+        self.socket.sendall(b)
+
+    def send_buffers(self, buffers):
+        """
+        sends several buffers with scatter/gather writes, without joining them first
+        :return: the number of writes it took
+        """
+        return framing.sendmsg_all(self.socket.sendmsg, buffers)
+
+    def recv(self, bufsize):
+        """
+        Receives data from the socket
+        :param bufsize: the maximum number of bytes to receive
+        :return: the read data
+        """
+        return self.socket.recv(bufsize)
+
+    def recv_into(self, buffer):
+        """
+        Receives data from the socket directly into a writable buffer
+        :param buffer: e.g. a memoryview into a bytearray
+        :return: the number of bytes received, 0 if the connection got closed
+        """
+        return self.socket.recv_into(buffer)
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        """ shuts down both directions of a connected socket, which wakes up a thread
+        blocked in receiving. With `socket.SHUT_RD` only receiving stops, sending still
+        works. """
+        self.socket.shutdown(how)
+
+    def close(self):
+        """closes the socket"""
+        self.socket.close()
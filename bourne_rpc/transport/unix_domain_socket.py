@@ -1,30 +1,93 @@
+import array
+import logging
 import socket
+import struct
+import sys
 import os
+import tempfile
 from contextlib import suppress
 
+from .. import framing
+
+logger = logging.getLogger(__name__)
+
+# the maximum number of file descriptors received at once
+MAX_FDS = 16
+
+# the maximum size of a record in SOCK_SEQPACKET mode, bigger writes are split
+SEQPACKET_RECORD_SIZE = 64 * 1024
+
+# pid, uid and gid of the peer (Linux)
+PEER_CREDENTIALS = struct.Struct('3i')
+
+
+def is_abstract(path):
+    """ :return: True if the path is in the abstract namespace (Linux), which has no
+    file system entry """
+    return isinstance(path, str) and path.startswith('\0')
+
 
 class UnixSocket:
     """ Implementation of a transport layer using unix domain sockets. Please refer to
     https://en.wikipedia.org/wiki/Unix_domain_socket for more information """
 
-    def __init__(self, path):
+    def __init__(self, path, sock=None, send_buffer_size=None, receive_buffer_size=None,
+                 seqpacket=False):
         """
         initializes a new unix socket transport
-        :param path: the path to the file the unix socket shall be opened under
+        :param path: the path to the file the unix socket shall be opened under, or a
+        name in the abstract namespace starting with a null byte (Linux)
+        :param sock: an already connected socket to wrap, see :meth:`connect`
+        :param send_buffer_size: the size of the send buffer (SO_SNDBUF) of the socket
+        and of accepted connections, None to keep the default of the system
+        :param receive_buffer_size: the size of the receive buffer (SO_RCVBUF)
+        :param seqpacket: use SOCK_SEQPACKET (Linux), which keeps message boundaries: a
+        frame up to `SEQPACKET_RECORD_SIZE` is a single record and always received
+        with a single call. Both ends have to use the same mode.
         """
 
         self.socket_path = path
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        self.seqpacket = seqpacket
+        self.record_size = None
+        if seqpacket:
+            self.record_size = SEQPACKET_RECORD_SIZE
+            if send_buffer_size:
+                self.record_size = min(SEQPACKET_RECORD_SIZE, send_buffer_size // 2)
 
-        # creating directories of path
-        with suppress(FileExistsError):
-            os.makedirs(os.path.dirname(self.socket_path))
+        if sock is not None:
+            self.socket = sock
+            return
 
-        with suppress(FileNotFoundError):
-            # deleting unix socket file if exists
-            os.unlink(self.socket_path)
+        if not is_abstract(path):
+            # creating directories of path
+            with suppress(FileExistsError):
+                os.makedirs(os.path.dirname(self.socket_path), mode=0o700)
+
+            with suppress(FileNotFoundError):
+                # deleting unix socket file if exists
+                os.unlink(self.socket_path)
 
         # creating unix socket
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket = self._create_socket()
+
+    def _create_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket_type(self.seqpacket))
+        self.configure_connection(sock)
+        return sock
+
+    def configure_connection(self, sock):
+        """ sets the buffer sizes of a socket """
+        if self.send_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+        if self.receive_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+
+    def _options(self):
+        return {'send_buffer_size': self.send_buffer_size,
+                'receive_buffer_size': self.receive_buffer_size,
+                'seqpacket': self.seqpacket}
 
     def bind(self):
         """ binds the socket to a configured address (=file as we are using
@@ -37,16 +100,59 @@ class UnixSocket:
         # though...
         self.socket.listen(socket.SOMAXCONN)
 
+    @classmethod
+    def connect(cls, path, **options):
+        """
+        connects to a server listening on a unix socket
+        :param path: the path of the unix socket the server listens on
+        :param options: the socket options, see :meth:`__init__`
+        :return: a connected transport
+        """
+        sock = socket.socket(socket.AF_UNIX, socket_type(options.get('seqpacket')))
+        transport = cls(path, sock=sock, **options)
+        try:
+            transport.configure_connection(sock)
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            raise
+        return transport
+
     def accept(self):
-        """ accepts a connection from the socket"""
-        return self.socket.accept()
+        """ accepts a connection from the socket. Sockets in the abstract namespace have
+        no file permissions, connections of other users are refused there.
+        :return: a tuple of the connected transport and the address of the client """
+        while 1:
+            sock, addr = self.socket.accept()
+            if is_abstract(self.socket_path) and peer_uid(sock) not in (None, os.getuid()):
+                logger.warning('refused connection of another user')
+                sock.close()
+                continue
+            self.configure_connection(sock)
+            return type(self)(self.socket_path, sock=sock, **self._options()), addr
 
     def sendall(self, b):
         """
         ends data to the socket
         :param b: the data to be sent
         """
-        self.socket.sendall(data=b)
+        if self.record_size is None or len(b) <= self.record_size:
+            self.socket.sendall(b)
+            return
+        view = memoryview(b)
+        for offset in range(0, len(view), self.record_size):
+            self.socket.sendall(view[offset:offset + self.record_size])
+
+    def send_buffers(self, buffers):
+        """
+        sends several buffers with scatter/gather writes, without joining them first
+        :return: the number of writes it took
+        """
+        if self.record_size is not None:
+            # every write is a record of its own, the receiver expects whole frames
+            self.sendall(b''.join(buffers))
+            return -(-sum(len(buffer) for buffer in buffers) // self.record_size)
+        return framing.sendmsg_all(self.socket.sendmsg, buffers)
 
     def recv(self, bufsize):
         """
@@ -54,7 +160,50 @@ class UnixSocket:
         :param bufsize:
         :return: the read data
         """
-        return self.socket.recv(buffersize=bufsize)
+        return self.socket.recv(bufsize)
+
+    def recv_into(self, buffer):
+        """
+        Receives data from the socket directly into a writable buffer
+        :param buffer: e.g. a memoryview into a bytearray
+        :return: the number of bytes received, 0 if the connection got closed
+        """
+        return self.socket.recv_into(buffer)
+
+    def send_fds(self, data, fds):
+        """
+        sends data together with file descriptors, which are duplicated into the
+        receiving process (SCM_RIGHTS)
+        :param data: the data to be sent, the file descriptors arrive with its first byte
+        :param fds: a list of file descriptors
+        """
+        sent = self.socket.sendmsg(
+            [data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+        if sent < len(data):
+            self.socket.sendall(memoryview(data)[sent:])
+
+    def recv_into_fds(self, buffer):
+        """
+        receives data into a writable buffer together with the file descriptors sent
+        along with it
+        :return: a tuple of the number of bytes received and the list of received file
+        descriptors, which are owned by the caller
+        """
+        fds = array.array('i')
+        received, ancdata, flags, _ = self.socket.recvmsg_into(
+            [buffer], socket.CMSG_SPACE(MAX_FDS * fds.itemsize))
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+        if flags & socket.MSG_CTRUNC:
+            logger.warning('file descriptors got truncated')
+        return received, list(fds)
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        """ shuts down both directions of a connected socket, which wakes up a thread
+        blocked in receiving. With `socket.SHUT_RD` only receiving stops, sending still
+        works. """
+        self.socket.shutdown(how)
 
     def close(self):
         """closes the socket"""
@@ -65,10 +214,31 @@ class UnixSocket:
         self.close()
 
 
+def socket_type(seqpacket):
+    """ :return: the socket type of the transport """
+    return socket.SOCK_SEQPACKET if seqpacket else socket.SOCK_STREAM
+
+
+def peer_uid(sock):
+    """ :return: the user id of the process at the other end of a connection, None if
+    the platform can't tell """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    _, uid, _ = PEER_CREDENTIALS.unpack(
+        sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size))
+    return uid
+
+
 def get_transport_path(application_id):
     """
     returns a unique path for the transport to operate on dependent on os,
-    username and application id. Note macOS: this library generates a transport
+    username and application id.
+
+    On Linux the socket is created in `$XDG_RUNTIME_DIR`, which is private to the user.
+    Without it, it falls back to the abstract namespace, where only connections of the
+    same user are accepted. Other unix systems use a directory in the temp directory.
+
+    Note macOS: this library generates a transport
     under the app group container for a specific shell extension under
     ~/Library/GroupContainers/[application_id]/. This way, a sandboxed shell
     extension will be able to reach the transport given proper configuration for
@@ -82,5 +252,14 @@ def get_transport_path(application_id):
     :return: a platform specific path to a transport unique for the user and
     application
     """
-    return os.path.join(os.path.expanduser('~'), 'Library', 'Group Containers',
-                        application_id, 'unix_socket')
+    if sys.platform == 'darwin':
+        return os.path.join(os.path.expanduser('~'), 'Library', 'Group Containers',
+                            application_id, 'unix_socket')
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, application_id, 'unix_socket')
+    if sys.platform.startswith('linux'):
+        return '\0{}.{}'.format(application_id, os.getuid())
+    return os.path.join(tempfile.gettempdir(), '{}-{}'.format(application_id, os.getuid()),
+                        'unix_socket')
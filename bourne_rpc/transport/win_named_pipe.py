@@ -3,6 +3,7 @@ import ctypes.wintypes
 import logging
 import contextlib
 import os
+import socket
 
 logger = logging.getLogger(__name__)
 
@@ -88,6 +89,28 @@ ConnectNamedPipe.argtypes = (
     LPOVERLAPPED  # lpOverlapped
 )
 
+CreateFile = ctypes.windll.kernel32.CreateFileW
+CreateFile.restype = ctypes.wintypes.HANDLE
+CreateFile.errcheck = _errcheck_handle
+CreateFile.argtypes = (
+    ctypes.wintypes.LPCWSTR,  # lpFileName
+    ctypes.wintypes.DWORD,  # dwDesiredAccess
+    ctypes.wintypes.DWORD,  # dwShareMode
+    LPSECURITY_ATTRIBUTES,  # lpSecurityAttributes
+    ctypes.wintypes.DWORD,  # dwCreationDisposition
+    ctypes.wintypes.DWORD,  # dwFlagsAndAttributes
+    ctypes.wintypes.HANDLE,  # hTemplateFile
+)
+
+GENERIC_READ = 0x80000000
+GENERIC_WRITE = 0x40000000
+OPEN_EXISTING = 3
+
+FILE_FLAG_OVERLAPPED = 0x40000000
+
+ERROR_IO_PENDING = 997
+ERROR_PIPE_CONNECTED = 535
+
 PIPE_ACCESS_DUPLEX = 0x00000003
 PIPE_TYPE_BYTE = 0x00000000
 PIPE_READMODE_BYTE = 0x00000000
@@ -132,25 +155,79 @@ FlushFileBuffers.restype = ctypes.wintypes.BOOL
 FlushFileBuffers.argtypes = (ctypes.wintypes.HANDLE,)
 FlushFileBuffers.errcheck = _errcheck_bool
 
+GetOverlappedResult = ctypes.windll.kernel32.GetOverlappedResult
+GetOverlappedResult.restype = ctypes.wintypes.BOOL
+GetOverlappedResult.errcheck = _errcheck_bool
+GetOverlappedResult.argtypes = (
+    ctypes.wintypes.HANDLE,  # hFile
+    LPOVERLAPPED,  # lpOverlapped
+    ctypes.wintypes.LPDWORD,  # lpNumberOfBytesTransferred
+    ctypes.wintypes.BOOL,  # bWait
+)
+
 CancelIoEx = ctypes.windll.kernel32.CancelIoEx
 CancelIoEx.restype = ctypes.wintypes.BOOL
 CancelIoEx.argtypes = (ctypes.wintypes.HANDLE, LPOVERLAPPED)
 CancelIoEx.errcheck = _errcheck_bool
 
 
+def _overlapped_io(function, handle, buffer, length, overlapped=None):
+    """
+    calls `ReadFile`, `WriteFile` or `ConnectNamedPipe` (with `buffer` None) on a handle
+    opened for overlapped I/O and waits for it to complete. Unlike synchronous I/O, a
+    thread blocked in reading does not block other threads writing the same handle.
+    :param overlapped: the `OVERLAPPED` structure of the operation, to cancel it
+    :return: the number of bytes transferred
+    """
+    if overlapped is None:
+        overlapped = OVERLAPPED()
+    overlapped.hEvent = CreateEvent(None, True, False, None)
+    transferred = ctypes.wintypes.DWORD()
+    try:
+        try:
+            if buffer is None:
+                function(handle, ctypes.byref(overlapped))
+            else:
+                function(handle, buffer, length, None, ctypes.byref(overlapped))
+        except OSError as e:
+            if e.winerror == ERROR_PIPE_CONNECTED:
+                return 0
+            if e.winerror != ERROR_IO_PENDING:
+                raise
+        GetOverlappedResult(handle, ctypes.byref(overlapped), ctypes.byref(transferred),
+                            True)
+    finally:
+        CloseHandle(overlapped.hEvent)
+    return transferred.value
+
+
 class NamedPipe:
+    """ A named pipe transport. Both ends are opened for overlapped I/O, so a thread
+    reading responses or requests does not block other threads sending on the same
+    pipe (multiplexing clients, pipelined servers, pushed events). """
+
     def __init__(self, path, handle=None):
         self.pipe_name = path
 
         self.handle = handle
+        # the `OVERLAPPED` structure of the pending read, if any
+        self._reading = None
+        self._read_shutdown = False
 
     def bind(self):
         """ does nothing and is just for interop with sockets """
 
+    @classmethod
+    def connect(cls, path):
+        """ :returns a NamedPipe object connected to the server listening on the pipe """
+        handle = CreateFile(path, GENERIC_READ | GENERIC_WRITE, 0, None, OPEN_EXISTING,
+                            FILE_FLAG_OVERLAPPED, None)
+        return cls(path, handle)
+
     def accept(self, max_connections=16, recv_buffer_size=255, send_buffer_size=255, timeout=50):
         """ :returns a NamedPipe object with the new connection """
         self.handle = CreateNamedPipe(self.pipe_name,
-                                      PIPE_ACCESS_DUPLEX,
+                                      PIPE_ACCESS_DUPLEX | FILE_FLAG_OVERLAPPED,
                                       PIPE_TYPE_BYTE | PIPE_READMODE_BYTE | PIPE_WAIT | PIPE_REJECT_REMOTE_CLIENTS,
                                       max_connections,
                                       send_buffer_size,  # buffer size
@@ -160,28 +237,58 @@ class NamedPipe:
                                       )
 
         logger.debug("waiting for a new connection")
-        ConnectNamedPipe(self.handle, None)
+        _overlapped_io(ConnectNamedPipe, self.handle, None, 0)
         result = NamedPipe(self.pipe_name, self.handle), self.pipe_name
         self.handle = None
         return result
 
     def sendall(self, b):
-        bytes_written = ctypes.wintypes.DWORD()
-        WriteFile(self.handle, b, len(b), ctypes.byref(bytes_written), None)
-        FlushFileBuffers(self.handle)
+        # not flushed, that would block until the peer read everything
+        data = b if isinstance(b, bytes) else bytes(b)
+        written = 0
+        while written < len(data):
+            written += _overlapped_io(WriteFile, self.handle, data[written:],
+                                      len(data) - written)
 
     def recv(self, bufsize):
         buffer = ctypes.create_string_buffer(bufsize)
-
-        bytes_read = ctypes.wintypes.DWORD()
-        ReadFile(self.handle,
-                 ctypes.byref(buffer),
-                 bufsize,
-                 ctypes.byref(bytes_read),
-                 None)
-        return buffer.raw[:bytes_read.value]
+        bytes_read = self._read(ctypes.byref(buffer), bufsize)
+        return buffer.raw[:bytes_read]
+
+    def recv_into(self, buffer):
+        """ reads from the pipe directly into a writable buffer (e.g. a memoryview)
+        :return: the number of bytes read """
+        length = len(buffer)
+        target = (ctypes.c_char * length).from_buffer(buffer)
+        return self._read(ctypes.byref(target), length)
+
+    def _read(self, buffer, length):
+        """ :return: the number of bytes read, 0 once reading got shut down """
+        overlapped = self._reading = OVERLAPPED()
+        try:
+            if self._read_shutdown:
+                return 0
+            return _overlapped_io(ReadFile, self.handle, buffer, length, overlapped)
+        finally:
+            self._reading = None
+
+    def shutdown(self, how=socket.SHUT_RDWR):
+        """ cancels pending I/O on the pipe, which wakes up a thread blocked in reading
+        with an error, further reads see the end of the stream. With `socket.SHUT_RD`
+        only the pending read is cancelled, sending still works. """
+        self._read_shutdown = True
+        reading = self._reading
+        with contextlib.suppress(WindowsError):
+            if how != socket.SHUT_RD:
+                CancelIoEx(self.handle, None)
+            elif reading is not None:
+                CancelIoEx(self.handle, ctypes.byref(reading))
 
     def close(self):
+        logger.debug("flushing pipe")
+        with contextlib.suppress(WindowsError):
+            FlushFileBuffers(self.handle)
+
         logger.debug("cancelling io")
         with contextlib.suppress(WindowsError):
             CancelIoEx(self.handle, None)
@@ -49,5 +49,10 @@ setup(
     # $ pip install -e .[test]
     extras_require={
         'test': ['pytest', 'pytest-cov'],
+        'fastjson': ['orjson'],
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
     },
 )
@@ -0,0 +1,81 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import RpcServer, framing
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return os.path.join(str(tmp_path), 'unix_socket')
+
+
+def poll(condition, timeout=5):
+    """ waits until the condition is met, failing the test after `timeout` seconds """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met within {}s'.format(timeout)
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def wait_until():
+    return poll
+
+
+def send_and_receive(client_socket, message):
+    client_socket.sendall(framing.pack_frame(json.dumps(message).encode('utf8')))
+    _, payload = framing.FrameReader(client_socket).read_frame()
+    return json.loads(str(payload, 'utf8'))
+
+
+@pytest.fixture
+def call():
+    """ :return: a function sending a JSON request (or batch) over a client socket and
+    returning the decoded response """
+    return send_and_receive
+
+
+@pytest.fixture
+def serve():
+    """ :return: a function connecting a client socket to a handler of a `RpcServer`,
+    the sockets are closed and the handlers joined at the end of the test """
+    connections = []
+
+    def connect(server):
+        server_socket, client_socket = socket.socketpair()
+        thread = threading.Thread(target=server.handler, args=(server_socket,),
+                                  daemon=True)
+        thread.start()
+        connections.append((client_socket, thread))
+        return client_socket
+
+    yield connect
+    for client_socket, thread in connections:
+        client_socket.close()
+        thread.join(timeout=5)
+
+
+@pytest.fixture
+def client(server, serve):
+    """ a client socket connected to a handler of the `server` fixture of the module """
+    return serve(server)
+
+
+@pytest.fixture
+def serve_socket(socket_path):
+    """ :return: a function starting a `RpcServer` for an object on `socket_path` """
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+
+    def start(obj, **options):
+        transport = UnixSocket(socket_path)
+        transport.bind()
+        server = RpcServer(transport, obj, **options)
+        threading.Thread(target=server.serve, daemon=True).start()
+        return server
+
+    return start
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import struct
+import sys
+
+import pytest
+
+from bourne_rpc import AsyncRpcServer
+from bourne_rpc.transport import unix_domain_socket
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+class Service:
+    def add(self, a, b):
+        return a + b
+
+    async def slow_echo(self, value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+
+async def call(reader, writer, method, params, request_id=1):
+    message = json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method,
+                          'params': params}).encode('utf8')
+    writer.write(struct.pack('I', len(message)) + message)
+    await writer.drain()
+    msg_length, = struct.unpack('I', await reader.readexactly(4))
+    return json.loads((await reader.readexactly(msg_length)).decode('utf8'))
+
+
+def run_with_server(socket_path, client_coro, **kwargs):
+    async def main():
+        transport = unix_domain_socket.UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, Service(), **kwargs)
+        await server.start()
+        try:
+            return await client_coro()
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_sync_and_async_methods(socket_path):
+    async def client():
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        try:
+            assert (await call(reader, writer, 'add', [1, 2]))['result'] == 3
+            assert (await call(reader, writer, 'slow_echo', ['x']))['result'] == 'x'
+            response = await call(reader, writer, 'missing', [])
+            assert response['error']['code'] == -32601
+        finally:
+            writer.close()
+
+    run_with_server(socket_path, client)
+
+
+def test_many_concurrent_connections(socket_path):
+    """ all connections are served from a single thread while sleeping concurrently """
+
+    async def single_client(index):
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        try:
+            response = await call(reader, writer, 'slow_echo', [index], request_id=index)
+            assert response == {'jsonrpc': '2.0', 'id': index, 'result': index}
+        finally:
+            writer.close()
+
+    async def client():
+        await asyncio.gather(*(single_client(index) for index in range(200)))
+
+    run_with_server(socket_path, client)
+
+
+def test_batch(socket_path):
+    async def client():
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        try:
+            batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'slow_echo', 'params': [i]}
+                     for i in range(100)]
+            message = json.dumps(batch).encode('utf8')
+            writer.write(struct.pack('I', len(message)) + message)
+            msg_length, = struct.unpack('I', await reader.readexactly(4))
+            response = json.loads((await reader.readexactly(msg_length)).decode('utf8'))
+            assert [entry['result'] for entry in response] == list(range(100))
+        finally:
+            writer.close()
+
+    run_with_server(socket_path, client)
+
+
+def test_pipelined(socket_path):
+    async def client():
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        try:
+            for request_id, seconds in [('slow', 0.2), ('fast', 0)]:
+                message = json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': 'sleep',
+                                      'params': [seconds]}).encode('utf8')
+                writer.write(struct.pack('I', len(message)) + message)
+            ids = []
+            for _ in range(2):
+                msg_length, = struct.unpack('I', await reader.readexactly(4))
+                ids.append(json.loads(await reader.readexactly(msg_length))['id'])
+            assert ids == ['fast', 'slow']
+        finally:
+            writer.close()
+
+    run_with_server(socket_path, client, pipelined=True)
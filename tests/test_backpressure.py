@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bourne_rpc import RpcServer, framing
+from bourne_rpc.backpressure import InflightLimiter
+
+
+class Service:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def work(self, value):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return value
+
+    def square(self, value):
+        return value * value
+
+    def big(self, size):
+        return 'x' * size
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+def test_limiter_blocks_until_released():
+    limiter = InflightLimiter(2)
+    assert limiter.acquire(2)
+    assert not limiter.acquire(timeout=0.05)
+
+    threading.Timer(0.05, limiter.release).start()
+    assert limiter.acquire(timeout=5)
+    assert limiter.inflight == 2
+
+
+def test_limiter_lets_oversized_batch_through_when_idle():
+    limiter = InflightLimiter(2)
+    assert limiter.acquire(5, timeout=0)
+    assert not limiter.acquire(timeout=0)
+
+
+def test_bounded_workers(serve, call, wait_until):
+    service = Service()
+    server = RpcServer(transport=None, obj=service, max_workers=3)
+    with serve(server) as client_socket:
+        batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'work', 'params': [i]}
+                 for i in range(20)]
+        response = call(client_socket, batch)
+    assert [entry['result'] for entry in response] == list(range(20))
+    assert service.max_running == 3
+
+    wait_until(lambda: server.queue_depth == 0)
+
+
+def test_process_pool_executor(serve, call):
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        server = RpcServer(transport=None, obj=Service(), executor=executor)
+        with serve(server) as client_socket:
+            batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'square', 'params': [i]}
+                     for i in range(10)]
+            response = call(client_socket, batch)
+    assert [entry['result'] for entry in response] == [i * i for i in range(10)]
+
+
+def test_client_not_reading_is_disconnected(serve, call, wait_until, caplog):
+    server = RpcServer(transport=None, obj=Service(), max_workers=1, send_timeout=0.2)
+    stalled = serve(server)
+    # the response does not fit into the socket buffers, the only worker blocks in
+    # sending it
+    call_big = {'jsonrpc': '2.0', 'id': 1, 'method': 'big', 'params': [1 << 24]}
+    stalled.sendall(framing.pack_frame(json.dumps(call_big).encode()))
+    wait_until(lambda: server.queue_depth)
+    start = time.monotonic()
+    response = call(serve(server), {'jsonrpc': '2.0', 'id': 2, 'method': 'square',
+                                    'params': [3]})
+    assert response['result'] == 9
+    assert time.monotonic() - start < 2
+    assert 'did not read' in caplog.text
+    stalled.settimeout(5)
+    # the stalled connection got closed
+    while stalled.recv(1 << 20):
+        pass
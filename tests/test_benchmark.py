@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from bourne_rpc import benchmark
+
+
+@pytest.mark.skipif('not hasattr(os, "fork")')
+@pytest.mark.parametrize('mode', benchmark.MODES)
+def test_run_scenario(mode):
+    """ a short run of every mode completes and reports its results """
+    result = benchmark.run_scenario(transport='tcp', clients=2, mode=mode, duration=0.1,
+                                    depth=4)
+    assert result['requests'] > 0 and result['requests_per_second'] > 0
+    assert 0 < result['p50'] <= result['p99']
+    if benchmark.resource is not None:
+        assert result['server_max_rss'] > 0
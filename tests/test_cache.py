@@ -0,0 +1,164 @@
+import json
+
+import pytest
+
+from bourne_rpc import RpcServer, codecs, framing, rpc_method
+from bourne_rpc.cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl():
+    clock = Clock()
+    cache = ResponseCache(ttl=1, clock=clock)
+    key = cache.key('status', ['/a'], 0)
+    cache.put(key, b'1')
+    assert cache.get(key) == b'1'
+    clock.now = 1
+    assert cache.get(key) is None
+    assert cache.counters.stats() == {'hits': 1, 'misses': 1, 'evictions': 0,
+                                      'invalidations': 0}
+
+
+def test_lru_eviction_and_memory_budget():
+    cache = ResponseCache(max_entries=2, max_bytes=10, ttl=None)
+    cache.put(cache.key('a', None, 0), b'aaa')
+    cache.put(cache.key('b', None, 0), b'bbb')
+    cache.get(cache.key('a', None, 0))
+    cache.put(cache.key('c', None, 0), b'ccc')
+    assert cache.get(cache.key('b', None, 0)) is None
+    assert cache.get(cache.key('a', None, 0)) == b'aaa'
+
+    cache.put(cache.key('d', None, 0), b'dddddddd')
+    assert len(cache) == 1 and cache.size == 8
+    assert not cache.put(cache.key('e', None, 0), b'e' * 11)
+
+
+def test_named_params_order_does_not_matter():
+    assert (ResponseCache.key('status', {'a': 1, 'b': 2}, 0) ==
+            ResponseCache.key('status', {'b': 2, 'a': 1}, 0))
+
+
+def test_invalidate():
+    cache = ResponseCache(ttl=None)
+    for path in ('/a', '/b'):
+        cache.put(cache.key('status', [path], 0), b'1')
+    cache.put(cache.key('info', None, 0), b'1')
+
+    cache.invalidate('status', ['/a'])
+    assert cache.get(cache.key('status', ['/a'], 0)) is None
+    assert cache.get(cache.key('status', ['/b'], 0)) == b'1'
+    cache.invalidate('status')
+    assert cache.get(cache.key('status', ['/b'], 0)) is None
+    assert cache.get(cache.key('info', None, 0)) == b'1'
+    cache.invalidate()
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_stale_result_is_not_stored():
+    cache = ResponseCache(ttl=None)
+    generation = cache.generation
+    cache.invalidate('status')
+    assert not cache.put(cache.key('status', ['/a'], 0), b'1', generation=generation)
+
+
+class Service:
+    def __init__(self):
+        self.calls = 0
+
+    @rpc_method(cache=True)
+    def status(self, path):
+        self.calls += 1
+        return {'path': path, 'synced': True}
+
+    @rpc_method
+    def touch(self, path):
+        self.calls += 1
+        return path
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def server(service):
+    return RpcServer(transport=None, obj=service, cache=ResponseCache(ttl=None))
+
+
+def test_cached_method_is_called_once(client, call, server, service):
+    for request_id in range(3):
+        response = call(client, {'jsonrpc': '2.0', 'id': request_id, 'method': 'status',
+                                 'params': ['/a']})
+        assert response == {'jsonrpc': '2.0', 'id': request_id,
+                            'result': {'path': '/a', 'synced': True}}
+    assert service.calls == 1
+
+    batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'status', 'params': ['/a']}
+             for i in range(2)]
+    assert [response['result'] for response in call(client, batch)] == [
+        {'path': '/a', 'synced': True}] * 2
+    assert service.calls == 1
+
+    server.invalidate('status', ['/a'])
+    call(client, {'jsonrpc': '2.0', 'id': 4, 'method': 'status', 'params': ['/a']})
+    assert service.calls == 2
+
+
+def test_uncached_method_is_always_called(client, call, service):
+    for request_id in range(2):
+        call(client, {'jsonrpc': '2.0', 'id': request_id, 'method': 'touch',
+                      'params': ['/a']})
+    assert service.calls == 2
+
+
+def test_params_differing_in_types_have_different_keys():
+    for params, other in (([b'a'], ["b'a'"]), ([{1: 'x'}], [{'1': 'x'}]), ((1, 2), [1, 2]),
+                          ([1], [1.0]), ([1], [True]), ([None], ['None'])):
+        assert ResponseCache.key('status', params, 0) != ResponseCache.key('status', other, 0)
+    # maps with keys of mixed types are keyed regardless of their order as well
+    assert (ResponseCache.key('status', [{1: 'a', 'b': 2}], 0) ==
+            ResponseCache.key('status', [{'b': 2, 1: 'a'}], 0))
+
+
+def test_params_with_mixed_keys_are_cached(server, service):
+    request = {'jsonrpc': '2.0', 'id': 1, 'method': 'status', 'params': [{1: 'a', 'b': 2}]}
+    for _ in range(2):
+        response = server.handle_request(request, codecs.JsonCodec()).result(timeout=5)
+        assert json.loads(codecs.JsonCodec().encode_response(response))['result'] == {
+            'path': {'1': 'a', 'b': 2}, 'synced': True}
+    assert service.calls == 1
+
+
+@pytest.mark.parametrize('codec_name, params, other', [
+    ('msgpack', b'a', "b'a'"),
+    ('msgpack', {b'a': 1, 'b': 2}, {"b'a'": 1, 'b': 2}),
+    ('msgpack', {1: 'x'}, {'1': 'x'}),
+    ('cbor', {1: 'x'}, {'1': 'x'}),
+])
+def test_cached_results_of_binary_codecs_do_not_collide(serve, service, codec_name,
+                                                         params, other):
+    codec_class = {'msgpack': codecs.MsgpackCodec, 'cbor': codecs.CborCodec}[codec_name]
+    try:
+        codec = codec_class()
+    except ImportError:
+        pytest.skip('{} is not installed'.format(codec_name))
+    server = RpcServer(transport=None, obj=service, cache=ResponseCache(ttl=None),
+                       codecs={codec.codec_id: codec})
+    client_socket = serve(server)
+    reader = framing.FrameReader(client_socket)
+    for request_id, path in enumerate((params, other, params)):
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': 'status',
+                   'params': [path]}
+        client_socket.sendall(framing.pack_frame(
+            codec.encode(request), framing.codec_flags(codec.codec_id)))
+        _, payload = reader.read_frame()
+        assert codec.decode(payload)['result'] == {'path': path, 'synced': True}
+    assert service.calls == 2
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer, exceptions
+from bourne_rpc.transport import unix_domain_socket
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+class Service:
+    def __init__(self):
+        self.events = []
+
+    def add(self, a, b):
+        return a + b
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    def selection_changed(self, path):
+        self.events.append(path)
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def client(socket_path, service):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, service, pipelined=True)
+    threading.Thread(target=server.serve, daemon=True).start()
+
+    with RpcClient(socket_path, pool_size=2, timeout=5,
+                   transport_class=unix_domain_socket.UnixSocket) as client:
+        yield client
+
+
+def test_call(client):
+    assert client.call('add', 1, 2) == 3
+    assert client.request('add', [3, 4]) == 7
+
+
+def test_error(client):
+    with pytest.raises(exceptions.RpcError) as excinfo:
+        client.call('missing')
+    assert excinfo.value.code == exceptions.ERROR_METHOD_NOT_FOUND
+
+
+def test_timeout(client):
+    with pytest.raises(exceptions.RpcTimeoutError):
+        client.request('sleep', [0.5], timeout=0.05)
+    # the late response does not confuse later calls
+    time.sleep(0.5)
+    assert client.call('add', 1, 1) == 2
+
+
+def test_concurrent_calls_share_connections(client):
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(lambda i: client.call('add', i, i), range(200)))
+    assert results == [2 * i for i in range(200)]
+    assert len([connection for connection in client._connections if connection]) == 2
+
+
+def test_batch(client):
+    with client.batch() as batch:
+        futures = [batch.call('add', i, 1) for i in range(10)]
+        failing = batch.call('missing')
+    assert [future.result() for future in futures] == list(range(1, 11))
+    with pytest.raises(exceptions.RpcError):
+        failing.result()
+
+
+def test_notify(client, service, wait_until):
+    client.notify('selection_changed', '/a')
+    wait_until(lambda: service.events)
+    assert service.events == ['/a']
+
+
+def test_reconnect(client):
+    assert client.call('add', 1, 2) == 3
+    for connection in client._connections:
+        if connection is not None:
+            connection.close()
+    assert client.call('add', 1, 2) == 3
+
+
+class AsyncService:
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+
+def test_async_client(socket_path):
+    async def main():
+        transport = unix_domain_socket.UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, AsyncService(), pipelined=True)
+        await server.start()
+        try:
+            async with AsyncRpcClient(socket_path) as client:
+                results = await asyncio.gather(
+                    *(client.call('sleep', i / 100) for i in range(10, 0, -1)))
+                assert results == [i / 100 for i in range(10, 0, -1)]
+
+                async with client.batch() as batch:
+                    future = batch.call('sleep', 0)
+                assert future.result() == 0
+
+                with pytest.raises(exceptions.RpcTimeoutError):
+                    await client.request('sleep', [1], timeout=0.01)
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
+
+
+@pytest.mark.skipif('not sys.platform.startswith("linux")')
+def test_seqpacket(tmp_path, service):
+    socket_path = os.path.join(str(tmp_path), 'seqpacket_socket')
+    transport = unix_domain_socket.UnixSocket(socket_path, seqpacket=True)
+    transport.bind()
+    threading.Thread(target=RpcServer(transport, service).serve, daemon=True).start()
+
+    with RpcClient(socket_path, transport_class=unix_domain_socket.UnixSocket,
+                   transport_options={'seqpacket': True}) as client:
+        big = 'x' * (1024 * 1024)
+        assert client.call('add', big, 'y') == big + 'y'
+        assert client.call('add', 1, 2) == 3
@@ -0,0 +1,106 @@
+import json
+import math
+
+import pytest
+
+from bourne_rpc import RpcServer, codecs, framing
+
+MESSAGE = {'jsonrpc': '2.0', 'id': 1, 'method': 'status',
+           'params': [['/a/ü', '/b'], {'recursive': True}]}
+
+
+def available_codecs():
+    result = [codecs.JsonCodec()]
+    for codec_class in (codecs.FastJsonCodec, codecs.MsgpackCodec, codecs.CborCodec):
+        try:
+            result.append(codec_class())
+        except ImportError:
+            pass
+    return result
+
+
+@pytest.mark.parametrize('codec', available_codecs(), ids=lambda codec: type(codec).__name__)
+def test_roundtrip(codec):
+    encoded = codec.encode(MESSAGE)
+    assert codec.decode(memoryview(bytearray(encoded))) == MESSAGE
+
+
+class Service:
+    def echo(self, value):
+        return value
+
+
+@pytest.mark.parametrize('codec', available_codecs(), ids=lambda codec: type(codec).__name__)
+def test_server_answers_with_codec_of_request(serve, codec):
+    client_socket = serve(RpcServer(
+        transport=None, obj=Service(),
+        codecs={codec.codec_id: codec for codec in available_codecs()}))
+
+    with client_socket:
+        request = {'jsonrpc': '2.0', 'id': 7, 'method': 'echo', 'params': [[1, 'x']]}
+        client_socket.sendall(framing.pack_frame(codec.encode(request),
+                                                 framing.codec_flags(codec.codec_id)))
+        flags, payload = framing.FrameReader(client_socket).read_frame()
+        assert framing.codec_id(flags) == codec.codec_id
+        assert codec.decode(payload) == {'jsonrpc': '2.0', 'id': 7, 'result': [1, 'x']}
+
+
+def test_unknown_codec_answers_json(serve):
+    client_socket = serve(RpcServer(transport=None, obj=Service(),
+                                    codecs={codecs.CODEC_JSON: codecs.JsonCodec()}))
+
+    with client_socket:
+        client_socket.sendall(framing.pack_frame(b'\x80', framing.codec_flags(3)))
+        flags, payload = framing.FrameReader(client_socket).read_frame()
+        assert flags == 0
+        assert json.loads(str(payload, 'utf8'))['error']['code'] == -32700
+
+
+@pytest.mark.parametrize('codec', available_codecs(), ids=lambda codec: type(codec).__name__)
+def test_encoded_result_is_spliced(codec):
+    result = {'path': '/a/ü', 'states': [1, 2]}
+    response = {'jsonrpc': '2.0', 'id': 1,
+                'result': codecs.EncodedResult(codec.encode(result))}
+    expected = {'jsonrpc': '2.0', 'id': 1, 'result': result}
+    assert codec.decode(codec.encode_response(response)) == expected
+    assert codec.decode(codec.encode_response([response, expected])) == [expected] * 2
+
+
+
+def fast_json_codec():
+    try:
+        return codecs.FastJsonCodec()
+    except ImportError:
+        pytest.skip('neither orjson nor ujson is installed')
+
+
+@pytest.mark.parametrize('obj', [
+    {1: 'a', 'b': 2},
+    [2 ** 70, -2 ** 70],
+    {'path': '/a', 'mtime': None},
+], ids=['non_str_keys', 'big_ints', 'null'])
+def test_fast_json_encodes_like_json(obj):
+    encoded = fast_json_codec().encode(obj)
+    standard = codecs.JsonCodec()
+    assert repr(standard.decode(encoded)) == repr(standard.decode(standard.encode(obj)))
+
+
+def test_fast_json_encodes_nan_as_null_with_orjson():
+    if codecs.orjson is None:
+        pytest.skip('orjson is not installed')
+    assert fast_json_codec().encode([float('nan'), float('inf')]) == b'[null,null]'
+
+
+@pytest.mark.parametrize('codec', available_codecs(), ids=lambda codec: type(codec).__name__)
+def test_maps_with_int_keys(codec):
+    encoded = codec.encode({1: 'a', 'b': 2})
+    assert codec.decode(encoded) in ({1: 'a', 'b': 2}, {'1': 'a', 'b': 2})
+
+
+def test_fast_json_decodes_nan():
+    fast = fast_json_codec()
+    decoded = fast.decode(memoryview(bytearray(b'[NaN, Infinity, -Infinity]')))
+    assert math.isnan(decoded[0]) and decoded[1:] == [math.inf, -math.inf]
+    assert fast.decode(b'{"1": null}') == {'1': None}
+    with pytest.raises(ValueError):
+        fast.decode(b'[')
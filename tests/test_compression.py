@@ -0,0 +1,115 @@
+import asyncio
+import concurrent.futures
+import os
+import socket
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, framing
+from bourne_rpc import compression
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+PAYLOAD = b'{"path": "/some/folder/file.txt", "size": 1234}, ' * 2000
+
+
+@pytest.mark.parametrize('name', sorted(compression.default_compressors()))
+def test_round_trip(name, monkeypatch):
+    monkeypatch.setattr(compression, 'CHUNK_SIZE', 1000)
+    compressor = compression.default_compressors()[name]
+    # zstd only puts out whole blocks of up to 128 KiB
+    payload = PAYLOAD * 4
+    chunks = compressor.compress(memoryview(payload))
+    assert len(chunks) > 2
+    assert compression.decompress(b''.join(chunks), len(payload)) == payload
+
+
+def test_zstd_is_thread_safe():
+    pytest.importorskip('zstandard')
+    compressor = compression.ZstdCompressor()
+    payloads = [PAYLOAD + str(i).encode() * 1000 for i in range(8)]
+
+    def round_trips(payload):
+        for _ in range(20):
+            compressed = b''.join(compressor.compress(payload))
+            assert compressor.decompress(compressed[1:], len(payload)) == payload
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(round_trips, payloads))
+
+
+def test_decompressed_size_is_limited():
+    compressed = b''.join(compression.ZlibCompressor().compress(PAYLOAD))
+    with pytest.raises(ValueError):
+        compression.decompress(compressed, len(PAYLOAD) - 1)
+    with pytest.raises(ValueError):
+        compression.decompress(b'\xff' + compressed[1:], len(PAYLOAD))
+
+
+def test_choose_follows_preference_of_the_client():
+    compressors = {'zlib': compression.ZlibCompressor()}
+    assert compression.choose(['brotli', 'zlib'], compressors).name == 'zlib'
+    assert compression.choose(['brotli'], compressors) is None
+
+
+def test_frame_reader_decompresses():
+    payload, flags = framing.compress_payload(compression.ZlibCompressor(), PAYLOAD,
+                                              framing.codec_flags(1))
+    assert flags & framing.FLAG_COMPRESSED
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        framing.send_frame(sender, payload, flags)
+        flags, received = framing.FrameReader(receiver).read_frame()
+    assert flags == framing.codec_flags(1)
+    assert bytes(received) == PAYLOAD
+
+
+def test_incompressible_payload_is_sent_as_it_is():
+    payload = os.urandom(1000)
+    assert framing.compress_payload(compression.ZlibCompressor(), payload, 0) == (
+        payload, 0)
+
+
+class Service:
+    def echo(self, value):
+        return value
+
+
+@pytest.mark.parametrize('compressors', [None, {}])
+def test_negotiated_compression(socket_path, serve_socket, compressors):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+    server = serve_socket(Service(), compressors=compressors, compression_threshold=1024)
+    value = PAYLOAD.decode()
+    with RpcClient(socket_path, pool_size=1, timeout=5, transport_class=UnixSocket,
+                   compression=['zlib']) as client:
+        assert client.call('echo', 'small') == 'small'
+        assert client.call('echo', value) == value
+        stats = server.stats()['compression']
+        if compressors is None:
+            # the request and the response
+            assert stats['compressed'] == 1 and stats['decompressed'] == 1
+            assert stats['ratio'] > 10
+        else:
+            assert stats['compressed'] == stats['decompressed'] == 0
+
+
+def test_async_negotiated_compression(socket_path):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+
+    async def main():
+        transport = UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, Service(), compression_threshold=1024)
+        await server.start()
+        client = AsyncRpcClient(socket_path, timeout=5, compression=True)
+        try:
+            value = PAYLOAD.decode()
+            assert await client.call('echo', value) == value
+            stats = server.stats()['compression']
+            assert stats['compressed'] == 1 and stats['decompressed'] == 1
+        finally:
+            await client.close()
+            await server.stop()
+
+    asyncio.run(main())
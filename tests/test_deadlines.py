@@ -0,0 +1,234 @@
+import asyncio
+import concurrent.futures
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, exceptions
+from bourne_rpc import framing, rpc_method
+from bourne_rpc.client import make_request
+from bourne_rpc.deadlines import DeadlineScheduler
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+def test_scheduler_calls_expired_deadlines_in_order():
+    scheduler = DeadlineScheduler()
+    expired = []
+    done = threading.Event()
+    scheduler.schedule(0.05, lambda: (expired.append('late'), done.set()))
+    scheduler.schedule(0.01, lambda: expired.append('early'))
+    scheduler.schedule(0.02, lambda: expired.append('cancelled')).cancel()
+    assert done.wait(timeout=5)
+    assert expired == ['early', 'late']
+    assert len(scheduler) == 0
+
+
+def test_cancelled_deadlines_do_not_pile_up():
+    scheduler = DeadlineScheduler()
+    for _ in range(100):
+        scheduler.schedule(60, lambda: None).cancel()
+    assert len(scheduler._heap) <= 1
+
+
+class Service:
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+        self.produced = 0
+
+    @rpc_method
+    def block(self, name):
+        self.started.append(name)
+        self.release.wait(5)
+        return name
+
+    @rpc_method(timeout=0.05)
+    def limited(self):
+        self.release.wait(5)
+
+    @rpc_method
+    def add(self, a, b):
+        return a + b
+
+    @rpc_method
+    def big(self, size):
+        return 'x' * size
+
+    @rpc_method
+    def items(self, count):
+        for i in range(count):
+            self.produced += 1
+            time.sleep(0.01)
+            yield i
+
+
+def connect(socket_path):
+    from bourne_rpc.transport import unix_domain_socket
+    return RpcClient(socket_path, pool_size=1, timeout=5,
+                     transport_class=unix_domain_socket.UnixSocket)
+
+
+def request_with_deadline(client, method, params, timeout):
+    """ sends a request with a deadline shorter than the client waits for it """
+    request_id = client.next_id()
+    future = concurrent.futures.Future()
+    client.send(client.codec.encode(make_request(method, params, request_id, timeout)),
+                {request_id: future})
+    client.wait({request_id: future})
+    return future.result()
+
+
+def test_method_timeout(socket_path, serve_socket):
+    service = Service()
+    server = serve_socket(service)
+    client = connect(socket_path)
+    with client:
+        with pytest.raises(exceptions.RpcTimeoutError):
+            client.call('limited')
+        service.release.set()
+        assert server.stats()['timeouts'] == 1
+
+
+def test_queued_request_is_dropped_at_its_deadline(socket_path, serve_socket,
+                                                   wait_until):
+    service = Service()
+    serve_socket(service, max_workers=1, pipelined=True)
+    client = connect(socket_path)
+    with client:
+        threading.Thread(target=client.call, args=('block', 'first'), daemon=True).start()
+        wait_until(lambda: service.started)
+        response = request_with_deadline(client, 'block', ['second'], 0.05)
+        assert response['error']['code'] == exceptions.ERROR_TIMEOUT
+        service.release.set()
+        assert client.call('add', 1, 2) == 3
+        assert service.started == ['first']
+
+
+def test_client_cancels_request_it_gave_up_on(socket_path, serve_socket, wait_until):
+    service = Service()
+    server = serve_socket(service, max_workers=1, pipelined=True)
+    client = connect(socket_path)
+    with client:
+        threading.Thread(target=client.call, args=('block', 'first'), daemon=True).start()
+        wait_until(lambda: service.started)
+        with pytest.raises(exceptions.RpcTimeoutError):
+            client.request('block', ['second'], timeout=0.05)
+        time.sleep(0.1)
+        assert server.stats()['cancelled'] + server.stats()['timeouts'] == 1
+        service.release.set()
+        assert client.call('add', 1, 2) == 3
+        assert service.started == ['first']
+
+
+def test_client_not_reading_does_not_hold_up_deadlines(socket_path, serve_socket):
+    service = Service()
+    serve_socket(service, pipelined=True)
+    client = connect(socket_path)
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(socket_path)
+    try:
+        # the response does not fit into the socket buffers, writing it blocks
+        for request in ({'jsonrpc': '2.0', 'id': 1, 'method': 'big', 'params': [1 << 24]},
+                        {'jsonrpc': '2.0', 'id': 2, 'method': 'limited'}):
+            stalled.sendall(framing.pack_frame(json.dumps(request).encode()))
+            time.sleep(0.2)
+        with client:
+            start = time.monotonic()
+            response = request_with_deadline(client, 'block', ['other'], 0.2)
+            assert response['error']['code'] == exceptions.ERROR_TIMEOUT
+            assert time.monotonic() - start < 2
+    finally:
+        service.release.set()
+        stalled.close()
+
+
+@pytest.mark.parametrize('cancel', [False, True])
+def test_aborted_stream_stops(socket_path, serve_socket, cancel):
+    from bourne_rpc.client import cancel_request
+    service = Service()
+    serve_socket(service, pipelined=True, stream_chunk_size=2)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.settimeout(5)
+        reader = framing.FrameReader(sock)
+        sock.sendall(framing.pack_frame(json.dumps(make_request(
+            'items', [100], 1, timeout=None if cancel else 0.2)).encode()))
+        if cancel:
+            time.sleep(0.2)
+            sock.sendall(framing.pack_frame(json.dumps(cancel_request(1)).encode()))
+        frames = []
+        while not frames or 'chunk' in frames[-1]:
+            frames.append(json.loads(bytes(reader.read_frame()[1])))
+        assert frames[-1]['error']['code'] in (exceptions.ERROR_TIMEOUT,
+                                               exceptions.ERROR_CANCELLED)
+        # nothing follows the error
+        sock.settimeout(0.3)
+        with pytest.raises(socket.timeout):
+            reader.read_frame()
+        assert service.produced < 100
+
+
+def test_invalid_timeout(socket_path, serve_socket):
+    serve_socket(Service())
+    client = connect(socket_path)
+    with client:
+        response = request_with_deadline(client, 'add', [1, 2], 'soon')
+        assert response['error']['code'] == exceptions.InvalidRequestError.code
+
+
+class AsyncService:
+    def __init__(self):
+        self.cancelled = asyncio.Event()
+
+    @rpc_method
+    async def sleep(self, seconds):
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        return seconds
+
+    @rpc_method(timeout=0.05)
+    async def limited(self, seconds):
+        return await self.sleep(seconds)
+
+
+def test_async_deadline_and_cancel(socket_path):
+    from bourne_rpc.transport import unix_domain_socket
+
+    async def main():
+        transport = unix_domain_socket.UnixSocket(socket_path)
+        transport.bind()
+        service = AsyncService()
+        server = AsyncRpcServer(transport, service, pipelined=True, default_timeout=10)
+        await server.start()
+        client = AsyncRpcClient(socket_path, timeout=5)
+        try:
+            with pytest.raises(exceptions.RpcTimeoutError):
+                await client.call('limited', 10)
+            await asyncio.wait_for(service.cancelled.wait(), 5)
+
+            # cancelling a request by its id
+            service.cancelled.clear()
+            connection = await client._connection()
+            future = asyncio.get_running_loop().create_future()
+            await connection.send(client.codec.encode(
+                {'jsonrpc': '2.0', 'id': 'slow', 'method': 'sleep', 'params': [10]}),
+                {'slow': future})
+            await asyncio.sleep(0.05)
+            await client.cancel(connection, 'slow')
+            response = await asyncio.wait_for(future, 5)
+            assert response['error']['code'] == exceptions.ERROR_CANCELLED
+            assert service.cancelled.is_set()
+            assert server.stats()['cancelled'] == 1
+            assert await client.call('sleep', 0) == 0
+        finally:
+            await client.close()
+            await server.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+import pytest
+
+from bourne_rpc import exceptions
+from bourne_rpc.dispatch import DispatchTable, MethodEntry, rpc_method
+from bourne_rpc.server import BaseRpcServer
+
+
+class PlainService:
+    value = 1
+
+    def status(self, path, recursive=False):
+        return path, recursive
+
+    def _private(self):
+        pass
+
+    @property
+    def prop(self):
+        raise AssertionError('properties must not be evaluated')
+
+
+class DecoratedService:
+    @rpc_method
+    def status(self, path):
+        return path
+
+    @rpc_method(name='sync.start', priority='bulk')
+    def start(self, *, folder):
+        return folder
+
+    def not_exposed(self):
+        pass
+
+
+def test_public_methods_by_default():
+    table = DispatchTable(PlainService())
+    assert set(table.entries) == {'status'}
+
+
+def test_allowlist():
+    assert set(DispatchTable(PlainService(), allowlist=['status']).entries) == {'status'}
+
+
+def test_decorated_methods_only():
+    table = DispatchTable(DecoratedService(), allowlist=['not_exposed'])
+    assert set(table.entries) == {'status', 'sync.start'}
+    assert table.lookup('sync.start').options == {'priority': 'bulk'}
+
+
+@pytest.mark.parametrize('name', ['missing', '_private', '__class__', 'value', None, []])
+def test_method_not_found(name):
+    with pytest.raises(exceptions.MethodNotFoundError):
+        DispatchTable(PlainService()).lookup(name)
+
+
+@pytest.mark.parametrize('params, expected', [
+    (['/a'], (['/a'], {})),
+    (['/a', True], (['/a', True], {})),
+    ({'path': '/a'}, ((), {'path': '/a'})),
+    ({'path': '/a', 'recursive': True}, ((), {'path': '/a', 'recursive': True})),
+])
+def test_bind(params, expected):
+    assert DispatchTable(PlainService()).lookup('status').bind(params) == expected
+
+
+@pytest.mark.parametrize('params', [
+    None, [], ['/a', True, 3], {'recursive': True}, {'path': '/a', 'other': 1}, 'x',
+])
+def test_bind_invalid(params):
+    with pytest.raises(exceptions.InvalidParamsError):
+        DispatchTable(PlainService()).lookup('status').bind(params)
+
+
+def test_keyword_only_requires_named_params():
+    entry = DispatchTable(DecoratedService()).lookup('sync.start')
+    with pytest.raises(exceptions.InvalidParamsError):
+        entry.bind(['/a'])
+    assert entry.bind({'folder': '/a'}) == ((), {'folder': '/a'})
+
+
+@pytest.mark.parametrize('params', [{}, {'x': 7, 'y': 2}])
+def test_positional_only_requires_positional_params(params):
+    entry = MethodEntry('divmod', divmod)
+    with pytest.raises(exceptions.InvalidParamsError):
+        entry.bind(params)
+    assert entry.bind([7, 2]) == ([7, 2], {})
+
+
+def test_error_responses():
+    server = BaseRpcServer(transport=None, obj=PlainService())
+    for request, code in [
+        ({'jsonrpc': '2.0', 'id': 1, 'method': 'missing'}, -32601),
+        ({'jsonrpc': '2.0', 'id': 1, 'method': 'status', 'params': []}, -32602),
+    ]:
+        with pytest.raises(exceptions.RequestError) as excinfo:
+            server.resolve(request)
+        response = server.error_response_for(request, excinfo.value)
+        assert response['error']['code'] == code
+
+        # notifications are not answered
+        del request['id']
+        assert server.error_response_for(request, excinfo.value) is None
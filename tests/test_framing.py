@@ -0,0 +1,130 @@
+import pytest
+
+from bourne_rpc import framing
+
+
+class ChunkedTransport:
+    """ fake transport returning the given data in chunks of a fixed size to simulate
+    short reads """
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def recv_into(self, buffer):
+        self.calls += 1
+        chunk = self.data[:min(self.chunk_size, len(buffer))]
+        self.data = self.data[len(chunk):]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1024])
+def test_short_reads(chunk_size):
+    payloads = [b'hello', b'', b'x' * 1000]
+    transport = ChunkedTransport(b''.join(map(framing.pack_frame, payloads)), chunk_size)
+    reader = framing.FrameReader(transport, buffer_size=16)
+
+    for payload in payloads:
+        assert bytes(reader.read_frame()[1]) == payload
+    assert reader.read_frame() is None
+
+
+def test_pipelined_frames_single_read():
+    """ several frames in one read are returned without hitting the transport again """
+    payloads = [str(i).encode() * i for i in range(20)]
+    transport = ChunkedTransport(b''.join(map(framing.pack_frame, payloads)), 1 << 20)
+    reader = framing.FrameReader(transport)
+
+    for payload in payloads:
+        assert bytes(reader.read_frame()[1]) == payload
+    assert transport.calls == 1
+
+
+def test_payload_decodes_from_buffer():
+    transport = ChunkedTransport(framing.pack_frame('{"a": "ü"}'.encode('utf8')), 4)
+    reader = framing.FrameReader(transport)
+    assert str(reader.read_frame()[1], 'utf8') == '{"a": "ü"}'
+
+
+def test_truncated_frame():
+    transport = ChunkedTransport(framing.pack_frame(b'abcdef')[:-2], 1024)
+    reader = framing.FrameReader(transport)
+    with pytest.raises(ConnectionError):
+        reader.read_frame()
+
+
+def test_flags():
+    frame = framing.pack_frame(b'abc', framing.codec_flags(2))
+    reader = framing.FrameReader(ChunkedTransport(frame, 1024))
+    flags, payload = reader.read_frame()
+    assert framing.codec_id(flags) == 2
+    assert bytes(payload) == b'abc'
+
+
+def test_frame_too_big():
+    with pytest.raises(ValueError):
+        framing.pack_header(framing.LENGTH_MASK + 1)
+
+
+def test_frame_longer_than_maximum_is_rejected():
+    reader = framing.FrameReader(
+        ChunkedTransport(framing.pack_header(framing.LENGTH_MASK), 1024), buffer_size=16)
+    with pytest.raises(ConnectionError):
+        reader.read_frame()
+    # nothing got allocated for the payload
+    assert len(reader._buffer) == 16
+
+    reader = framing.FrameReader(ChunkedTransport(framing.pack_frame(b'x' * 11), 1024),
+                                 max_frame_size=10)
+    with pytest.raises(ConnectionError):
+        reader.read_frame()
+
+
+def test_decompressed_frame_longer_than_maximum_is_rejected():
+    from bourne_rpc.compression import ZlibCompressor
+    payload, flags = framing.compress_payload(ZlibCompressor(), b'x' * 1000, 0)
+    frame = framing.pack_header(sum(map(len, payload)), flags) + b''.join(payload)
+    reader = framing.FrameReader(ChunkedTransport(frame, 1024), max_frame_size=999)
+    with pytest.raises(ConnectionError):
+        reader.read_frame()
+
+
+class PartialSender:
+    """ fake `sendmsg` writing at most a few bytes per call """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.data = b''
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        self.calls.append(len(buffers))
+        chunk = b''.join(bytes(buffer) for buffer in buffers)[:self.chunk_size]
+        self.data += chunk
+        return len(chunk)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1 << 20])
+def test_sendmsg_all_partial_writes(chunk_size):
+    buffers = [b'abc', b'', bytearray(b'defgh'), memoryview(b'ij')]
+    sender = PartialSender(chunk_size)
+    writes = framing.sendmsg_all(sender.sendmsg, buffers)
+    assert sender.data == b'abcdefghij'
+    assert writes == len(sender.calls) == (1 if chunk_size > 10 else -(-10 // chunk_size))
+
+
+def test_sendmsg_all_splits_at_iov_max(monkeypatch):
+    monkeypatch.setattr(framing, 'IOV_MAX', 3)
+    sender = PartialSender(1 << 20)
+    assert framing.sendmsg_all(sender.sendmsg, [b'x'] * 7) == 3
+    assert sender.calls == [3, 3, 1]
+
+
+def test_send_frames_single_write():
+    sender = PartialSender(1 << 20)
+    sender.send_buffers = lambda buffers: framing.sendmsg_all(sender.sendmsg, buffers)
+    payloads = [b'hello', b'x' * 100000]
+    assert framing.send_frames(sender, [(payload, 0) for payload in payloads]) == 1
+    assert sender.data == b''.join(map(framing.pack_frame, payloads))
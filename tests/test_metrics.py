@@ -0,0 +1,97 @@
+import json
+import time
+
+import pytest
+
+from bourne_rpc import RpcServer, framing
+from bourne_rpc.metrics import LatencyHistogram, ServerMetrics
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) is None
+    for _ in range(99):
+        histogram.record(1000)
+    histogram.record(1000000)
+
+    # 1000 ns fall into the bucket from 512 to 1024 ns
+    assert 512e-9 <= histogram.percentile(0.5) <= 1024e-9
+    assert histogram.percentile(0.99) <= 1024e-9
+    assert histogram.percentile(1.0) > 512e-6
+    assert histogram.stats()['mean'] == pytest.approx((99 * 1000 + 1000000) / 100 / 1e9)
+
+
+def test_record_is_cheap():
+    metrics = ServerMetrics()
+    start = time.perf_counter()
+    for _ in range(100000):
+        metrics.record('status', metrics.now() - 1000)
+    # around a microsecond per call including the clock, headroom for slow machines
+    assert time.perf_counter() - start < 0.3
+    assert metrics.stats()['methods']['status']['calls'] == 100000
+
+
+class Service:
+    def status(self, path):
+        return path
+
+    def fail(self):
+        raise ValueError('nope')
+
+    def listdir(self, count):
+        for i in range(count):
+            yield {'name': 'file{}'.format(i)}
+
+
+@pytest.fixture
+def server():
+    return RpcServer(transport=None, obj=Service())
+
+
+def test_rpc_stats(client, call):
+    for request_id in range(3):
+        call(client, {'jsonrpc': '2.0', 'id': request_id, 'method': 'status',
+                      'params': ['/a']})
+    call(client, {'jsonrpc': '2.0', 'id': 3, 'method': 'fail'})
+    call(client, {'jsonrpc': '2.0', 'id': 4, 'method': 'unknown'})
+
+    stats = call(client, {'jsonrpc': '2.0', 'id': 5, 'method': 'rpc.stats'})['result']
+    assert 'connections' in stats and 'queue_depth' in stats
+    assert stats['requests'] == 5
+    assert stats['rejected'] == 1
+    assert stats['bytes_in'] > 0 and stats['bytes_out'] > 0
+    assert stats['methods']['status']['calls'] == 3
+    assert stats['methods']['status']['errors'] == 0
+    assert stats['methods']['status']['p99'] > 0
+    assert stats['methods']['fail'] == {**stats['methods']['fail'], 'calls': 1,
+                                        'errors': 1}
+    assert 'unknown' not in stats['methods']
+
+
+def test_metrics_disabled():
+    server = RpcServer(transport=None, obj=Service(), metrics=False)
+    assert 'methods' not in server.stats()
+    assert server.stats()['connections'] == 0
+
+
+def test_bytes_out_counts_chunks_and_events(client, server):
+    reader = framing.FrameReader(client)
+    received = 0
+
+    def read():
+        nonlocal received
+        _, payload = reader.read_frame()
+        received += framing.HEADER.size + len(payload)
+        return json.loads(str(payload, 'utf8'))
+
+    client.sendall(framing.pack_frame(json.dumps(
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'rpc.subscribe', 'params': ['status']}
+    ).encode('utf8')))
+    read()
+    server.publish('status', {'path': '/a'})
+    assert read()['method'] == 'status'
+    client.sendall(framing.pack_frame(json.dumps(
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'listdir', 'params': [100]}).encode('utf8')))
+    while 'chunk' in read():
+        pass
+    assert server.metrics.bytes_out == received
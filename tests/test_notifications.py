@@ -0,0 +1,33 @@
+import threading
+
+from bourne_rpc.notifications import NotificationExecutor
+
+
+def test_overflow_is_dropped_and_counted():
+    release = threading.Event()
+    executed = []
+
+    def blocking(value):
+        release.wait()
+        executed.append(value)
+
+    executor = NotificationExecutor(queue_size=2)
+    # the first one is taken by the worker and blocks it, two more fit into the queue
+    results = [executor.submit(blocking, i) for i in range(10)]
+    release.set()
+    executor.shutdown()
+
+    assert results.count(False) == len(results) - len(executed)
+    assert executor.counters.stats() == {'received': 10, 'dropped': results.count(False),
+                                         'failed': 0}
+    assert executed == sorted(executed)
+
+
+def test_failures_are_counted():
+    def failing():
+        raise ValueError()
+
+    executor = NotificationExecutor()
+    executor.submit(failing)
+    executor.shutdown()
+    assert executor.counters.failed == 1
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import RpcClient, exceptions
+from bourne_rpc.transport import unix_domain_socket
+
+prefork = pytest.importorskip('bourne_rpc.prefork')
+pytestmark = pytest.mark.skipif('not hasattr(os, "fork")')
+
+
+class Service:
+    def pid(self):
+        return os.getpid()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    def crash(self):
+        os._exit(1)
+
+
+@pytest.fixture
+def supervisor(socket_path):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    supervisor = prefork.PreforkServer(transport, Service(), workers=2, restart_delay=0,
+                                       drain_timeout=5)
+    thread = threading.Thread(target=supervisor.serve, daemon=True)
+    thread.start()
+    supervisor.socket_path = socket_path
+    supervisor.thread = thread
+    yield supervisor
+    supervisor.stop()
+    thread.join(timeout=10)
+
+
+def client(socket_path, **kwargs):
+    return RpcClient(socket_path, transport_class=unix_domain_socket.UnixSocket, **kwargs)
+
+
+def test_connections_are_spread_across_workers(supervisor):
+    pids = set()
+    for _ in range(20):
+        with client(supervisor.socket_path, pool_size=1) as rpc_client:
+            pids.add(rpc_client.call('pid'))
+    assert pids <= set(supervisor.worker_pids)
+    assert len(pids) == 2
+
+
+def test_crashed_worker_is_restarted(supervisor, wait_until):
+    with client(supervisor.socket_path, pool_size=1, timeout=5) as rpc_client:
+        with pytest.raises((ConnectionError, exceptions.RpcTimeoutError)):
+            rpc_client.call('crash')
+    wait_until(lambda: supervisor.restarts == 1 and len(supervisor.worker_pids) == 2)
+    with client(supervisor.socket_path, pool_size=1) as rpc_client:
+        assert rpc_client.call('pid') in supervisor.worker_pids
+
+
+def test_stop_drains_requests_in_flight(supervisor):
+    with client(supervisor.socket_path, pool_size=1, timeout=5) as rpc_client:
+        rpc_client.call('pid')
+        result = []
+        thread = threading.Thread(target=lambda: result.append(rpc_client.call('sleep', 0.5)))
+        thread.start()
+        time.sleep(0.1)
+        supervisor.stop()
+        thread.join(timeout=5)
+        assert result == [0.5]
+    supervisor.thread.join(timeout=10)
+    assert not supervisor.thread.is_alive()
+    assert supervisor.worker_pids == []
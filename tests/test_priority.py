@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import PriorityExecutor, RpcClient, RpcServer, exceptions, rpc_method
+from bourne_rpc.priority import LANE_BULK, LANE_INTERACTIVE
+
+
+def test_reserved_worker_is_left_to_interactive_calls(wait_until):
+    executor = PriorityExecutor(max_workers=2, reserved=1)
+    release = threading.Event()
+    try:
+        bulk = [executor.submit_to(LANE_BULK, release.wait, 5) for _ in range(3)]
+        wait_until(lambda: executor.lane_stats()[LANE_BULK]['running'] == 1)
+        default = executor.submit(lambda: 'default')
+        interactive = executor.submit_to(LANE_INTERACTIVE, lambda: 'interactive')
+        assert interactive.result(timeout=5) == 'interactive'
+        # the only shared worker is busy with bulk work
+        assert not default.done()
+        release.set()
+        assert default.result(timeout=5) == 'default'
+        assert all(future.result(timeout=5) for future in bulk)
+    finally:
+        release.set()
+        executor.shutdown()
+    stats = executor.lane_stats()
+    assert stats[LANE_BULK]['submitted'] == 3
+    assert stats[LANE_INTERACTIVE]['wait_p99'] < 1
+
+
+def test_more_important_lane_goes_first(wait_until):
+    executor = PriorityExecutor(max_workers=1, reserved=0, aging=None)
+    release = threading.Event()
+    order = []
+    try:
+        executor.submit(release.wait, 5)
+        wait_until(lambda: executor.lane_stats()['default']['running'] == 1)
+        futures = [executor.submit_to(lane, order.append, lane)
+                   for lane in (LANE_BULK, 'default', LANE_INTERACTIVE)]
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        executor.shutdown()
+    assert order == [LANE_INTERACTIVE, 'default', LANE_BULK]
+
+
+def test_waiting_bulk_work_ages(wait_until):
+    executor = PriorityExecutor(max_workers=1, reserved=0, aging=0.01)
+    release = threading.Event()
+    order = []
+    try:
+        executor.submit(release.wait, 5)
+        wait_until(lambda: executor.lane_stats()['default']['running'] == 1)
+        bulk = executor.submit_to(LANE_BULK, order.append, LANE_BULK)
+        time.sleep(0.05)
+        interactive = executor.submit_to(LANE_INTERACTIVE, order.append, LANE_INTERACTIVE)
+        release.set()
+        bulk.result(timeout=5)
+        interactive.result(timeout=5)
+    finally:
+        executor.shutdown()
+    assert order == [LANE_BULK, LANE_INTERACTIVE]
+
+
+def test_invalid_lanes():
+    with pytest.raises(ValueError):
+        PriorityExecutor(max_workers=1, reserved=1)
+    with pytest.raises(ValueError):
+        PriorityExecutor(lane_workers={'urgent': 1})
+    executor = PriorityExecutor(max_workers=1, reserved=0)
+    with pytest.raises(ValueError):
+        executor.submit_to('urgent', print)
+    executor.shutdown()
+
+
+class Service:
+    def __init__(self):
+        self.release = threading.Event()
+
+    @rpc_method(priority='bulk')
+    def export(self):
+        self.release.wait(5)
+        return 'exported'
+
+    @rpc_method(priority='interactive')
+    def status(self, path):
+        return {'path': path, 'synced': True}
+
+    @rpc_method
+    def echo(self, value):
+        return value
+
+
+@pytest.mark.skipif('sys.platform == "win32"')
+def test_server_schedules_by_method_priority(socket_path, wait_until):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+    transport = UnixSocket(socket_path)
+    transport.bind()
+    service = Service()
+    executor = PriorityExecutor(max_workers=3, reserved=1)
+    server = RpcServer(transport, service, executor=executor, pipelined=True)
+    threading.Thread(target=server.serve, daemon=True).start()
+    with RpcClient(socket_path, pool_size=2, timeout=5,
+                   transport_class=UnixSocket) as client:
+        exports = [threading.Thread(target=client.call, args=('export',), daemon=True)
+                   for _ in range(3)]
+        for thread in exports:
+            thread.start()
+        wait_until(lambda: server.stats()['lanes']['bulk']['queued'] == 2)
+        assert client.call('status', '/a') == {'path': '/a', 'synced': True}
+        # the request may ask for another lane
+        assert client.request('echo', [1], priority='interactive') == 1
+        with pytest.raises(exceptions.RpcError):
+            client.request('echo', [1], priority='urgent')
+        service.release.set()
+        for thread in exports:
+            thread.join(5)
+        lanes = server.stats()['lanes']
+        assert lanes['bulk']['submitted'] == 3
+        assert lanes['interactive']['submitted'] == 2
+    server.stop()
+    executor.shutdown()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer, framing
+from bourne_rpc.pubsub import PendingEvents
+from bourne_rpc.transport import unix_domain_socket
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+def test_pending_events_are_coalesced_and_bounded():
+    pending = PendingEvents(queue_size=2)
+    pending.push('status', {'synced': False}, '/a')
+    pending.push('status', {'synced': False}, '/b')
+    pending.push('status', {'synced': True}, '/a')
+    assert pending.coalesced == 1
+    pending.push('status', {'synced': True}, '/c')
+    assert pending.dropped == 1
+    assert [pending.pop() for _ in range(len(pending))] == [
+        ('status', {'synced': False}), ('status', {'synced': True})]
+
+
+def test_pending_events_without_key_are_queued():
+    pending = PendingEvents(queue_size=3)
+    for line in range(4):
+        pending.push('log', [line], None)
+    pending.push('status', {'synced': True}, None)
+    assert pending.coalesced == 0
+    assert pending.dropped == 2
+    assert [pending.pop() for _ in range(len(pending))] == [
+        ('log', [2]), ('log', [3]), ('status', {'synced': True})]
+
+
+class Service:
+    def add(self, a, b):
+        return a + b
+
+
+def test_subscribe_over_socket():
+    server_socket, client_socket = socket.socketpair()
+    server = RpcServer(transport=None, obj=Service())
+    thread = threading.Thread(target=server.handler, args=(server_socket,), daemon=True)
+    thread.start()
+    reader = framing.FrameReader(client_socket)
+
+    def call(request):
+        client_socket.sendall(framing.pack_frame(json.dumps(request).encode('utf8')))
+        _, payload = reader.read_frame()
+        return json.loads(str(payload, 'utf8'))
+
+    assert call({'jsonrpc': '2.0', 'id': 1, 'method': 'rpc.subscribe',
+                 'params': ['status']})['result'] == ['status']
+    assert server.publish('status', {'path': '/a'}) == 1
+    assert server.publish('other') == 0
+    _, payload = reader.read_frame()
+    assert json.loads(str(payload, 'utf8')) == {'jsonrpc': '2.0', 'method': 'status',
+                                                 'params': {'path': '/a'}}
+
+    assert call({'jsonrpc': '2.0', 'id': 2, 'method': 'rpc.subscribe',
+                 'params': 'status'})['error']['code'] == -32602
+    assert call({'jsonrpc': '2.0', 'id': 3, 'method': 'rpc.unsubscribe'})['result'] == []
+    assert server.pubsub.subscriber_count('status') == 0
+
+    call({'jsonrpc': '2.0', 'id': 4, 'method': 'rpc.subscribe', 'params': ['status']})
+    client_socket.close()
+    thread.join(timeout=5)
+    assert server.pubsub.subscriber_count('status') == 0
+
+
+def test_client_subscription(socket_path, wait_until):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, Service())
+    threading.Thread(target=server.serve, daemon=True).start()
+
+    events = []
+    with RpcClient(socket_path, transport_class=unix_domain_socket.UnixSocket) as client:
+        client.subscribe('status', events.append)
+        for i in range(3):
+            server.publish('status', {'path': '/a', 'version': i}, key='/a')
+        wait_until(lambda: events and events[-1]['version'] == 2)
+        assert client.call('add', 1, 2) == 3
+
+        client.unsubscribe('status')
+        assert server.pubsub.subscriber_count('status') == 0
+
+
+def test_async_client_subscription(socket_path):
+    async def main():
+        transport = unix_domain_socket.UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, Service())
+        await server.start()
+        try:
+            async with AsyncRpcClient(socket_path) as client:
+                received = asyncio.Event()
+                events = []
+
+                def on_event(params):
+                    events.append(params)
+                    received.set()
+
+                await client.subscribe('status', on_event)
+                assert server.publish('status', ['/a']) == 1
+                await asyncio.wait_for(received.wait(), 5)
+                assert events == [['/a']]
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
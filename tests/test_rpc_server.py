@@ -1,6 +1,206 @@
-from unittest.mock import MagicMock
-from bourne_rpc import RpcServer
+import json
+import socket
+import threading
+import time
 
+import pytest
 
-def test_basic_server():
-    pass
+from bourne_rpc import RpcServer, framing
+
+
+class Service:
+    def add(self, a, b):
+        return a + b
+
+    def __init__(self):
+        self.events = []
+
+    def selection_changed(self, path):
+        self.events.append(path)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    def slow_status(self, path):
+        time.sleep(0.1)
+        return {'path': path, 'synced': True}
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def server(service):
+    return RpcServer(transport=None, obj=service, max_workers=10)
+
+
+def send(client_socket, message):
+    client_socket.sendall(framing.pack_frame(json.dumps(message).encode('utf8')))
+
+
+def receive(client_socket):
+    _, payload = framing.FrameReader(client_socket).read_frame()
+    return json.loads(str(payload, 'utf8'))
+
+
+def test_basic_server(client):
+    send(client, {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1, 2]})
+    assert receive(client) == {'jsonrpc': '2.0', 'id': 1, 'result': 3}
+
+
+def test_pipelined_and_large_requests(client):
+    """ several requests in one write and requests exceeding the receive buffer """
+    big = 'x' * (1 << 20)
+    data = b''.join(
+        framing.pack_frame(json.dumps({'jsonrpc': '2.0', 'id': i, 'method': 'add',
+                                       'params': [big, str(i)]}).encode('utf8'))
+        for i in range(3))
+    # sending from another thread, the server already answers while we are still sending
+    threading.Thread(target=client.sendall, args=(data,), daemon=True).start()
+
+    reader = framing.FrameReader(client)
+    for i in range(3):
+        _, payload = reader.read_frame()
+        assert json.loads(str(payload, 'utf8'))['result'] == big + str(i)
+
+
+def test_parse_error(client):
+    client.sendall(framing.pack_frame(b'{not json'))
+    response = receive(client)
+    assert response['id'] is None
+    assert response['error']['code'] == -32700
+
+
+def test_batch_runs_concurrently(client):
+    batch = [{'jsonrpc': '2.0', 'id': i, 'method': 'slow_status', 'params': [str(i)]}
+             for i in range(10)]
+    start = time.monotonic()
+    send(client, batch)
+    response = receive(client)
+    assert time.monotonic() - start < 0.5
+    assert [entry['id'] for entry in response] == list(range(10))
+    assert response[3]['result'] == {'path': '3', 'synced': True}
+
+
+def test_batch_invalid_entries(client):
+    send(client, [1, {'jsonrpc': '2.0', 'id': 2, 'method': 'add', 'params': [1, 1]}])
+    invalid, valid = receive(client)
+    assert invalid['id'] is None
+    assert invalid['error']['code'] == -32600
+    assert valid['result'] == 2
+
+
+def test_empty_batch(client):
+    send(client, [])
+    assert receive(client)['error']['code'] == -32600
+
+
+def test_notifications_get_no_response(client, service, wait_until):
+    send(client, {'jsonrpc': '2.0', 'method': 'selection_changed', 'params': ['/a']})
+    send(client, [{'jsonrpc': '2.0', 'method': 'selection_changed', 'params': ['/b']},
+                  {'jsonrpc': '2.0', 'method': 'unknown'}])
+    send(client, {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1, 2]})
+    # the first response is the one of the request
+    assert receive(client) == {'jsonrpc': '2.0', 'id': 1, 'result': 3}
+
+    wait_until(lambda: len(service.events) >= 2)
+    assert service.events == ['/a', '/b']
+
+
+def test_notifications_in_batch(client):
+    send(client, [{'jsonrpc': '2.0', 'method': 'selection_changed', 'params': ['/a']},
+                  {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1, 2]}])
+    assert receive(client) == [{'jsonrpc': '2.0', 'id': 1, 'result': 3}]
+
+
+def test_pipelined_responses_out_of_order(serve, service):
+    client_socket = serve(RpcServer(transport=None, obj=service, pipelined=True))
+
+    with client_socket:
+        send(client_socket, {'jsonrpc': '2.0', 'id': 'slow', 'method': 'sleep',
+                             'params': [0.3]})
+        send(client_socket, {'jsonrpc': '2.0', 'id': 'fast', 'method': 'add',
+                             'params': [1, 2]})
+        reader = framing.FrameReader(client_socket)
+        ids = [json.loads(str(reader.read_frame()[1], 'utf8'))['id'] for _ in range(2)]
+    assert ids == ['fast', 'slow']
+
+
+def test_pipelined_answers_after_half_close(serve, service):
+    client_socket = serve(RpcServer(transport=None, obj=service, pipelined=True))
+
+    with client_socket:
+        send(client_socket, {'jsonrpc': '2.0', 'id': 1, 'method': 'sleep', 'params': [0.1]})
+        client_socket.shutdown(socket.SHUT_WR)
+        assert receive(client_socket)['result'] == 0.1
+
+
+class BlockingTransport:
+    """ fake transport whose first write blocks until released """
+
+    def __init__(self):
+        self.writes = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def send_buffers(self, buffers):
+        self.writing.set()
+        self.release.wait(5)
+        self.writes.append(b''.join(buffers))
+        return 1
+
+
+def test_responses_ready_while_writing_are_coalesced(wait_until):
+    from bourne_rpc.connection import Connection
+    from bourne_rpc.metrics import ServerMetrics
+    transport = BlockingTransport()
+    metrics = ServerMetrics()
+    connection = Connection(transport, metrics=metrics)
+    senders = [threading.Thread(target=connection.send, args=(b'first',))]
+    senders[0].start()
+    assert transport.writing.wait(5)
+    for count, message in enumerate((b'second', b'third'), 1):
+        senders.append(threading.Thread(target=connection.send, args=(message,)))
+        senders[-1].start()
+        wait_until(lambda: len(connection._pending) >= count)
+    transport.release.set()
+    for sender in senders:
+        sender.join(5)
+    assert transport.writes[0] == framing.pack_frame(b'first')
+    assert transport.writes[1] == (framing.pack_frame(b'second') +
+                                   framing.pack_frame(b'third'))
+    assert metrics.stats()['writes'] == 2
+    assert metrics.stats()['writes_per_frame'] == 2 / 3
+
+
+def test_flush_delay_only_while_other_responses_are_pending():
+    from bourne_rpc.connection import Connection
+    transport = BlockingTransport()
+    transport.release.set()
+    connection = Connection(transport, flush_delay=0.5)
+    connection.expect_response()
+    start = time.monotonic()
+    connection.send(b'alone')
+    assert time.monotonic() - start < 0.4
+
+    connection.expect_response()
+    start = time.monotonic()
+    connection.send(b'pipelined')
+    assert time.monotonic() - start >= 0.4
+    assert transport.writes == [framing.pack_frame(b'alone'),
+                                framing.pack_frame(b'pipelined')]
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_batch_is_not_delayed_by_flush_delay(serve, service, pipelined):
+    client_socket = serve(RpcServer(transport=None, obj=service, flush_delay=0.5,
+                                    pipelined=pipelined))
+    with client_socket:
+        start = time.monotonic()
+        send(client_socket, [{'jsonrpc': '2.0', 'id': i, 'method': 'add', 'params': [i, 1]}
+                             for i in range(3)])
+        assert [response['result'] for response in receive(client_socket)] == [1, 2, 3]
+        assert time.monotonic() - start < 0.4
@@ -0,0 +1,124 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from bourne_rpc import RpcClient, RpcServer, framing
+from bourne_rpc.transport import unix_domain_socket
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+@pytest.fixture
+def transports():
+    server_socket, client_socket = socket.socketpair(socket.AF_UNIX)
+    yield (unix_domain_socket.UnixSocket(None, sock=server_socket),
+           unix_domain_socket.UnixSocket(None, sock=client_socket))
+
+
+def test_frames_with_segments(transports):
+    sender, receiver = transports
+    big = os.urandom(3 * 1024 * 1024)
+    flags = framing.codec_flags(1)
+    for payload in (b'small', big, b'', big[:1024]):
+        framing.send_frame(sender, payload, flags, shm_threshold=1024)
+    sender.close()
+
+    reader = framing.FrameReader(receiver)
+    for payload in (b'small', big, b'', big[:1024]):
+        assert reader.read_frame() == (flags, payload)
+    assert reader.read_frame() is None
+
+
+def test_segment_is_passed_as_fd(transports):
+    sender, receiver = transports
+    framing.send_frame(sender, b'x' * 100, shm_threshold=10)
+    buffer = bytearray(100)
+    received, fds = receiver.recv_into_fds(buffer)
+    assert received == framing.HEADER.size + 8 and len(fds) == 1
+    os.close(fds[0])
+
+
+def test_fds_of_plain_frames_are_closed(transports):
+    sender, receiver = transports
+    read_fd, write_fd = os.pipe()
+    try:
+        sender.send_fds(framing.pack_frame(b'plain'), [read_fd])
+        framing.send_frame(sender, b'x' * 100, shm_threshold=10)
+        reader = framing.FrameReader(receiver)
+        assert reader.read_frame() == (0, b'plain')
+        assert len(reader._fds) <= 1
+        assert reader.read_frame() == (0, b'x' * 100)
+        assert not reader._fds
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_too_many_pending_fds(transports):
+    sender, receiver = transports
+    read_fd, write_fd = os.pipe()
+    try:
+        frame = framing.pack_frame(b'x' * 1000)
+        # the frame is split up, every part carries file descriptors
+        sender.socket.sendall(frame[:10])
+        for offset in range(10, 1000, 10):
+            sender.send_fds(frame[offset:offset + 10], [read_fd] * 4)
+        reader = framing.FrameReader(receiver)
+        with pytest.raises(ConnectionError):
+            reader.read_frame()
+        assert not reader._fds
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+class Service:
+    def echo(self, value):
+        return value
+
+
+def test_client_and_server(socket_path):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, Service(), shm_threshold=64 * 1024)
+    threading.Thread(target=server.serve, daemon=True).start()
+
+    value = 'ü' * (1024 * 1024)
+    with RpcClient(socket_path, pool_size=1, shm_threshold=64 * 1024,
+                   transport_class=unix_domain_socket.UnixSocket) as client:
+        assert client.call('echo', value) == value
+        assert client.call('echo', 'small') == 'small'
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif('not os.path.isdir("/proc/self/fd")')
+def test_server_closes_fds_of_plain_frames(socket_path):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, Service())
+    threading.Thread(target=server.serve, daemon=True).start()
+
+    sender = unix_domain_socket.UnixSocket.connect(socket_path)
+    reader = framing.FrameReader(sender)
+    read_fd, write_fd = os.pipe()
+    try:
+        request = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'echo',
+                              'params': ['x']}).encode()
+        sender.send_fds(framing.pack_frame(request), [read_fd])
+        assert reader.read_frame() is not None
+        before = open_fds()
+        for _ in range(50):
+            sender.send_fds(framing.pack_frame(request), [read_fd, write_fd])
+            assert reader.read_frame() is not None
+        assert open_fds() == before
+    finally:
+        sender.close()
+        os.close(read_fd)
+        os.close(write_fd)
+        server.shutdown()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import socket
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer
+from bourne_rpc.restart import LISTEN_FD_VARIABLE, inherited_socket, spawn_successor
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+class Service:
+    def __init__(self):
+        self.started = threading.Event()
+
+    def slow(self, seconds):
+        self.started.set()
+        time.sleep(seconds)
+        return seconds
+
+    def pid(self):
+        return os.getpid()
+
+
+def start_server(socket_path, service, **options):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+    transport = UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, service, **options)
+    serving = threading.Thread(target=server.serve, daemon=True)
+    serving.start()
+    return server, serving, RpcClient(socket_path, pool_size=1, timeout=5,
+                                      transport_class=UnixSocket)
+
+
+def test_shutdown_answers_requests_in_flight(socket_path):
+    service = Service()
+    server, serving, client = start_server(socket_path, service, pipelined=True)
+    idle_client = RpcClient(socket_path, pool_size=1, timeout=5,
+                            transport_class=type(server.transport))
+    with client, idle_client:
+        assert idle_client.call('pid') == os.getpid()
+        results = []
+        caller = threading.Thread(target=lambda: results.append(client.call('slow', 0.2)))
+        caller.start()
+        assert service.started.wait(5)
+
+        assert server.shutdown(drain_timeout=5)
+        caller.join(timeout=5)
+        assert results == [0.2]
+        serving.join(timeout=5)
+        assert not serving.is_alive()
+        assert server.connection_count == 0
+        # the listening socket is gone, reconnecting fails
+        with pytest.raises(OSError):
+            idle_client.call('pid')
+
+
+def test_shutdown_gives_up_after_drain_timeout(socket_path):
+    service = Service()
+    server, serving, client = start_server(socket_path, service, pipelined=True)
+    with client:
+        failed = []
+
+        def call():
+            try:
+                client.call('slow', 1)
+            except ConnectionError as e:
+                failed.append(e)
+
+        caller = threading.Thread(target=call, daemon=True)
+        caller.start()
+        assert service.started.wait(5)
+        start = time.monotonic()
+        assert not server.shutdown(drain_timeout=0.1)
+        assert time.monotonic() - start < 1
+        caller.join(timeout=5)
+        assert failed
+
+
+class AsyncService:
+    async def slow(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+
+def test_async_shutdown(socket_path):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+
+    async def main():
+        transport = UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, AsyncService(), pipelined=True)
+        await server.start()
+        client = AsyncRpcClient(socket_path, timeout=5)
+        try:
+            call = asyncio.ensure_future(client.call('slow', 0.1))
+            while not server.queue_depth:
+                await asyncio.sleep(0.01)
+            assert server.connection_count == 1
+            assert await server.shutdown(drain_timeout=5)
+            assert await call == 0.1
+            assert server.connection_count == 0
+
+            hanging = AsyncRpcClient(socket_path, timeout=5)
+            with pytest.raises(OSError):
+                await hanging.call('slow', 0)
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+SUCCESSOR = textwrap.dedent('''
+    import os, sys
+    sys.path.insert(0, {root!r})
+    from bourne_rpc import RpcServer
+    from bourne_rpc.restart import listening_transport
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+
+    class Service:
+        def pid(self):
+            return os.getpid()
+
+        def exit(self):
+            os._exit(0)
+
+    RpcServer(listening_transport(UnixSocket, {path!r}), Service()).serve()
+''')
+
+
+def test_hot_restart(socket_path):
+    server, serving, client = start_server(socket_path, Service())
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with client:
+        assert client.call('pid') == os.getpid()
+        successor = spawn_successor(server.transport, [
+            sys.executable, '-c', SUCCESSOR.format(root=root, path=socket_path)])
+        try:
+            assert server.shutdown(drain_timeout=5)
+            # the connection to the old server got closed, the client reconnects to the
+            # successor through the same socket
+            deadline = time.monotonic() + 10
+            while 1:
+                try:
+                    pid = client.call('pid')
+                    break
+                except ConnectionError:
+                    assert time.monotonic() < deadline
+                    time.sleep(0.05)
+            assert pid == successor.pid
+            client.notify('exit')
+            successor.wait(timeout=5)
+        finally:
+            successor.kill()
+            successor.wait()
+
+
+def test_inherited_socket_is_taken_from_environment():
+    assert inherited_socket({}) is None
+    original = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    environ = {LISTEN_FD_VARIABLE: str(os.dup(original.fileno()))}
+    with original, inherited_socket(environ) as sock:
+        assert sock.family == socket.AF_INET and sock.type == socket.SOCK_STREAM
+    assert LISTEN_FD_VARIABLE not in environ
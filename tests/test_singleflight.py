@@ -0,0 +1,136 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer, exceptions
+from bourne_rpc import codecs, rpc_method
+from bourne_rpc.singleflight import SingleFlight
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+def test_join_shares_future_until_it_landed():
+    flights = SingleFlight()
+    future = concurrent.futures.Future()
+    assert flights.join('key', lambda: future) is future
+    assert flights.join('key', concurrent.futures.Future) is future
+    future.set_result(1)
+    assert len(flights) == 0
+    assert flights.join('key', concurrent.futures.Future) is not future
+    assert flights.counters.stats() == {'calls': 2, 'collapsed': 1}
+
+
+class Service:
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    @rpc_method(single_flight=True)
+    def listing(self, path, depth=1):
+        self.calls.append(path)
+        self.release.wait(5)
+        return ['{}/{}'.format(path, depth)]
+
+
+def test_identical_calls_share_execution(socket_path, wait_until):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+    transport = UnixSocket(socket_path)
+    transport.bind()
+    service = Service()
+    server = RpcServer(transport, service, pipelined=True)
+    threading.Thread(target=server.serve, daemon=True).start()
+    with RpcClient(socket_path, pool_size=3, timeout=5,
+                   transport_class=UnixSocket) as client:
+        with concurrent.futures.ThreadPoolExecutor(6) as executor:
+            identical = [executor.submit(client.request, 'listing', params)
+                         for params in ({'path': '/a', 'depth': 1},
+                                        {'depth': 1, 'path': '/a'})]
+            identical += [executor.submit(client.request, 'listing', ['/a'])
+                          for _ in range(3)]
+            other = executor.submit(client.request, 'listing', ['/b'])
+            wait_until(lambda: len(service.calls) == 3 and
+                       server.flights.counters.collapsed == 3)
+            # the deadline of a single request does not fail the others
+            with pytest.raises(exceptions.RpcTimeoutError):
+                client.request('listing', ['/a'], timeout=0.05)
+            service.release.set()
+            assert [future.result() for future in identical] == [['/a/1']] * 5
+            assert other.result() == ['/b/1']
+        # named params in any order are the same call, positional ones another
+        assert sorted(service.calls) == ['/a', '/a', '/b']
+        assert server.stats()['single_flight'] == {'calls': 3, 'collapsed': 4}
+        # nothing is kept once the call finished
+        assert client.call('listing', '/a') == ['/a/1']
+        assert len(service.calls) == 4
+
+
+def no_key(*args):
+    raise TypeError('unorderable keys')
+
+
+def test_params_without_key_are_not_shared(monkeypatch):
+    service = Service()
+    service.release.set()
+    server = RpcServer(transport=None, obj=service)
+    monkeypatch.setattr(server.cache, 'key', no_key)
+    request = {'jsonrpc': '2.0', 'id': 1, 'method': 'listing', 'params': ['/a']}
+    for _ in range(2):
+        response = server.handle_request(request, codecs.JsonCodec()).result(timeout=5)
+        assert response['result'] == ['/a/1']
+    assert len(service.calls) == 2
+    assert server.flights.counters.stats() == {'calls': 0, 'collapsed': 0}
+
+
+class AsyncService:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    @rpc_method(single_flight=True)
+    async def listing(self, path):
+        self.calls += 1
+        await self.release.wait()
+        return [path]
+
+
+def test_async_identical_calls_share_execution(socket_path):
+    from bourne_rpc.transport.unix_domain_socket import UnixSocket
+
+    async def main():
+        transport = UnixSocket(socket_path)
+        transport.bind()
+        service = AsyncService()
+        server = AsyncRpcServer(transport, service, pipelined=True)
+        await server.start()
+        client = AsyncRpcClient(socket_path, timeout=5)
+        try:
+            calls = [asyncio.ensure_future(client.call('listing', '/a'))
+                     for _ in range(3)]
+            while server.flights.counters.collapsed < 2:
+                await asyncio.sleep(0.01)
+            with pytest.raises(exceptions.RpcTimeoutError):
+                await client.request('listing', ['/a'], timeout=0.05)
+            service.release.set()
+            assert await asyncio.gather(*calls) == [['/a']] * 3
+            assert service.calls == 1
+        finally:
+            await client.close()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_async_params_without_key_are_not_shared(monkeypatch):
+    async def main():
+        service = AsyncService()
+        service.release.set()
+        server = AsyncRpcServer(transport=None, obj=service)
+        monkeypatch.setattr(server.cache, 'key', no_key)
+        request = {'jsonrpc': '2.0', 'id': 1, 'method': 'listing', 'params': ['/a']}
+        response = await server.handle_request(request, codecs.JsonCodec())
+        assert response['result'] == ['/a']
+        assert server.flights.counters.calls == 0
+
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer, exceptions
+from bourne_rpc.streaming import chunked
+from bourne_rpc.transport import unix_domain_socket
+
+pytestmark = pytest.mark.skipif('sys.platform == "win32"')
+
+
+def test_chunks_grow():
+    assert [len(chunk) for chunk in chunked(range(20), max_size=4)] == [1, 2, 4, 4, 4, 4, 1]
+
+
+class Service:
+    def __init__(self):
+        self.closed = threading.Event()
+        self.produced = 0
+
+    def listdir(self, count):
+        try:
+            for i in range(count):
+                yield {'name': 'file{}'.format(i)}
+        finally:
+            self.closed.set()
+
+    def failing(self):
+        yield 1
+        raise ValueError('broken')
+
+    def blobs(self, count):
+        for _ in range(count):
+            self.produced += 1
+            yield 'x' * 1000
+
+    def add(self, a, b):
+        return a + b
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def client(socket_path, service):
+    transport = unix_domain_socket.UnixSocket(socket_path)
+    transport.bind()
+    server = RpcServer(transport, service, stream_chunk_size=64)
+    threading.Thread(target=server.serve, daemon=True).start()
+
+    with RpcClient(socket_path, pool_size=1, timeout=5,
+                   transport_class=unix_domain_socket.UnixSocket) as client:
+        yield client
+
+
+def test_stream(client):
+    items = list(client.stream('listdir', [1000]))
+    assert items == [{'name': 'file{}'.format(i)} for i in range(1000)]
+    assert list(client.stream('listdir', [0])) == []
+
+
+def test_stream_error(client):
+    items = []
+    with pytest.raises(exceptions.RpcError):
+        for item in client.stream('failing'):
+            items.append(item)
+    assert items == [1]
+
+
+def test_abandoned_stream_stops_the_method(client, service):
+    for _ in client.stream('listdir', [10 ** 7]):
+        break
+    client.close()
+    assert service.closed.wait(5)
+
+
+def test_slow_consumer_holds_up_the_method(socket_path, serve_socket, service):
+    serve_socket(service, stream_chunk_size=64)
+    with RpcClient(socket_path, pool_size=1, timeout=5, stream_queue_size=2,
+                   transport_class=unix_domain_socket.UnixSocket) as client:
+        items = client.stream('blobs', [5000])
+        next(items)
+        time.sleep(0.5)
+        # two chunks queued and what fits into the socket buffers
+        assert service.produced < 2500
+        assert sum(1 for _ in items) == 4999
+
+        # a stream abandoned with a full queue does not block the connection
+        for _ in client.stream('blobs', [5000]):
+            time.sleep(0.2)
+            break
+        assert client.call('add', 1, 2) == 3
+
+
+class AsyncService:
+    async def listdir(self, count):
+        for i in range(count):
+            await asyncio.sleep(0)
+            yield i
+
+
+def test_async_stream(socket_path):
+    async def main():
+        transport = unix_domain_socket.UnixSocket(socket_path)
+        transport.bind()
+        server = AsyncRpcServer(transport, AsyncService())
+        await server.start()
+        try:
+            async with AsyncRpcClient(socket_path) as client:
+                assert [i async for i in client.stream('listdir', [500])] == list(range(500))
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
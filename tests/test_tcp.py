@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import socket
+import threading
+
+import pytest
+
+from bourne_rpc import AsyncRpcClient, AsyncRpcServer, RpcClient, RpcServer, TcpSocket
+from bourne_rpc import framing
+from bourne_rpc.transport.tcp_socket import parse_address
+
+
+class Service:
+    def add(self, a, b):
+        return a + b
+
+
+def test_parse_address():
+    assert parse_address('127.0.0.1:8000') == ('127.0.0.1', 8000)
+    assert parse_address('[::1]:8000') == ('::1', 8000)
+    assert parse_address(('localhost', '8000')) == ('localhost', 8000)
+
+
+def test_rpc_over_tcp():
+    transport = TcpSocket(('127.0.0.1', 0))
+    transport.bind()
+    threading.Thread(target=RpcServer(transport, Service()).serve, daemon=True).start()
+
+    with RpcClient(transport.bound_address, transport_class=TcpSocket) as client:
+        assert client.call('add', 1, 2) == 3
+        big = 'x' * (1024 * 1024)
+        assert client.call('add', big, 'y') == big + 'y'
+        sock = next(connection for connection in client._connections
+                    if connection).transport.socket
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+
+@pytest.mark.parametrize('server_class', [RpcServer, AsyncRpcServer])
+def test_too_long_frame_closes_connection(server_class):
+    transport = TcpSocket(('127.0.0.1', 0))
+    transport.bind()
+    server = server_class(transport, Service(), max_frame_size=1024)
+    if server_class is RpcServer:
+        threading.Thread(target=server.serve, daemon=True).start()
+    else:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+
+    try:
+        with socket.create_connection(transport.bound_address, timeout=5) as sock:
+            # announcing 256 MiB, the server must neither wait for nor allocate them
+            sock.sendall(framing.pack_header(framing.LENGTH_MASK))
+            assert sock.recv(1) == b''
+        with RpcClient(transport.bound_address, transport_class=TcpSocket) as client:
+            assert client.call('add', 1, 2) == 3
+            with pytest.raises(ConnectionError):
+                client.call('add', 'x' * 2048, 'y')
+    finally:
+        if server_class is RpcServer:
+            server.stop()
+        else:
+            asyncio.run_coroutine_threadsafe(server.stop(), loop).result(5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+
+
+@pytest.mark.skipif('not hasattr(socket, "SO_REUSEPORT")')
+def test_reuse_port():
+    first = TcpSocket(('127.0.0.1', 0), reuse_port=True)
+    first.bind()
+    second = TcpSocket(first.bound_address, reuse_port=True)
+    second.bind()
+    assert second.bound_address == first.bound_address
+    first.close()
+    second.close()
+
+
+def test_async_server_over_tcp():
+    async def main():
+        transport = TcpSocket(('127.0.0.1', 0))
+        transport.bind()
+        server = AsyncRpcServer(transport, Service())
+        await server.start()
+        try:
+            connect = functools.partial(asyncio.open_connection, *transport.bound_address)
+            async with AsyncRpcClient(None, connect=connect) as client:
+                assert await client.call('add', 1, 2) == 3
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
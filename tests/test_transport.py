@@ -2,16 +2,20 @@ import pytest
 import multiprocessing
 import time
 import socket
+import sys
+import threading
 from contextlib import suppress
 import os
 
-from bourne_rpc import StreamingTransport, get_transport_path
+from bourne_rpc import StreamingTransport, framing, get_transport_path
 
-TEST_UNIX_SOCKET_PATH = r"./test_unix_socket"
 TEST_PIPE_NAME = r'\\.\pipe\testpipe'
 ECHO_SERVER_BYTES = 10
 ECHO_SERVER_ACCEPTED = 2
 
+if sys.platform != 'win32':
+    from bourne_rpc.transport import unix_domain_socket
+
 
 def echo_server_loop(transport_path):
     """ generates an echo server that returns all received messages with an appropriate
@@ -31,9 +35,16 @@ def echo_server_loop(transport_path):
 
 
 @pytest.fixture
-def echo_server():
-    transport_path = get_transport_path(application_id='com.crosscloud.unittest')
-    return transport_path, multiprocessing.Process(target=echo_server_loop, args=[transport_path])
+def echo_server(tmp_path):
+    if sys.platform == 'win32':
+        transport_path = get_transport_path(application_id='com.crosscloud.unittest')
+    else:
+        transport_path = os.path.join(str(tmp_path), 'unix_socket')
+    process = multiprocessing.Process(target=echo_server_loop, args=[transport_path])
+    yield transport_path, process
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
 
 
 @pytest.mark.skipif('sys.platform == "win32"')
@@ -45,6 +56,7 @@ def test_connect_unix_socket(echo_server):
     :param echo_server: a server instance on that transport returning all messages sent
     to it
     """
+    transport_path, echo_server = echo_server
     # starting server
     echo_server.start()
 
@@ -52,7 +64,7 @@ def test_connect_unix_socket(echo_server):
         time.sleep(.5)
         # opening and connecting to unix socket
         socket_client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        socket_client.connect(TEST_UNIX_SOCKET_PATH)
+        socket_client.connect(transport_path)
 
         # generating test content to send and get back
         test_content = bytearray(range(ECHO_SERVER_BYTES))
@@ -66,21 +78,58 @@ def test_connect_unix_socket(echo_server):
 
 
 @pytest.mark.skipif('sys.platform == "win32"')
-def test_unix_socket_file_there():
+def test_unix_socket_file_there(socket_path):
     """ tests that unix socket is able to handle already existing socket file"""
     with suppress(OSError):
         # deleting unix socket file if exists
-        os.unlink(TEST_UNIX_SOCKET_PATH)
+        os.unlink(socket_path)
 
-    with open(TEST_UNIX_SOCKET_PATH, 'w') as output_file:
+    with open(socket_path, 'w') as output_file:
         output_file.write('I am wrong content in the unix socket file')
 
     # creating unix domain socket -> this deletes the path, throws exception if problem
-    unix_domain_socket.UnixSocket(path=TEST_UNIX_SOCKET_PATH,
-                                  application_id='test_application')
-
-
-@pytest.mark.skipif('sys.platform == "darwin"')
+    unix_domain_socket.UnixSocket(path=socket_path).bind()
+
+
+@pytest.mark.skipif('not sys.platform.startswith("linux")')
+@pytest.mark.parametrize('options', [{}, {'seqpacket': True},
+                                     {'seqpacket': True, 'send_buffer_size': 16 * 1024},
+                                     {'send_buffer_size': 16 * 1024,
+                                      'receive_buffer_size': 16 * 1024}])
+def test_unix_socket_options(options):
+    """ frames of all sizes pass sockets in the abstract namespace with all options """
+    path = '\0bourne_rpc_test.{}'.format(os.getpid())
+    server = unix_domain_socket.UnixSocket(path, **options)
+    server.bind()
+    payloads = [b'', b'small', os.urandom(200 * 1024)] * 2
+
+    def echo():
+        connection, _ = server.accept()
+        reader = framing.FrameReader(connection)
+        for _ in payloads:
+            flags, payload = reader.read_frame()
+            framing.send_frame(connection, bytes(payload), flags)
+
+    thread = threading.Thread(target=echo, daemon=True)
+    thread.start()
+    client = unix_domain_socket.UnixSocket.connect(path, **options)
+    if options.get('send_buffer_size'):
+        # the kernel doubles the value for its bookkeeping
+        assert client.socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= \
+            options['send_buffer_size']
+    sender = threading.Thread(target=lambda: [framing.send_frame(client, payload)
+                                              for payload in payloads], daemon=True)
+    sender.start()
+
+    reader = framing.FrameReader(client)
+    for payload in payloads:
+        assert reader.read_frame() == (0, payload)
+    thread.join(timeout=5)
+    client.close()
+    server.close()
+
+
+@pytest.mark.skipif('sys.platform != "win32"')
 def test_connect_named_pipes(echo_server):
     """
     Tests a transport (named pipes) by opening a connection to an echo server, sending
@@ -110,8 +159,8 @@ def test_connect_named_pipes(echo_server):
         assert test_content == result
 
 
-@pytest.mark.skipif('sys.platform == "darwin"')
-def test_generate_path_named_pipes(echo_server):
+@pytest.mark.skipif('sys.platform != "win32"')
+def test_generate_path_named_pipes():
     """tests if the generated path for the transport matches the expected format"""
     application_id = 'test_application_id.test'
     testuser_id = 'testymctestface'
@@ -123,8 +172,8 @@ def test_generate_path_named_pipes(echo_server):
     assert path == reference
 
 
-@pytest.mark.skipif('sys.platform == "win32"')
-def test_generate_path_unix_path(echo_server):
+@pytest.mark.skipif('sys.platform != "darwin"')
+def test_generate_path_unix_path():
     """tests if the generated path for the transport matches the expected format"""
     application_id = 'test_application_id.test'
     path = get_transport_path(application_id=application_id)
@@ -133,3 +182,16 @@ def test_generate_path_unix_path(echo_server):
                              application_id, 'unix_socket')
 
     assert path == reference
+
+
+@pytest.mark.skipif('not sys.platform.startswith("linux")')
+def test_generate_path_linux(monkeypatch):
+    """tests the runtime directory and the abstract namespace fallback on linux"""
+    application_id = 'test_application_id.test'
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    assert get_transport_path(application_id) == os.path.join(
+        '/run/user/1000', application_id, 'unix_socket')
+
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert get_transport_path(application_id) == '\0{}.{}'.format(application_id,
+                                                                   os.getuid())
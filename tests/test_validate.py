@@ -7,12 +7,23 @@ from bourne_rpc import server, exceptions
     {},
     {'jsonrpc': '123'},
     {'jsonrpc': '2.0'},
-    {'jsonrpc': '2.0', 'method': 'hello'},
     {'jsonrpc': '2.0', 'id': 123},
     {'method': 'hello'},
     {'method': 'hello', 'id': 123},
     {'id': 123},
+    [],
+    'hello',
 ])
 def test_validation(req):
     with pytest.raises(exceptions.InvalidRequestError):
         server.validate_request(req)
+
+
+@pytest.mark.parametrize("req", [
+    {'jsonrpc': '2.0', 'method': 'hello', 'id': 123},
+    {'jsonrpc': '2.0', 'method': 'hello', 'id': None},
+    {'jsonrpc': '2.0', 'method': 'hello', 'params': [1]},
+    {'jsonrpc': '2.0', 'method': 'hello'},
+])
+def test_valid(req):
+    server.validate_request(req)